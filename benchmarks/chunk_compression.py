@@ -0,0 +1,103 @@
+"""
+Compares the chunk codecs (plain, gzip, zstd) and coordinate rounding: size on disk, writing
+throughput (serialization, compression, write) and streaming read throughput (decompression
+and parsing of every line).
+
+The features are those of the fake map server (all the fields of metadata/buildings_metadata.json,
+with longitude/latitude footprints reprojected at full float precision, as the client-side
+reprojection writes them). Run from the repository root:
+
+    python benchmarks/chunk_compression.py --n-features 50000
+"""
+import sys
+sys.path.append('.')
+from lib import *
+
+from checker import fastjson
+from fake_arcgis import FakeLayer
+from lib.compression import zstandard
+
+import argparse
+import shutil
+import tempfile
+import time
+
+# (codec, level), None levels being the defaults of the ChunkWriter
+CODECS = [(None, None), ('gzip', 1), ('gzip', None), ('gzip', 9), ('zstd', 3), ('zstd', None), ('zstd', 19)]
+
+
+def fake_features(n_features):
+    layer = FakeLayer(n_features=n_features)
+
+    for attributes, ring in zip(layer.attributes, layer.rings['4326'].tolist()):
+        yield {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [ring]}, 'properties': attributes}
+
+
+def write_chunks(features, outfolderpath, chunksize, compression, level, precision):
+    extension = chunk_extension(compression)
+    filepaths = []
+
+    for start in range(0, len(features), chunksize):
+        filepath = os.path.join(outfolderpath, f'bench_chunk_{start // chunksize}{extension}')
+
+        with ChunkWriter(filepath, fsync=False, level=level) as writer:
+            for feature in features[start:start + chunksize]:
+                writer.write(serialize_feature(feature, precision))
+
+        filepaths.append(filepath)
+
+    return filepaths
+
+
+def read_chunks(filepaths):
+    return sum(1 for filepath in filepaths for line in iter_chunk_lines(filepath) if fastjson.loads(line))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the chunk codecs on fake building features.')
+    parser.add_argument('--n-features', type=int, default=50000,
+                        help='Number of features (default: 50000)')
+    parser.add_argument('--chunksize', type=int, default=1000,
+                        help='Number of features per chunk (default: 1000)')
+    parser.add_argument('--precision', type=int, default=7,
+                        help='Decimals of the rounded runs (default: 7)')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Directory for the temporary chunks (default: system temp)')
+
+    args = parser.parse_args()
+
+    features = list(fake_features(args.n_features))
+    codecs = [(codec, level) for codec, level in CODECS if codec != 'zstd' or zstandard is not None]
+
+    if len(codecs) < len(CODECS):
+        print("zstandard is not installed, skipping zstd")
+
+    print(f"{'codec':<10} {'level':>5} {'precision':>9} {'size (MB)':>10} {'ratio':>6} {'write (feat/s)':>15} {'read (feat/s)':>14}")
+
+    plain_size = None
+
+    for precision in [None, args.precision]:
+        for codec, level in codecs:
+            outfolderpath = tempfile.mkdtemp(prefix='bench_codec_', dir=args.workdir)
+
+            try:
+                start = time.perf_counter()
+                filepaths = write_chunks(features, outfolderpath, args.chunksize, codec, level, precision)
+                write_seconds = time.perf_counter() - start
+
+                size = sum(os.path.getsize(filepath) for filepath in filepaths)
+
+                start = time.perf_counter()
+                n_read = read_chunks(filepaths)
+                read_seconds = time.perf_counter() - start
+            finally:
+                shutil.rmtree(outfolderpath)
+
+            assert n_read == len(features)
+
+            # ratios relative to the plain, unrounded chunks
+            plain_size = plain_size or size
+            level = level if level is not None else DEFAULT_LEVELS.get(codec, '-')
+
+            print(f"{codec or 'plain':<10} {level:>5} {precision if precision is not None else '-':>9} {size / 1e6:>10.2f} {plain_size / size:>6.1f} "
+                  f"{len(features) / write_seconds:>15,.0f} {len(features) / read_seconds:>14,.0f}")
@@ -0,0 +1,76 @@
+"""
+Records the peak RSS of the in-memory (silly_dumper) and streaming (streaming_dumper) GeoParquet
+paths on a synthetic, reprojected feature stream. Each mode runs in its own child process, so
+the peaks do not contaminate each other.
+
+Run from the repository root:
+
+    python benchmarks/dumper_memory.py --n-features 200000 --batch-size 10000
+"""
+import sys
+sys.path.append('.')
+from lib import *
+
+from synthetic import synthetic_features
+
+import argparse
+import resource
+import subprocess
+import tempfile
+import time
+
+MODES = ['silly', 'streaming']
+
+
+def run_mode(mode, n_features, batch_size, outpath):
+    layer_metadata = read_json('metadata/buildings_metadata.json')
+    features = synthetic_features(n_features, projected=True)
+
+    if mode == 'silly':
+        # the same steps as silly_dumper, with the synthetic stream in place of the EsriDumper
+        all_feats = [feature for feature in features]
+        as_gdf = gpd.GeoDataFrame.from_features(all_feats, crs=DEFAULT_CRS).to_crs(OSM_CRS)
+        as_gdf.to_parquet(outpath)
+    else:
+        schema = arrow_schema_from_metadata(layer_metadata)
+        write_geoparquet_stream(features, outpath, schema, batch_size=batch_size, different_crs=DEFAULT_CRS)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the peak memory of the GeoParquet dumpers.')
+    parser.add_argument('--n-features', type=int, default=200000,
+                        help='Number of synthetic features (default: 200000)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Batch size of the streaming mode (default: 10000)')
+    parser.add_argument('--mode', choices=MODES, default=None,
+                        help='Run a single mode in this process (used internally)')
+    parser.add_argument('--outpath', type=str, default=None,
+                        help='Output file of the single mode run (used internally)')
+
+    args = parser.parse_args()
+
+    if args.mode:
+        start = time.perf_counter()
+        run_mode(args.mode, args.n_features, args.batch_size, args.outpath)
+        print(json.dumps({'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}))
+        sys.exit(0)
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode in MODES:
+            output = subprocess.run([sys.executable, __file__, '--mode', mode,
+                                     '--n-features', str(args.n_features),
+                                     '--batch-size', str(args.batch_size),
+                                     '--outpath', os.path.join(tmpdir, f'{mode}.parquet')],
+                                    check=True, capture_output=True, text=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+            print(f"{mode}: peak RSS {results[mode]['peak_rss_mb']:.0f} MB, {results[mode]['seconds']:.1f} s")
+
+    print(f"peak RSS ratio (silly / streaming): {results['silly']['peak_rss_mb'] / results['streaming']['peak_rss_mb']:.1f}x")
@@ -0,0 +1,426 @@
+"""
+Local stand-in for the ArcGIS REST MapServer of the Geocuritiba portal, for the benchmarks.
+
+It serves synthetic polygon layers shaped like metadata/buildings_metadata.json (same fields,
+attribute values drawn from metadata/unique_building_values.json), and answers the queries the
+dumpers send: layer metadata, counts, objectid lists and statistics, objectid where clauses,
+offsets and keyset pages, outFields, outSR (the layer CRS or EPSG:4326), geometryPrecision and
+envelope filters. Latency, page limits and injected errors (random, or scripted per query) are
+configurable.
+
+Protocol buffer (f=pbf) responses are not implemented, so the layers do not announce them.
+
+    with FakeArcGISServer({'72': FakeLayer(n_features=10000, latency=0.05)}) as server:
+        use_fake_server(server)
+        geojsonl_lazy_dumper('buildings', outfolderpath=...)
+"""
+import sys
+sys.path.append('.')
+
+import json
+import random
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from pyproj import Transformer
+
+SOURCE_WKID = 31982
+
+# how long a 'timeout' fault keeps the client waiting, in seconds
+FAULT_DELAY = 3.0
+
+CLAUSE_PATTERN = re.compile(r'^(\w+)\s*(>=|<=|>|<|=)\s*(-?\d+)$')
+IN_PATTERN = re.compile(r'^(\w+)\s+IN\s*\(([\d,\s]*)\)$', re.IGNORECASE)
+BETWEEN_PATTERN = re.compile(r'(\w+)\s+BETWEEN\s+(-?\d+)\s+AND\s+(-?\d+)', re.IGNORECASE)
+
+
+def random_value(field, rng, unique_values):
+    """
+    Draws a plausible value for a field of the layer.
+    """
+    name, field_type = field['name'], field['type']
+
+    if name in unique_values:
+        return rng.choice(unique_values[name])
+
+    if field_type == 'esriFieldTypeString':
+        return rng.choice([None, f'{name.upper()}_{rng.randint(1, 20)}'])
+    if field_type == 'esriFieldTypeDouble':
+        return rng.choice([None, round(rng.uniform(0, 100), 3)])
+    if field_type in ('esriFieldTypeSmallInteger', 'esriFieldTypeInteger'):
+        return rng.choice([None, rng.randint(0, 9999)])
+
+    return None
+
+
+def _strip_parentheses(clause):
+    # the unbalanced ones left by splitting '(a AND b)', then the enclosing pairs
+    clause = clause.strip()
+    while clause.startswith('(') and clause.count('(') > clause.count(')'):
+        clause = clause[1:].strip()
+    while clause.endswith(')') and clause.count(')') > clause.count('('):
+        clause = clause[:-1].strip()
+    while clause.startswith('(') and clause.endswith(')'):
+        clause = clause[1:-1].strip()
+
+    return clause
+
+
+class FakeLayer:
+    """
+    A synthetic polygon layer.
+
+    Args:
+        n_features (int, optional): The number of features. Defaults to 10000.
+        metadata_path (str, optional): The layer metadata to imitate. Defaults to 'metadata/buildings_metadata.json'.
+        unique_values_path (str, optional): The attribute values to draw from.
+                                            Defaults to 'metadata/unique_building_values.json'.
+        max_record_count (int, optional): The page limit of the layer. Defaults to None (the metadata one).
+        latency (float, optional): The fixed delay of each query, in seconds. Defaults to 0.
+        latency_per_feature (float, optional): The additional delay per returned feature, in seconds. Defaults to 0.
+        error_rate (float, optional): The probability of a query failing. Defaults to 0.
+        error_status (int, optional): The HTTP status of the failures; 200 returns an Esri error
+                                      payload instead. Defaults to 503.
+        gap_rate (float, optional): The probability of skipping an objectid (deleted features). Defaults to 0.
+        seed (int, optional): The random seed. Defaults to 0.
+        faults (callable, optional): Scripted failures: called with the arguments of each query,
+                                     it returns None to answer normally, the HTTP status to
+                                     fail with (200 for an Esri error payload), 'truncated' (the
+                                     answer cut in half) or 'timeout' (the answer sent after
+                                     FAULT_DELAY seconds). Defaults to None.
+        pagination (bool, optional): Whether the metadata advertises pagination. Defaults to True.
+        order_by (bool, optional): Whether the metadata advertises orderByFields. Defaults to True.
+        unordered (bool, optional): Whether the queries without orderByFields are answered in
+                                    a fixed order unrelated to the objectids, as servers may
+                                    (offsets included). Defaults to False.
+    """
+    def __init__(self, n_features=10000, metadata_path='metadata/buildings_metadata.json',
+                 unique_values_path='metadata/unique_building_values.json', max_record_count=None,
+                 latency=0.0, latency_per_feature=0.0, error_rate=0.0, error_status=503, gap_rate=0.0, seed=0, faults=None,
+                 pagination=True, order_by=True, unordered=False):
+        with open(metadata_path, encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        with open(unique_values_path, encoding='utf-8') as f:
+            unique_values = json.load(f)
+
+        # no protocol buffers here
+        self.metadata['supportedQueryFormats'] = 'JSON, geoJSON'
+        if max_record_count:
+            self.metadata['maxRecordCount'] = max_record_count
+
+        capabilities = self.metadata.setdefault('advancedQueryCapabilities', {})
+        capabilities.update({'supportsPagination': pagination, 'supportsOrderBy': order_by})
+        self.metadata.pop('supportsPagination', None)
+
+        self.max_record_count = self.metadata['maxRecordCount']
+        self.latency = latency
+        self.latency_per_feature = latency_per_feature
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.faults = faults
+        self.unordered = unordered
+
+        self.oid_field = next(field['name'] for field in self.metadata['fields'] if field['type'] == 'esriFieldTypeOID')
+        attribute_fields = [field for field in self.metadata['fields']
+                            if field['type'] not in ('esriFieldTypeOID', 'esriFieldTypeGeometry')]
+
+        rng = random.Random(seed)
+        self._rng = random.Random(seed + 1)
+        self._lock = threading.Lock()
+
+        oids = []
+        oid = 0
+        while len(oids) < n_features:
+            oid += 1
+            if gap_rate and rng.random() < gap_rate:
+                continue
+            oids.append(oid)
+        self.oids = np.array(oids, dtype=np.int64)
+        # the storage order of the unordered answers
+        self._storage_rank = np.random.default_rng(seed).permutation(len(oids))
+
+        # rectangular footprints over the layer extent, in its CRS (meters)
+        extent = self.metadata['extent']
+        x = np.array([rng.uniform(extent['xmin'], extent['xmax'] - 30) for _ in oids])
+        y = np.array([rng.uniform(extent['ymin'], extent['ymax'] - 30) for _ in oids])
+        dx = np.array([rng.uniform(5, 25) for _ in oids])
+        dy = np.array([rng.uniform(5, 25) for _ in oids])
+
+        ring_x = np.stack([x, x + dx, x + dx, x, x], axis=1)
+        ring_y = np.stack([y, y, y + dy, y + dy, y], axis=1)
+        self.rings = {str(SOURCE_WKID): np.stack([ring_x, ring_y], axis=2)}
+
+        lon, lat = Transformer.from_crs(f'EPSG:{SOURCE_WKID}', 'EPSG:4326', always_xy=True).transform(ring_x, ring_y)
+        self.rings['4326'] = np.stack([lon, lat], axis=2)
+        self.bounds_lonlat = np.stack([lon.min(axis=1), lat.min(axis=1), lon.max(axis=1), lat.max(axis=1)], axis=1)
+
+        self.attributes = []
+        for oid, cx, cy in zip(oids, x + dx / 2, y + dy / 2):
+            attributes = {self.oid_field: oid}
+            for field in attribute_fields:
+                attributes[field['name']] = random_value(field, rng, unique_values)
+            for name, value in (('x_coord', cx), ('y_coord', cy)):
+                if name in attributes:
+                    attributes[name] = round(float(value), 3)
+            self.attributes.append(attributes)
+
+        self.n_queries = 0
+        self.n_errors = 0
+
+    def _where_mask(self, where):
+        if not where:
+            return np.ones(len(self.oids), dtype=bool)
+
+        where = BETWEEN_PATTERN.sub(r'\1 >= \2 AND \1 <= \3', where)
+
+        # only flat 'a AND b OR c AND d' combinations, enough for the dumpers and esridump
+        mask = np.zeros(len(self.oids), dtype=bool)
+        for conjunction in re.split(r'\s+OR\s+', where, flags=re.IGNORECASE):
+            mask |= self._conjunction_mask(conjunction)
+
+        return mask
+
+    def _conjunction_mask(self, where):
+        mask = np.ones(len(self.oids), dtype=bool)
+
+        for clause in re.split(r'\s+AND\s+', where, flags=re.IGNORECASE):
+            clause = _strip_parentheses(clause)
+
+            if clause in ('', '1=1'):
+                continue
+
+            match = IN_PATTERN.match(clause)
+            if match and match[1] == self.oid_field:
+                values = [int(value) for value in match[2].split(',') if value.strip()]
+                mask &= np.isin(self.oids, values)
+                continue
+
+            match = CLAUSE_PATTERN.match(clause)
+            if not match or match[1] != self.oid_field:
+                raise ValueError(f"Unsupported where clause: {clause}")
+
+            value = int(match[3])
+            mask &= {'>': self.oids > value, '>=': self.oids >= value, '<': self.oids < value,
+                     '<=': self.oids <= value, '=': self.oids == value}[match[2]]
+
+        return mask
+
+    def _envelope_mask(self, query):
+        geometry = json.loads(query['geometry'])
+        if str(query.get('inSR', '4326')) != '4326':
+            raise ValueError("Only EPSG:4326 envelopes are supported")
+
+        bounds = self.bounds_lonlat
+        return ((bounds[:, 2] >= geometry['xmin']) & (bounds[:, 0] <= geometry['xmax']) &
+                (bounds[:, 3] >= geometry['ymin']) & (bounds[:, 1] <= geometry['ymax']))
+
+    def query(self, query):
+        """
+        Answers a query.
+
+        Args:
+            query (dict): The query arguments.
+
+        Returns:
+            tuple: The (HTTP status, JSON payload, delay in seconds) of the response.
+        """
+        fault = self.faults(query) if self.faults is not None else None
+
+        with self._lock:
+            self.n_queries += 1
+            if fault is None and self.error_rate and self._rng.random() < self.error_rate:
+                fault = self.error_status
+            if fault is not None:
+                self.n_errors += 1
+
+        if fault == 'truncated':
+            status, payload, delay = self._answer(query)
+            body = json.dumps(payload).encode('utf-8')
+            return status, body[:len(body) // 2], delay
+
+        if fault == 'timeout':
+            status, payload, delay = self._answer(query)
+            return status, payload, delay + FAULT_DELAY
+
+        if fault is not None:
+            if fault == 200:
+                return 200, {'error': {'code': 500, 'message': 'Injected error', 'details': []}}, self.latency
+            return fault, {'error': {'code': fault, 'message': 'Injected error', 'details': []}}, self.latency
+
+        return self._answer(query)
+
+    def _answer(self, query):
+        try:
+            mask = self._where_mask(query.get('where'))
+            if query.get('geometry'):
+                mask &= self._envelope_mask(query)
+        except ValueError as e:
+            return 200, {'error': {'code': 400, 'message': str(e), 'details': [str(e)]}}, self.latency
+
+        indexes = np.flatnonzero(mask)
+        if self.unordered and not query.get('orderByFields'):
+            indexes = indexes[np.argsort(self._storage_rank[indexes], kind='stable')]
+
+        if query.get('outStatistics'):
+            attributes = {}
+            for statistic in json.loads(query['outStatistics']):
+                values = self.oids[indexes]
+                attributes[statistic['outStatisticFieldName']] = int(values.min() if statistic['statisticType'] == 'min' else values.max()) if len(values) else None
+            return 200, {'features': [{'attributes': attributes}]}, self.latency
+
+        if str(query.get('returnCountOnly')).lower() == 'true':
+            return 200, {'count': len(indexes)}, self.latency
+
+        if str(query.get('returnIdsOnly')).lower() == 'true':
+            return 200, {'objectIdFieldName': self.oid_field, 'objectIds': self.oids[indexes].tolist()}, self.latency
+
+        offset = int(query.get('resultOffset') or 0)
+        count = min(int(query.get('resultRecordCount') or self.max_record_count), self.max_record_count)
+        page = indexes[offset:offset + count]
+        exceeded = offset + count < len(indexes)
+
+        out_fields = query.get('outFields') or '*'
+        keep = None if out_fields == '*' else set(out_fields.split(',')) | {self.oid_field}
+
+        out_sr = str(query.get('outSR') or SOURCE_WKID)
+        out_sr = json.loads(out_sr).get('wkid') if out_sr.startswith('{') else out_sr
+        rings = self.rings[str(SOURCE_WKID) if str(out_sr) == str(SOURCE_WKID) else '4326']
+
+        precision = query.get('geometryPrecision')
+        return_geometry = str(query.get('returnGeometry', 'true')).lower() != 'false'
+
+        if return_geometry:
+            page_rings = rings[page]
+            if precision not in (None, ''):
+                page_rings = np.round(page_rings, int(precision))
+            page_rings = page_rings.tolist()
+
+        features = []
+        for position, index in enumerate(page):
+            attributes = self.attributes[index]
+            if keep is not None:
+                attributes = {name: value for name, value in attributes.items() if name in keep}
+
+            feature = {'attributes': attributes}
+            if return_geometry:
+                feature['geometry'] = {'rings': [page_rings[position]]}
+            features.append(feature)
+
+        payload = {
+            'objectIdFieldName': self.oid_field,
+            'geometryType': 'esriGeometryPolygon',
+            'spatialReference': {'wkid': int(out_sr)},
+            'features': features,
+            'exceededTransferLimit': exceeded,
+        }
+
+        return 200, payload, self.latency + self.latency_per_feature * len(features)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, query):
+        path = urlparse(self.path).path.rstrip('/')
+        parts = path.split('/')
+        query = {key: values[0] for key, values in query.items()}
+
+        is_query = parts[-1] == 'query'
+        layer_id = parts[-2] if is_query else parts[-1]
+        layer = self.server.layers.get(layer_id)
+
+        if layer is None:
+            status, payload, delay = 200, {'error': {'code': 400, 'message': f'Invalid layer {layer_id}', 'details': []}}, 0
+        elif is_query:
+            status, payload, delay = layer.query(query)
+        else:
+            status, payload, delay = 200, layer.metadata, layer.latency
+
+        if delay:
+            threading.Event().wait(delay)
+
+        # a truncated answer comes already serialized
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up (e.g. a 'timeout' fault)
+            pass
+
+    def do_GET(self):
+        self._respond(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        query = parse_qs(urlparse(self.path).query)
+        query.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+        self._respond(query)
+
+
+class FakeArcGISServer:
+    """
+    Serves fake layers on localhost, in a background thread.
+
+    Args:
+        layers (dict): The {layer id: FakeLayer} layers of the MapServer.
+        port (int, optional): The port. Defaults to 0 (any free one).
+    """
+    def __init__(self, layers, port=0):
+        self.layers = layers
+        self.port = port
+        self._server = None
+
+    @property
+    def url(self):
+        """
+        str: The MapServer URL, ending with '/' like the ones of constants.py.
+        """
+        return f'http://127.0.0.1:{self._server.server_port}/server/rest/services/Fake/MapServer/'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.layers = self.layers
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def use_fake_server(server, no_pauses=True):
+    """
+    Points the dumpers of lib to a fake server, for both the main and the alternative URLs.
+
+    Args:
+        server (FakeArcGISServer): The started server.
+        no_pauses (bool, optional): Whether to disable esridump's fixed politeness pauses (10 s
+                                    every 5 requests), which would only measure sleeping.
+                                    Defaults to True.
+    """
+    import lib.esri
+
+    # get_layer_url reads the URLs from lib.esri's globals
+    lib.esri.MAPSERVER_URL = server.url
+    lib.esri.MAPSERVER_URL_ALT = server.url
+
+    if no_pauses:
+        lib.esri.EsriDumper.pause_seconds = 0
@@ -0,0 +1,90 @@
+"""
+Guards the startup cost of lib: times `import lib`, a light CLI command and the full
+`from lib import *` in fresh interpreters, and checks that importing lib loads none of the heavy
+dependencies nor touches the filesystem.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py                # exits with 1 past the budgets
+    python benchmarks/import_time.py --budget 0.1 --repeat 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# modules `import lib` must not load, they are imported by the code that uses them
+HEAVY_MODULES = ['geopandas', 'pandas', 'pyarrow', 'shapely', 'pyproj', 'numpy', 'esridump', 'requests', 'tqdm']
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = f"""
+import os, sys, json
+before = set(os.listdir('.'))
+import lib
+print(json.dumps({{
+    'heavy': [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+    'created': sorted(set(os.listdir('.')) - before),
+}}))
+"""
+
+
+def run_python(args, cwd):
+    env = {**os.environ, 'PYTHONPATH': REPO_ROOT, 'PYTHONDONTWRITEBYTECODE': '1'}
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, *args], cwd=cwd, env=env, check=True, capture_output=True, text=True).stdout
+    return time.perf_counter() - start, output
+
+
+def best_time(args, cwd, repeat):
+    return min(run_python(args, cwd)[0] for _ in range(repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the import time and import side effects of lib.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs of each measure, the best one counts (default: 5)')
+    parser.add_argument('--budget', type=float, default=0.15,
+                        help='Maximum time of `import lib` above a bare interpreter, in seconds (default: 0.15)')
+    parser.add_argument('--cli-budget', type=float, default=0.15,
+                        help='Maximum time of `python -m lib verify` above a bare interpreter, in seconds (default: 0.15)')
+
+    args = parser.parse_args()
+    failures = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _, output = run_python(['-c', PROBE], workdir)
+        probe = json.loads(output.strip().splitlines()[-1])
+
+        if probe['heavy']:
+            failures.append(f"`import lib` loads {probe['heavy']}")
+        if probe['created']:
+            failures.append(f"`import lib` creates {probe['created']}")
+
+        manifest_path = os.path.join(workdir, 'empty_manifest.jsonl')
+        open(manifest_path, 'w').close()
+
+        bare = best_time(['-c', 'pass'], workdir, args.repeat)
+        timings = {
+            'import lib': best_time(['-c', 'import lib'], workdir, args.repeat) - bare,
+            'python -m lib verify': best_time(['-m', 'lib', 'verify', manifest_path], workdir, args.repeat) - bare,
+            'from lib import *': best_time(['-c', 'from lib import *'], workdir, args.repeat) - bare,
+        }
+
+    budgets = {'import lib': args.budget, 'python -m lib verify': args.cli_budget}
+
+    print(f"{'bare interpreter':22} {bare:8.3f} s")
+    for name, seconds in timings.items():
+        budget = budgets.get(name)
+        flag = '  OVER BUDGET' if budget is not None and seconds > budget else ''
+        print(f"{name:22} {seconds:+8.3f} s" + (f"  (budget {budget:.3f} s){flag}" if budget is not None else ''))
+        if flag:
+            failures.append(f"{name} takes {seconds:.3f} s, over its {budget:.3f} s budget")
+
+    for failure in failures:
+        print(failure)
+
+    sys.exit(1 if failures else 0)
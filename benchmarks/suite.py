@@ -0,0 +1,265 @@
+"""
+Benchmark suite of the dumpers, checker and profiler against the local fake ArcGIS server
+(see fake_arcgis.py), with stored baselines to catch regressions.
+
+Each scenario runs in its own child process, so its peak RSS is its own. The results are
+compared with benchmarks/baselines.json: a metric worse than its baseline by more than
+`--tolerance` is reported as a regression, and the suite exits with 1.
+
+Run from the repository root:
+
+    python benchmarks/suite.py                      # all the scenarios, compared with the baselines
+    python benchmarks/suite.py lazy_dump resume     # some of them
+    python benchmarks/suite.py --save-baseline      # (re)record the baselines of this machine
+"""
+import sys
+sys.path.append('.')
+sys.path.append('benchmarks')
+from lib import *
+
+from fake_arcgis import FakeArcGISServer, FakeLayer, use_fake_server
+
+import argparse
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+
+BASELINES_PATH = 'benchmarks/baselines.json'
+
+# metrics where higher is better; for all the others lower is better
+HIGHER_IS_BETTER = ('_per_second',)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def serve(args, **layer_kwargs):
+    layer = FakeLayer(n_features=args.n_features, max_record_count=args.max_record_count,
+                      latency=args.latency, **layer_kwargs)
+    server = FakeArcGISServer({LAYER_IDS['buildings']: layer, LAYER_IDS['buildings_alt']: layer}).start()
+    use_fake_server(server)
+    return server, layer
+
+
+def last_run_metrics(folderpath, layername='buildings'):
+    return json.loads(read_file_as_list(os.path.join(folderpath, f'{layername}_metrics.jsonl'))[-1])
+
+
+def dump_result(folderpath, seconds):
+    counters = last_run_metrics(folderpath)['counters']
+    return {
+        'seconds': seconds,
+        'features_per_second': counters.get('features', 0) / seconds,
+        'requests': counters.get('requests', 0),
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def best_of(repeat, func, *args, **kwargs):
+    # for the short, read-only scenarios, whose single timings are too noisy
+    return min(timed(func, *args, **kwargs) for _ in range(repeat))
+
+
+def lazy_dump(args, workdir):
+    server, _ = serve(args)
+    with server:
+        seconds = timed(geojsonl_lazy_dumper, 'buildings', outfolderpath=workdir, chunksize=args.chunksize)
+    return dump_result(workdir, seconds)
+
+
+def lazy_dump_errors(args, workdir):
+    server, layer = serve(args, error_rate=0.2)
+    with server:
+        # the back-off waits are part of the cost of errors, but scaled down to the fake latencies
+        seconds = timed(geojsonl_lazy_dumper, 'buildings', outfolderpath=workdir, chunksize=args.chunksize,
+                        max_attempts=20)
+    result = dump_result(workdir, seconds)
+    result['retries'] = last_run_metrics(workdir)['counters'].get('retries', 0)
+    return result
+
+
+def parallel_dump(args, workdir):
+    server, _ = serve(args)
+    with server:
+        seconds = timed(geojsonl_parallel_dumper, 'buildings', outfolderpath=workdir, chunksize=args.chunksize,
+                        max_workers=4, page_size=args.max_record_count)
+    return dump_result(workdir, seconds)
+
+
+def silly_dump(args, workdir):
+    server, _ = serve(args)
+    with server:
+        seconds = timed(silly_dumper, 'buildings', outpath=os.path.join(workdir, 'buildings.geojson'))
+    return {'seconds': seconds, 'features_per_second': args.n_features / seconds}
+
+
+def resume(args, workdir):
+    server, layer = serve(args)
+    with server:
+        geojsonl_lazy_dumper('buildings', outfolderpath=workdir, chunksize=args.chunksize)
+
+        # a rerun of a complete dump
+        n_queries = layer.n_queries
+        noop_seconds = timed(geojsonl_lazy_dumper, 'buildings', outfolderpath=workdir, chunksize=args.chunksize)
+        noop_requests = layer.n_queries - n_queries
+
+        # a rerun after an interruption at half of the dump: the manifest loses its last half
+        manifest_path = os.path.join(workdir, 'buildings_manifest.jsonl')
+        lines = [line for line in read_file_as_list(manifest_path) if line]
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines[:len(lines) // 2]))
+
+        n_queries = layer.n_queries
+        half_seconds = timed(geojsonl_lazy_dumper, 'buildings', outfolderpath=workdir, chunksize=args.chunksize)
+
+    return {
+        'noop_seconds': noop_seconds,
+        'noop_requests': noop_requests,
+        'half_seconds': half_seconds,
+        'half_requests': layer.n_queries - n_queries,
+    }
+
+
+def dumped_chunks(args, workdir):
+    # a dump without latency, only to have chunks to read
+    args = argparse.Namespace(**{**vars(args), 'latency': 0.0})
+    server, _ = serve(args)
+    with server:
+        geojsonl_lazy_dumper('buildings', outfolderpath=workdir, chunksize=args.chunksize, reprojection='server')
+    return [os.path.join(workdir, entry['filename']) for entry in ChunkManifest(os.path.join(workdir, 'buildings_manifest.jsonl')).entries]
+
+
+def checker_speed(args, workdir):
+    from checker import check_objectids
+
+    filepaths = dumped_chunks(args, workdir)
+    seconds = best_of(5, check_objectids, filepaths)
+    return {'seconds': seconds, 'ids_per_second': args.n_features / seconds}
+
+
+def profiler_speed(args, workdir):
+    from profiler import profile_columns
+
+    filepaths = dumped_chunks(args, workdir)
+    seconds = best_of(3, profile_columns, filepaths)
+    return {'seconds': seconds, 'features_per_second': args.n_features / seconds}
+
+
+SCENARIOS = {
+    'lazy_dump': lazy_dump,
+    'lazy_dump_errors': lazy_dump_errors,
+    'parallel_dump': parallel_dump,
+    'silly_dump': silly_dump,
+    'resume': resume,
+    'checker': checker_speed,
+    'profiler': profiler_speed,
+}
+
+
+def run_scenario_process(name, args):
+    command = [sys.executable, __file__, '--run', name, '--n-features', str(args.n_features),
+               '--latency', str(args.latency), '--max-record-count', str(args.max_record_count),
+               '--chunksize', str(args.chunksize)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baselines, tolerance):
+    regressions = []
+
+    for name, metrics in results.items():
+        baseline = baselines.get(name, {})
+
+        for metric, value in metrics.items():
+            reference = baseline.get(metric)
+            if reference is None or not isinstance(value, (int, float)):
+                print(f"{name:18} {metric:22} {value:14.4f}")
+                continue
+
+            higher_is_better = metric.endswith(HIGHER_IS_BETTER)
+            if reference:
+                change = (value - reference) / abs(reference)
+            else:
+                change = 0.0 if value == reference else math.inf
+            worse = -change if higher_is_better else change
+
+            flag = ''
+            if worse > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((name, metric))
+
+            print(f"{name:18} {metric:22} {value:14.4f}  baseline {reference:14.4f}  {change:+7.1%}{flag}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the dumpers against a local fake ArcGIS server.')
+    parser.add_argument('scenarios', nargs='*', default=[],
+                        help=f'Scenarios to run (default: all of {", ".join(SCENARIOS)})')
+    parser.add_argument('--n-features', type=int, default=20000,
+                        help='Number of features of the fake layer (default: 20000)')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Delay of each request of the fake server, in seconds (default: 0.02)')
+    parser.add_argument('--max-record-count', type=int, default=2000,
+                        help='Page limit of the fake layer (default: 2000, like the real one)')
+    parser.add_argument('--chunksize', type=int, default=350,
+                        help='Number of features per chunk (default: 350, like the scripts)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative change of a metric, against its baseline, counted as a regression (default: 0.25)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help=f'Store the results as the new baselines in {BASELINES_PATH}')
+    parser.add_argument('--run', choices=list(SCENARIOS), default=None,
+                        help='Run a single scenario in this process (used internally)')
+
+    args = parser.parse_args()
+
+    if args.run:
+        workdir = tempfile.mkdtemp(prefix=f'bench_{args.run}_')
+        try:
+            result = SCENARIOS[args.run](args, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        result['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(result))
+        sys.exit(0)
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}, choose from {list(SCENARIOS)}")
+    results = {}
+
+    for name in names:
+        print(f"running {name}...", flush=True)
+        results[name] = run_scenario_process(name, args)
+
+    stored = read_json(BASELINES_PATH, {})
+    settings = {key: getattr(args, key) for key in ['n_features', 'latency', 'max_record_count', 'chunksize']}
+
+    if stored and stored.get('settings') != settings:
+        print(f"Warning: the baselines were recorded with {stored.get('settings')}, not {settings}")
+
+    regressions = compare(results, stored.get('scenarios', {}), args.tolerance)
+
+    if args.save_baseline:
+        stored = {
+            'settings': settings,
+            'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'recorded': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'scenarios': {**stored.get('scenarios', {}), **results},
+        }
+        dump_json(stored, BASELINES_PATH)
+        print(f"Baselines saved to {BASELINES_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} regressions: {regressions}")
+        sys.exit(1)
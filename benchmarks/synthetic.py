@@ -0,0 +1,44 @@
+"""
+Synthetic data shared by the benchmarks.
+"""
+import random
+
+
+def synthetic_features(n_features, seed=0, projected=False):
+    """
+    Generates building-like GeoJSON features with small rectangular footprints over Curitiba.
+
+    Args:
+        n_features (int): The number of features to generate.
+        seed (int, optional): The random seed. Defaults to 0.
+        projected (bool, optional): If True, the coordinates are in DEFAULT_CRS (UTM 22S, meters)
+                                    instead of longitude/latitude. Defaults to False.
+
+    Yields:
+        dict: A GeoJSON feature.
+    """
+    rng = random.Random(seed)
+
+    for objectid in range(1, n_features + 1):
+        if projected:
+            x = 672000 + rng.uniform(-10000, 10000)
+            y = 7185000 + rng.uniform(-10000, 10000)
+            dx, dy = rng.uniform(5, 20), rng.uniform(5, 20)
+        else:
+            x = -49.27 + rng.uniform(-0.1, 0.1)
+            y = -25.43 + rng.uniform(-0.1, 0.1)
+            dx, dy = rng.uniform(5e-5, 2e-4), rng.uniform(5e-5, 2e-4)
+
+        yield {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[x, y], [x + dx, y], [x + dx, y + dy], [x, y + dy], [x, y]]],
+            },
+            'properties': {
+                'objectid': objectid,
+                'ctba_nome': 'EDIFICACAO',
+                'alturaaproximada': None,
+                'numeropavimentos': None,
+            },
+        }
@@ -0,0 +1,215 @@
+from lib import *
+
+import hashlib
+import pickle
+import shutil
+import tempfile
+
+from checker import chunk_sort_key, fastjson
+
+# the objectid span of each bucket: bucket k holds the objectids from k * BUCKET_SIZE to (k + 1) * BUCKET_SIZE - 1
+BUCKET_SIZE = 5000
+
+def bucket_filename(layername, bucket, compression=None):
+    """
+    Returns the file name of a bucket ('buildings', 12 -> 'buildings_bucket_12.geojsonl').
+
+    Args:
+        layername (str): The name of the layer.
+        bucket (int): The bucket number.
+        compression (str, optional): 'gzip', 'zstd' or None (plain text). Defaults to None.
+
+    Returns:
+        str: The file name.
+    """
+    return f'{layername}_bucket_{bucket}{chunk_extension(compression)}'
+
+def bucket_manifest_path(folderpath, layername):
+    """
+    Returns the path of the manifest of the buckets of a layer.
+
+    Args:
+        folderpath (str): The folder of the buckets.
+        layername (str): The name of the layer.
+
+    Returns:
+        str: The path of '<layername>_buckets_manifest.jsonl'.
+    """
+    return os.path.join(folderpath, f'{layername}_buckets_manifest.jsonl')
+
+def _append_spool(spool_folderpath, bucket, oids, lines):
+    with open(os.path.join(spool_folderpath, f'{bucket}.pickle'), 'ab') as f:
+        pickle.dump((oids, lines), f)
+
+def _read_spool(spool_folderpath, bucket):
+    oids, lines = [], []
+    with open(os.path.join(spool_folderpath, f'{bucket}.pickle'), 'rb') as f:
+        while True:
+            try:
+                block_oids, block_lines = pickle.load(f)
+            except EOFError:
+                break
+            oids.append(block_oids)
+            lines.extend(block_lines)
+
+    return np.concatenate(oids), lines
+
+def _write_manifest(path, entries):
+    # rewritten whole, so the same buckets always give the same file
+    tmp_path = path + '.tmp'
+
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry, sort_keys=True) + '\n' for entry in entries)
+            f.flush()
+            os.fsync(f.fileno())
+    except (OSError, IOError) as e:
+        logging.error(f"Error writing manifest {tmp_path}: {e}")
+        raise
+
+    os.replace(tmp_path, path)
+
+def bucket_chunks(input_folderpath, outfolderpath, layername='buildings', bucket_size=BUCKET_SIZE, compression=None,
+                  level=None, block_size=50000, oid_field='objectid'):
+    """
+    Lays out the chunks of a dump as deterministic objectid buckets, rewriting only the buckets
+    whose contents changed.
+
+    The layout of the dumpers depends on the feature order and the paging, so a single new
+    feature shifts every later chunk. Here bucket k holds the features with an objectid from
+    k * bucket_size to (k + 1) * bucket_size - 1 ('<layername>_bucket_<k>.geojsonl[.gz|.zst]'),
+    sorted by objectid, so the same features always give the same bytes. The sha256 of the
+    uncompressed contents of each bucket is kept in '<layername>_buckets_manifest.jsonl' (one
+    line per bucket, as read by ChunkManifest), and a bucket is only written again when that
+    hash changes; buckets left without features are removed. In a folder under version control,
+    a rerun then only touches the buckets with real changes.
+
+    The features are streamed in blocks of `block_size` into per-bucket temporary files, then
+    each bucket is sorted on its own, so memory is bounded by the largest bucket. If an objectid
+    is found more than once (e.g. refreshed chunks), the last chunk in name order wins.
+
+    Args:
+        input_folderpath (str): The folder of the dumped chunks (only '<layername>_*' chunks are read).
+        outfolderpath (str): The folder of the buckets. It must differ from input_folderpath.
+        layername (str, optional): The name of the layer. Defaults to 'buildings'.
+        bucket_size (int, optional): The objectid span of each bucket. Defaults to BUCKET_SIZE.
+        compression (str, optional): 'gzip', 'zstd' or None (plain text). Defaults to None.
+        level (int, optional): The compression level. Defaults to None (see lib.compression.DEFAULT_LEVELS).
+        block_size (int, optional): The number of features read at a time. Defaults to 50000.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        dict: A summary: the features and buckets, and the buckets written, unchanged and removed.
+
+    Raises:
+        ValueError: If the folders are the same, bucket_size is not positive, or the input has no
+                    features (e.g. a wrong path or a failed dump), which would empty the buckets.
+    """
+    if bucket_size <= 0:
+        raise ValueError("bucket_size must be positive")
+    if os.path.abspath(input_folderpath) == os.path.abspath(outfolderpath):
+        raise ValueError("The buckets must go to another folder than the dumped chunks")
+
+    chunk_paths = sorted((filepath for filepath in listdir_fullpath(input_folderpath, extension=CHUNK_EXTENSIONS)
+                          if os.path.basename(filepath).startswith(f'{layername}_')), key=chunk_sort_key)
+
+    # nothing is touched then, rather than removing every bucket
+    if not chunk_paths:
+        raise ValueError(f"No {layername} chunks in {input_folderpath}")
+
+    manifest_path = bucket_manifest_path(outfolderpath, layername)
+    previous = {entry['index']: entry for entry in ChunkManifest(manifest_path).entries}
+
+    summary = {'n_features': 0, 'n_duplicates': 0, 'n_no_oid': 0, 'n_buckets': 0,
+               'n_written': 0, 'n_unchanged': 0, 'n_removed': 0, 'n_bytes_written': 0}
+
+    create_dir(outfolderpath)
+    # out of the output folder, which may be under version control
+    spool_folderpath = tempfile.mkdtemp(prefix=f'{layername}_buckets_')
+    buckets = set()
+
+    def spool(lines):
+        oids = np.array([(fastjson.loads(line).get('properties') or {}).get(oid_field) for line in lines], dtype=object)
+        has_oid = np.array([oid is not None for oid in oids], dtype=bool)
+        summary['n_no_oid'] += int((~has_oid).sum())
+
+        oids = oids[has_oid].astype(np.int64)
+        lines = [line for line, keep in zip(lines, has_oid) if keep]
+        numbers = oids // bucket_size
+
+        for bucket in np.unique(numbers).tolist():
+            in_bucket = np.flatnonzero(numbers == bucket)
+            _append_spool(spool_folderpath, bucket, oids[in_bucket], [lines[i] for i in in_bucket])
+            buckets.add(bucket)
+
+    entries = []
+
+    try:
+        # pass 1: streaming the chunks into per-bucket temporary files
+        lines = []
+        for filepath in tqdm(chunk_paths, desc='reading chunks'):
+            for line in iter_chunk_lines(filepath):
+                lines.append(line)
+                if len(lines) >= block_size:
+                    spool(lines)
+                    lines = []
+        if lines:
+            spool(lines)
+
+        if not buckets:
+            raise ValueError(f"No {layername} features with an objectid in {input_folderpath}")
+
+        # pass 2: sorting each bucket and writing the changed ones
+        for bucket in tqdm(sorted(buckets), desc='writing buckets'):
+            oids, lines = _read_spool(spool_folderpath, bucket)
+
+            order = np.argsort(oids, kind='stable')
+            oids = oids[order]
+            # the last occurrence of each objectid
+            last = np.append(oids[1:] != oids[:-1], True)
+            summary['n_duplicates'] += int((~last).sum())
+
+            contents = b''.join(lines[i] + b'\n' for i in order[last])
+            content_sha256 = hashlib.sha256(contents).hexdigest()
+            filename = bucket_filename(layername, bucket, compression)
+            filepath = os.path.join(outfolderpath, filename)
+
+            entry = previous.get(bucket)
+            unchanged = (entry is not None and entry['filename'] == filename and entry.get('content_sha256') == content_sha256
+                         and os.path.exists(filepath) and os.path.getsize(filepath) == entry['n_bytes'])
+
+            if unchanged:
+                summary['n_unchanged'] += 1
+            else:
+                with ChunkWriter(filepath, level=level) as writer:
+                    writer.write(contents.decode('utf-8'))
+                entry = {
+                    'index': bucket,
+                    'filename': filename,
+                    'oid_range': [int(oids[0]), int(oids[-1])],
+                    'n_features': int(last.sum()),
+                    'n_bytes': writer.n_bytes,
+                    'sha256': writer.sha256,
+                    'content_sha256': content_sha256,
+                }
+                summary['n_written'] += 1
+                summary['n_bytes_written'] += writer.n_bytes
+
+            entries.append(entry)
+            summary['n_features'] += entry['n_features']
+    finally:
+        shutil.rmtree(spool_folderpath, ignore_errors=True)
+
+    summary['n_buckets'] = len(entries)
+
+    # the buckets that are gone, whatever their codec
+    kept = {entry['filename'] for entry in entries}
+    for filepath in listdir_fullpath(outfolderpath, extension=CHUNK_EXTENSIONS):
+        filename = os.path.basename(filepath)
+        if filename.startswith(f'{layername}_bucket_') and filename not in kept:
+            os.remove(filepath)
+            summary['n_removed'] += 1
+
+    _write_manifest(manifest_path, entries)
+
+    return summary
@@ -0,0 +1,214 @@
+import os, json
+import hashlib
+import re
+from tqdm import tqdm
+
+from lib.files import create_dir, read_json, dump_json
+from lib.compression import chunk_codec, get_decompressor
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# orjson is optional, the standard library parser is used if it's not installed
+try:
+    import orjson as fastjson
+except ImportError:
+    fastjson = json
+
+def chunk_sort_key(filename):
+    """
+    Sorting key of chunk files, by the number at the end of their names ('buildings_chunk_12.geojsonl' -> 12).
+
+    Args:
+        filename (str): The file name or path.
+
+    Returns:
+        tuple: The sorting key.
+    """
+    stem = os.path.basename(filename).split('.')[0]
+    last = stem.split('_')[-1]
+
+    return (0, int(last), stem) if last.isdigit() else (1, 0, stem)
+
+def extract_oids(data, oid_field='objectid'):
+    """
+    Extracts the objectids of the lines of a GeoJSONL chunk, without building any geometry.
+
+    The ids are first taken with a regular expression over the raw bytes; that is only
+    trusted if it finds exactly one id per line, otherwise each line is parsed as JSON.
+    Features with a null or missing objectid are left out of the ids.
+
+    Args:
+        data (bytes): The contents of the chunk.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        tuple: A tuple containing:
+            - np.ndarray: The objectids, as int64, in file order.
+            - np.ndarray: Per feature, whether it has an objectid (boolean).
+    """
+    pattern = re.compile(rb'"' + re.escape(oid_field.encode('utf-8')) + rb'":\s*(-?\d+)[,}]')
+    n_lines = data.count(b'\n') + (0 if not data or data.endswith(b'\n') else 1)
+
+    matches = pattern.findall(data)
+
+    if len(matches) == n_lines:
+        return np.array(matches, dtype=np.int64), np.ones(n_lines, dtype=bool)
+
+    oids = np.array([(fastjson.loads(line).get('properties') or {}).get(oid_field)
+                     for line in data.splitlines() if line.strip()], dtype=object)
+    has_oid = np.array([oid is not None for oid in oids], dtype=bool)
+
+    return oids[has_oid].astype(np.int64), has_oid
+
+def check_file(filepath, known_sha256=None, oid_field='objectid'):
+    """
+    Hashes a chunk and, if its checksum is not `known_sha256`, extracts its objectids.
+    Compressed chunks are hashed as they are on disk, and only decompressed if they changed.
+
+    Args:
+        filepath (str): The path of the chunk.
+        known_sha256 (str, optional): The checksum of the already checked version of the file.
+                                      Defaults to None.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        tuple: A tuple containing:
+            - str: The hex sha256 checksum of the file.
+            - np.ndarray: Its objectids, or None if the file was unchanged.
+            - int: The number of its features without an objectid (0 if the file was unchanged).
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    if sha256 == known_sha256:
+        return sha256, None, 0
+
+    compression = chunk_codec(filepath)
+    if compression:
+        data = get_decompressor(compression).decompress(data)
+
+    oids, has_oid = extract_oids(data, oid_field=oid_field)
+
+    return sha256, oids, int((~has_oid).sum())
+
+def find_gaps(sorted_unique_ids):
+    """
+    Finds the missing stretches of a sorted array of unique ids.
+
+    Args:
+        sorted_unique_ids (np.ndarray): The sorted unique ids.
+
+    Returns:
+        np.ndarray: A (n, 2) array of inclusive [first, last] missing ranges.
+    """
+    steps = np.diff(sorted_unique_ids)
+    where = np.nonzero(steps > 1)[0]
+
+    return np.column_stack([sorted_unique_ids[where] + 1, sorted_unique_ids[where + 1] - 1])
+
+def check_objectids(filepaths, registry_path=None, ids_cache_path=None, oid_field='objectid', max_workers=None, max_examples=100):
+    """
+    Checks the objectid continuity of a whole dataset of GeoJSONL chunks in a single pass.
+
+    Only the objectids are read from the chunks (in a process pool), and the gaps, duplicates
+    and out-of-order ids are found with vectorized operations over all of them, so problems
+    between chunks are detected too. Files whose checksum is in the registry are not parsed
+    again: their ids come from the ids cache. Features without an objectid are counted per file
+    (those files are left out of the registry, so they are counted again on the next check).
+
+    Args:
+        filepaths (list): The chunk paths, in the order the ids are expected to increase.
+        registry_path (str, optional): JSON registry of the checked files ({filename: sha256}).
+                                       Defaults to None (no registry).
+        ids_cache_path (str, optional): NumPy .npz cache of the ids of the checked files.
+                                        Defaults to None (no cache).
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+        max_workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+        max_examples (int, optional): The maximum number of duplicates, gaps and out-of-order
+                                      positions listed in the report. Defaults to 100.
+
+    Returns:
+        dict: The report, with the counts and examples of each kind of problem.
+    """
+    registry = read_json(registry_path, {}) if registry_path else {}
+
+    # older registries were plain lists of names, without checksums
+    if not isinstance(registry, dict):
+        registry = {}
+
+    cached_ids = {}
+    if ids_cache_path and os.path.exists(ids_cache_path):
+        with np.load(ids_cache_path) as cache:
+            cached_ids = {name: cache[name] for name in cache.files}
+
+    filenames = [os.path.basename(filepath) for filepath in filepaths]
+    known = [registry.get(name) if name in cached_ids else None for name in filenames]
+
+    ids_per_file = []
+    new_registry = {}
+    no_oid = []
+    n_parsed = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(check_file, filepaths, known, [oid_field] * len(filepaths), chunksize=8)
+
+        for name, (sha256, ids, n_no_oid) in tqdm(zip(filenames, results), total=len(filenames)):
+            if ids is None:
+                ids = cached_ids[name]
+            else:
+                n_parsed += 1
+            ids_per_file.append(ids)
+
+            if n_no_oid:
+                no_oid.append({'file': name, 'count': n_no_oid})
+            else:
+                new_registry[name] = sha256
+
+    counts = np.array([len(ids) for ids in ids_per_file], dtype=np.int64)
+    all_ids = np.concatenate(ids_per_file) if ids_per_file else np.array([], dtype=np.int64)
+
+    # positions in the whole stream -> (file, line)
+    file_starts = np.concatenate([[0], np.cumsum(counts)])
+
+    def locate(position):
+        file_idx = int(np.searchsorted(file_starts, position, side='right') - 1)
+        return {'file': filenames[file_idx], 'line': int(position - file_starts[file_idx]) + 1}
+
+    unique_ids, unique_counts = np.unique(all_ids, return_counts=True)
+    duplicated = unique_ids[unique_counts > 1]
+    gaps = find_gaps(unique_ids)
+    out_of_order = np.nonzero(np.diff(all_ids) <= 0)[0] + 1
+
+    report = {
+        'n_files': len(filepaths),
+        'n_files_parsed': n_parsed,
+        'n_ids': int(len(all_ids)),
+        'n_unique_ids': int(len(unique_ids)),
+        'min_id': int(unique_ids[0]) if len(unique_ids) else None,
+        'max_id': int(unique_ids[-1]) if len(unique_ids) else None,
+        'n_duplicated_ids': int(len(duplicated)),
+        'duplicates': [{'objectid': int(oid), 'count': int(count)}
+                       for oid, count in zip(duplicated[:max_examples], unique_counts[unique_counts > 1][:max_examples])],
+        'n_missing_ids': int((gaps[:, 1] - gaps[:, 0] + 1).sum()) if len(gaps) else 0,
+        'n_gaps': int(len(gaps)),
+        'gaps': gaps[:max_examples].tolist(),
+        'n_out_of_order': int(len(out_of_order)),
+        'out_of_order': [{'objectid': int(all_ids[pos]), 'previous': int(all_ids[pos - 1]), **locate(pos)}
+                         for pos in out_of_order[:max_examples]],
+        'n_no_oid': sum(item['count'] for item in no_oid),
+        'no_oid': no_oid[:max_examples],
+    }
+
+    if registry_path:
+        dump_json(new_registry, registry_path)
+
+    if ids_cache_path:
+        directory = os.path.dirname(ids_cache_path)
+        if directory:
+            create_dir(directory)
+        np.savez(ids_cache_path, **dict(zip(filenames, ids_per_file)))
+
+    return report
@@ -0,0 +1,292 @@
+from lib import *
+
+import glob
+import numpy as np
+import pyarrow.compute as pc
+import shutil
+import uuid
+
+GEOHASH_ALPHABET = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+
+def geohash_encode(lon, lat, precision=5):
+    """
+    Vectorized geohash encoding of points.
+
+    Args:
+        lon (np.ndarray): The longitudes.
+        lat (np.ndarray): The latitudes.
+        precision (int, optional): The number of geohash characters. Defaults to 5 (~5 km cells).
+
+    Returns:
+        np.ndarray: The geohashes, as strings.
+    """
+    n_bits = precision * 5
+    n_lon_bits = (n_bits + 1) // 2
+    n_lat_bits = n_bits // 2
+
+    lon_cells = np.clip(((np.asarray(lon) + 180.0) / 360.0 * (1 << n_lon_bits)).astype(np.int64), 0, (1 << n_lon_bits) - 1)
+    lat_cells = np.clip(((np.asarray(lat) + 90.0) / 180.0 * (1 << n_lat_bits)).astype(np.int64), 0, (1 << n_lat_bits) - 1)
+
+    # interleave, starting with a longitude bit
+    code = np.zeros(len(lon_cells), dtype=np.int64)
+    for i in range(n_bits):
+        if i % 2 == 0:
+            bit = (lon_cells >> (n_lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_cells >> (n_lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+
+    geohashes = GEOHASH_ALPHABET[(code >> (5 * (precision - 1))) & 31]
+    for i in range(1, precision):
+        geohashes = np.char.add(geohashes, GEOHASH_ALPHABET[(code >> (5 * (precision - 1 - i))) & 31])
+
+    return geohashes
+
+def hilbert_index(lon, lat, order=20):
+    """
+    Vectorized position of points along a Hilbert curve over the longitude/latitude plane.
+
+    Args:
+        lon (np.ndarray): The longitudes.
+        lat (np.ndarray): The latitudes.
+        order (int, optional): The curve order, 2**order cells per axis. Defaults to 20 (~40 m).
+
+    Returns:
+        np.ndarray: The Hilbert indexes, as uint64.
+    """
+    n = 1 << order
+
+    x = np.clip(((np.asarray(lon) + 180.0) / 360.0 * n).astype(np.int64), 0, n - 1)
+    y = np.clip(((np.asarray(lat) + 90.0) / 180.0 * n).astype(np.int64), 0, n - 1)
+    d = np.zeros(len(x), dtype=np.uint64)
+
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += np.uint64(s) * np.uint64(s) * ((3 * rx.astype(np.uint64)) ^ ry.astype(np.uint64))
+
+        # rotating the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+
+        s >>= 1
+
+    return d
+
+def geoparquet_schema_with_bbox(schema):
+    """
+    Adds the 'bbox' covering column (GeoParquet 1.1) and the 'hilbert' column to a schema.
+
+    The per-row bbox struct gives each row group min/max statistics on xmin/ymin/xmax/ymax,
+    which readers use to skip row groups outside a queried box.
+
+    Args:
+        schema (pa.Schema): A schema from `arrow_schema_from_metadata`.
+
+    Returns:
+        pa.Schema: The extended schema.
+    """
+    bbox_type = pa.struct([(name, pa.float64()) for name in ['xmin', 'ymin', 'xmax', 'ymax']])
+
+    geo_metadata = json.loads(schema.metadata[b'geo'])
+    geo_metadata['version'] = '1.1.0'
+    geo_metadata['columns']['geometry']['covering'] = {
+        'bbox': {name: ['bbox', name] for name in ['xmin', 'ymin', 'xmax', 'ymax']}
+    }
+
+    schema = schema.append(pa.field('bbox', bbox_type)).append(pa.field('hilbert', pa.uint64()))
+
+    return schema.with_metadata({b'geo': json.dumps(geo_metadata).encode('utf-8')})
+
+def add_spatial_columns(table, schema, geohash_precision=5):
+    """
+    Computes the bbox, Hilbert index and geohash partition of each row of a table.
+
+    Args:
+        table (pa.Table): A table from `features_to_arrow`.
+        schema (pa.Schema): The schema from `geoparquet_schema_with_bbox`.
+        geohash_precision (int, optional): The geohash length of the partitions. Defaults to 5.
+
+    Returns:
+        tuple: A tuple containing:
+            - pa.Table: The table with the 'bbox' and 'hilbert' columns.
+            - np.ndarray: The geohash partition of each row.
+    """
+    geoms = shapely.from_wkb(table.column('geometry').to_numpy(zero_copy_only=False))
+    bounds = shapely.bounds(geoms)
+
+    center_lon = (bounds[:, 0] + bounds[:, 2]) / 2
+    center_lat = (bounds[:, 1] + bounds[:, 3]) / 2
+
+    # rows without a geometry end up in a partition of their own, at the start of the curve
+    empty = np.isnan(center_lon)
+    center_lon = np.where(empty, -180.0, center_lon)
+    center_lat = np.where(empty, -90.0, center_lat)
+
+    bbox = pa.StructArray.from_arrays([pa.array(bounds[:, i], from_pandas=True) for i in range(4)],
+                                      names=['xmin', 'ymin', 'xmax', 'ymax'])
+
+    table = table.append_column('bbox', bbox).append_column('hilbert', pa.array(hilbert_index(center_lon, center_lat)))
+
+    return table.cast(schema), geohash_encode(center_lon, center_lat, geohash_precision)
+
+def compact_chunks(manifest_path, outfolderpath, layer_metadata, batch_size=50000, geohash_precision=5, row_group_size=5000, rebuild=False):
+    """
+    Compacts the registered GeoJSONL chunks of a dump into a partitioned, spatially sorted GeoParquet dataset.
+
+    The dataset is hive-partitioned by the geohash of the feature bbox centers
+    ('<outfolderpath>/geohash=<prefix>/part-<run>.parquet'); inside each file the rows are
+    sorted along a Hilbert curve and grouped in small row groups carrying bbox statistics.
+
+    It is incremental: the compacted chunks and their checksums are kept in
+    '<outfolderpath>/_compaction_state.json', and each run only appends a new part per partition
+    with the newly registered chunks. If an already compacted chunk changed or disappeared
+    (e.g. a refreshed tile), the dataset is rebuilt.
+
+    Chunks are read in batches of `batch_size` features and spread into per-partition temporary
+    files, then each partition is sorted on its own, so memory is bounded by the largest partition.
+
+    The parts are only published once every partition is sorted, and the run is recorded as
+    pending in the state while they are moved in place: the parts of a run that failed before
+    its chunks were recorded are deleted by the next run, which compacts those chunks again.
+
+    Args:
+        manifest_path (str): The manifest of the dump (see ChunkManifest).
+        outfolderpath (str): The folder of the GeoParquet dataset.
+        layer_metadata (dict): The layer's metadata (the dumpers save it as '<layername>_metadata.json').
+        batch_size (int, optional): The number of features converted at a time. Defaults to 50000.
+        geohash_precision (int, optional): The geohash length of the partitions. Defaults to 5.
+        row_group_size (int, optional): The number of rows of each row group. Defaults to 5000.
+        rebuild (bool, optional): Whether to compact everything again from scratch. Defaults to False.
+
+    Returns:
+        dict: A summary with the number of compacted chunks and features of this run.
+    """
+    manifest = ChunkManifest(manifest_path)
+
+    state_path = os.path.join(outfolderpath, '_compaction_state.json')
+    state = read_json(state_path, {'chunks': {}})
+
+    pending_run = state.pop('pending_run', None)
+    if pending_run:
+        logging.warning(f"Removing the uncommitted parts of the compaction run {pending_run} in {outfolderpath}")
+        for path in glob.glob(os.path.join(outfolderpath, 'geohash=*', f'part-{pending_run}.parquet*')):
+            os.remove(path)
+        dump_json(state, state_path)
+
+    for path in glob.glob(os.path.join(outfolderpath, '_tmp_*')):
+        shutil.rmtree(path, ignore_errors=True)
+
+    current = {entry['filename']: entry['sha256'] for entry in manifest.entries if entry['n_features']}
+
+    if any(current.get(filename) != sha256 for filename, sha256 in state['chunks'].items()):
+        logging.warning(f"Compacted chunks of {manifest_path} changed, rebuilding {outfolderpath}")
+        rebuild = True
+
+    if rebuild and os.path.exists(outfolderpath):
+        shutil.rmtree(outfolderpath)
+        state = {'chunks': {}}
+
+    new_entries = [entry for entry in manifest.entries if entry['n_features'] and entry['filename'] not in state['chunks']]
+
+    if not new_entries:
+        return {'n_chunks': 0, 'n_features': 0}
+
+    create_dir(outfolderpath)
+
+    base_schema = arrow_schema_from_metadata(layer_metadata)
+    schema = geoparquet_schema_with_bbox(base_schema)
+    run_id = uuid.uuid4().hex[:12]
+    tmp_folderpath = os.path.join(outfolderpath, f'_tmp_{run_id}')
+    create_dir(tmp_folderpath)
+
+    writers = {}
+    n_feats = 0
+
+    def flush(batch):
+        table, partitions = add_spatial_columns(features_to_arrow(batch, base_schema), schema, geohash_precision)
+
+        for partition in np.unique(partitions):
+            if partition not in writers:
+                writers[partition] = pq.ParquetWriter(os.path.join(tmp_folderpath, f'{partition}.parquet'), schema)
+            writers[partition].write_table(table.filter(pa.array(partitions == partition)))
+
+    try:
+        # pass 1: streaming the chunks into per-partition temporary files
+        try:
+            batch = []
+            for entry in tqdm(new_entries, desc='reading chunks'):
+                for line in iter_chunk_lines(manifest.chunk_path(entry)):
+                    batch.append(json.loads(line))
+                    if len(batch) >= batch_size:
+                        flush(batch)
+                        n_feats += len(batch)
+                        batch = []
+            if batch:
+                flush(batch)
+                n_feats += len(batch)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        # pass 2: sorting each partition along the Hilbert curve, still in the temporary folder
+        for partition in tqdm(sorted(writers), desc='sorting partitions'):
+            tmp_path = os.path.join(tmp_folderpath, f'{partition}.parquet')
+            table = pq.read_table(tmp_path, schema=schema)
+            table = table.take(pc.sort_indices(table, sort_keys=[('hilbert', 'ascending')]))
+
+            pq.write_table(table, os.path.join(tmp_folderpath, f'{partition}.sorted.parquet'),
+                           row_group_size=row_group_size, compression='zstd', write_statistics=True)
+            os.remove(tmp_path)
+
+        # pass 3: publishing the parts, the run being pending until its chunks are recorded
+        dump_json({**state, 'pending_run': run_id}, state_path)
+
+        for partition in sorted(writers):
+            partition_folderpath = os.path.join(outfolderpath, f'geohash={partition}')
+            create_dir(partition_folderpath)
+            os.replace(os.path.join(tmp_folderpath, f'{partition}.sorted.parquet'),
+                       os.path.join(partition_folderpath, f'part-{run_id}.parquet'))
+    finally:
+        shutil.rmtree(tmp_folderpath, ignore_errors=True)
+
+    # the state is only updated once every part is in place
+    state['chunks'].update({entry['filename']: entry['sha256'] for entry in new_entries})
+    dump_json(state, state_path)
+
+    return {'n_chunks': len(new_entries), 'n_features': n_feats, 'n_partitions': len(writers), 'run_id': run_id}
+
+def read_compacted_bbox(folderpath, bbox, columns=None):
+    """
+    Reads the features of a compacted dataset that may intersect a box, pushing the filter
+    down to the row group bbox statistics.
+
+    Args:
+        folderpath (str): The folder of the GeoParquet dataset.
+        bbox (tuple): The (xmin, ymin, xmax, ymax) box, in longitude/latitude.
+        columns (list, optional): The columns to read, besides the geometry, which is always
+                                  read. Defaults to None (all).
+
+    Returns:
+        gpd.GeoDataFrame: The features whose bbox intersects the box.
+    """
+    import pyarrow.dataset as ds
+
+    xmin, ymin, xmax, ymax = bbox
+
+    if columns is not None and 'geometry' not in columns:
+        columns = [*columns, 'geometry']
+
+    dataset = ds.dataset(folderpath, format='parquet', partitioning='hive', exclude_invalid_files=True,
+                         ignore_prefixes=['_', '.'])
+
+    condition = ((pc.field('bbox', 'xmax') >= xmin) & (pc.field('bbox', 'xmin') <= xmax) &
+                 (pc.field('bbox', 'ymax') >= ymin) & (pc.field('bbox', 'ymin') <= ymax))
+
+    table = dataset.to_table(columns=columns, filter=condition)
+    df = table.drop_columns([name for name in ['bbox', 'hilbert', 'geohash'] if name in table.column_names]).to_pandas()
+
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkb(df['geometry']), crs=OSM_CRS)
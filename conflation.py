@@ -0,0 +1,281 @@
+from lib import *
+
+from concurrent.futures import ProcessPoolExecutor
+
+from checker import extract_oids, chunk_sort_key
+from osm_pbf import read_osm_areas
+from tiles import lonlat_to_tiles
+
+# zoom level of the tiles the conflation is partitioned by (~1 km wide), each one a task of the process pool
+CONFLATION_ZOOM = 15
+
+# minimum intersection over union of a dumped building and an OSM one to be the same building
+MATCH_IOU = 0.5
+
+# minimum intersection, as a fraction of the smaller of the two areas, for buildings to overlap
+# (neighbours sharing a wall only touch, up to floating point noise)
+MIN_OVERLAP = 0.01
+
+CONFLATION_CATEGORIES = ('matched', 'overlapping', 'new', 'no_geometry')
+
+def load_chunk_geometries(filepath, oid_field='objectid'):
+    """
+    Reads the objectids and geometries of a GeoJSONL chunk, parsing the geometries in one vectorized call.
+
+    Args:
+        filepath (str): The path of the chunk.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        tuple: The objectids (np.ndarray), the geometries, as WKB (None for the features
+               without one), which is much cheaper to send between processes than shapely objects,
+               and the number of features left out for not having an objectid.
+    """
+    data = read_chunk(filepath)
+
+    lines = [line.decode('utf-8') for line in data.split(b'\n') if line.strip()]
+    oids, has_oid = extract_oids(data, oid_field=oid_field)
+
+    return oids, shapely.to_wkb(shapely.from_geojson(lines, on_invalid='ignore'))[has_oid], int((~has_oid).sum())
+
+def repair_geometries(geometries):
+    """
+    Makes the invalid geometries valid (in place), so the overlay operations don't fail on them.
+
+    Args:
+        geometries (np.ndarray): The shapely geometries, without missing ones.
+
+    Returns:
+        np.ndarray: The same array.
+    """
+    invalid = ~shapely.is_valid(geometries)
+
+    if invalid.any():
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+
+    return geometries
+
+def conflate_tile(dump_wkb, osm_wkb, min_overlap=MIN_OVERLAP):
+    """
+    Compares the dumped buildings of a tile with the OSM buildings around them.
+
+    The overlapping pairs come from a bulk STRtree query, and their intersection over union
+    from array-wide shapely operations. Coordinates are longitude/latitude: at the size of a
+    building, areas are distorted by a constant factor, which cancels out in the ratio.
+
+    Args:
+        dump_wkb (np.ndarray): The dumped buildings, as WKB.
+        osm_wkb (np.ndarray): The OSM buildings that may overlap them, as WKB.
+        min_overlap (float, optional): Minimum intersection, as a fraction of the smaller area,
+                                       for a pair to overlap. Defaults to MIN_OVERLAP.
+
+    Returns:
+        tuple: A tuple containing:
+            - np.ndarray: The (local) index of the best OSM candidate of each dumped building, or -1.
+            - np.ndarray: Its intersection over union.
+            - np.ndarray: The number of overlapping OSM buildings of each dumped building.
+            - np.ndarray: The mask of the OSM buildings overlapped by some dumped building.
+    """
+    dump_geometries = shapely.from_wkb(dump_wkb)
+    osm_geometries = shapely.from_wkb(osm_wkb)
+
+    n = len(dump_geometries)
+    best_osm = np.full(n, -1, dtype=np.int64)
+    best_iou = np.zeros(n)
+    n_candidates = np.zeros(n, dtype=np.int64)
+    osm_overlapped = np.zeros(len(osm_geometries), dtype=bool)
+
+    if not n or not len(osm_geometries):
+        return best_osm, best_iou, n_candidates, osm_overlapped
+
+    dump_idx, osm_idx = shapely.STRtree(osm_geometries).query(dump_geometries, predicate='intersects')
+
+    dump_areas = shapely.area(dump_geometries)[dump_idx]
+    osm_areas = shapely.area(osm_geometries)[osm_idx]
+    intersections = shapely.area(shapely.intersection(dump_geometries[dump_idx], osm_geometries[osm_idx]))
+
+    overlapping = intersections > min_overlap * np.minimum(dump_areas, osm_areas)
+    dump_idx, osm_idx = dump_idx[overlapping], osm_idx[overlapping]
+    intersections = intersections[overlapping]
+    unions = dump_areas[overlapping] + osm_areas[overlapping] - intersections
+    iou = intersections / unions
+
+    # best candidate of each dumped building: the first of its group, once sorted by decreasing IoU
+    order = np.lexsort((-iou, dump_idx))
+    dump_idx, osm_idx, iou = dump_idx[order], osm_idx[order], iou[order]
+    first = np.ones(len(dump_idx), dtype=bool)
+    first[1:] = dump_idx[1:] != dump_idx[:-1]
+
+    best_osm[dump_idx[first]] = osm_idx[first]
+    best_iou[dump_idx[first]] = iou[first]
+    n_candidates += np.bincount(dump_idx, minlength=n)
+    osm_overlapped[osm_idx] = True
+
+    return best_osm, best_iou, n_candidates, osm_overlapped
+
+def partition_by_tile(bounds, zoom=CONFLATION_ZOOM):
+    """
+    Groups geometries by the tile of their bbox center.
+
+    Args:
+        bounds (np.ndarray): The (n, 4) bounds of the geometries.
+        zoom (int, optional): The zoom level of the tiles. Defaults to CONFLATION_ZOOM.
+
+    Returns:
+        tuple: The positions of the geometries sorted by tile, and the start of each tile's
+               group in them (with a final end position).
+    """
+    x, y = lonlat_to_tiles((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2, zoom)
+    keys = x * (2 ** zoom) + y
+
+    order = np.argsort(keys, kind='stable')
+    starts = np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+
+    return order, np.append(starts, len(keys))
+
+def conflate(dump_folderpath, osm_path, outfolderpath, layername='buildings', zoom=CONFLATION_ZOOM, match_iou=MATCH_IOU,
+             min_overlap=MIN_OVERLAP, max_workers=None, oid_field='objectid'):
+    """
+    Conflates the dumped buildings with the buildings of a local OpenStreetMap extract.
+
+    Each dumped building is categorized as 'matched' (an OSM building overlaps it with an
+    intersection over union of at least `match_iou`), 'overlapping' (it overlaps OSM buildings,
+    but none enough to be the same one), 'new' (nothing in OSM) or 'no_geometry'. The OSM
+    buildings near the dump that no dumped building overlaps are listed too, as candidates for
+    demolished or missing buildings.
+
+    The dumped buildings are grouped by the tile of their bbox center (at `zoom`) and each tile
+    is compared, in a process pool, with the OSM buildings intersecting the extent of its
+    buildings, so buildings across tile borders are still compared.
+
+    Written to `outfolderpath`:
+        - '<layername>_conflation.jsonl': per dumped building, its objectid, category, best OSM
+          candidate ('osm_type', 'osm_id'), 'iou' and number of overlapping OSM buildings.
+        - '<layername>_osm_only.geojsonl': the OSM buildings no dumped building overlaps, with their tags.
+        - '<layername>_conflation_summary.json': the counts of each category (and of the dumped
+          buildings left out for not having an objectid).
+
+    Args:
+        dump_folderpath (str): The folder of the dumped GeoJSONL chunks (longitude/latitude).
+        osm_path (str): The .osm.pbf extract.
+        outfolderpath (str): The output folder.
+        layername (str, optional): The prefix of the output files. Defaults to 'buildings'.
+        zoom (int, optional): The zoom level of the partitioning tiles. Defaults to CONFLATION_ZOOM.
+        match_iou (float, optional): Minimum IoU of a match. Defaults to MATCH_IOU.
+        min_overlap (float, optional): Minimum intersection, as a fraction of the smaller area,
+                                       for buildings to overlap. Defaults to MIN_OVERLAP.
+        max_workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        dict: The summary.
+
+    Raises:
+        ValueError: If the folder has no chunks.
+    """
+    filepaths = sorted(listdir_fullpath(dump_folderpath, extension=CHUNK_EXTENSIONS), key=chunk_sort_key)
+
+    if not filepaths:
+        raise ValueError(f"No GeoJSONL chunks in {dump_folderpath}")
+
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        loaded = list(tqdm(executor.map(load_chunk_geometries, filepaths, [oid_field] * len(filepaths), chunksize=4),
+                           total=len(filepaths), desc='reading chunks'))
+
+    oids = np.concatenate([chunk_oids for chunk_oids, _, _ in loaded])
+    dump_geometries = shapely.from_wkb(np.concatenate([geometries for _, geometries, _ in loaded]))
+    n_no_oid = sum(n for _, _, n in loaded)
+    del loaded
+
+    located = ~shapely.is_missing(dump_geometries) & ~shapely.is_empty(dump_geometries)
+    dump_positions = np.flatnonzero(located)
+    dump_geometries = repair_geometries(dump_geometries[located])
+    dump_bounds = shapely.bounds(dump_geometries)
+
+    extent = (*dump_bounds[:, :2].min(axis=0), *dump_bounds[:, 2:].max(axis=0)) if len(dump_bounds) else None
+    osm = read_osm_areas(osm_path, key='building', bbox=extent, max_workers=max_workers)
+    osm_geometries = repair_geometries(osm['geometry'])
+
+    logging.info(f"Conflating {len(dump_geometries)} dumped buildings with {len(osm_geometries)} OSM buildings ({osm['skipped']} skipped)")
+
+    # tiles, and the OSM buildings intersecting the extent of each tile's buildings
+    order, starts = partition_by_tile(dump_bounds, zoom)
+    sorted_bounds = dump_bounds[order]
+    tile_boxes = shapely.box(np.minimum.reduceat(sorted_bounds[:, 0], starts[:-1]), np.minimum.reduceat(sorted_bounds[:, 1], starts[:-1]),
+                             np.maximum.reduceat(sorted_bounds[:, 2], starts[:-1]), np.maximum.reduceat(sorted_bounds[:, 3], starts[:-1])) if len(order) else np.empty(0, dtype=object)
+
+    tile_idx, osm_idx = shapely.STRtree(osm_geometries).query(tile_boxes)
+    osm_order = np.argsort(tile_idx, kind='stable')
+    osm_starts = np.searchsorted(tile_idx[osm_order], np.arange(len(tile_boxes) + 1))
+    osm_candidates = osm_idx[osm_order]
+
+    tasks = [(order[starts[t]:starts[t + 1]], osm_candidates[osm_starts[t]:osm_starts[t + 1]]) for t in range(len(tile_boxes))]
+
+    best_osm = np.full(len(dump_geometries), -1, dtype=np.int64)
+    best_iou = np.zeros(len(dump_geometries))
+    n_candidates = np.zeros(len(dump_geometries), dtype=np.int64)
+    osm_overlapped = np.zeros(len(osm_geometries), dtype=bool)
+    osm_near = np.zeros(len(osm_geometries), dtype=bool)
+    osm_near[osm_candidates] = True
+
+    dump_wkb = shapely.to_wkb(dump_geometries)
+    osm_wkb = shapely.to_wkb(osm_geometries)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(conflate_tile, [dump_wkb[positions] for positions, _ in tasks],
+                               [osm_wkb[candidates] for _, candidates in tasks], [min_overlap] * len(tasks), chunksize=4)
+
+        for (positions, candidates), (tile_best, tile_iou, tile_candidates, tile_overlapped) in tqdm(zip(tasks, results), total=len(tasks), desc='conflating tiles'):
+            found = tile_best >= 0
+            best_osm[positions[found]] = candidates[tile_best[found]]
+            best_iou[positions] = tile_iou
+            n_candidates[positions] = tile_candidates
+            osm_overlapped[candidates[tile_overlapped]] = True
+
+    categories = np.full(len(oids), 'no_geometry', dtype=object)
+    categories[dump_positions] = np.where(best_iou >= match_iou, 'matched', np.where(best_osm >= 0, 'overlapping', 'new'))
+
+    create_dir(outfolderpath)
+
+    all_best = np.full(len(oids), -1, dtype=np.int64)
+    all_best[dump_positions] = best_osm
+    all_iou = np.zeros(len(oids))
+    all_iou[dump_positions] = best_iou
+    all_candidates = np.zeros(len(oids), dtype=np.int64)
+    all_candidates[dump_positions] = n_candidates
+
+    with ChunkWriter(os.path.join(outfolderpath, f'{layername}_conflation.jsonl')) as writer:
+        for oid, category, best, iou, count in zip(oids.tolist(), categories, all_best.tolist(), all_iou.tolist(), all_candidates.tolist()):
+            writer.write(json.dumps({
+                oid_field: oid,
+                'category': category,
+                'osm_type': str(osm['osm_type'][best]) if best >= 0 else None,
+                'osm_id': int(osm['osm_id'][best]) if best >= 0 else None,
+                'iou': round(iou, 4),
+                'n_candidates': count,
+            }) + '\n')
+
+    osm_only = np.flatnonzero(osm_near & ~osm_overlapped)
+    with ChunkWriter(os.path.join(outfolderpath, f'{layername}_osm_only.geojsonl')) as writer:
+        for i, geometry in zip(osm_only.tolist(), shapely.to_geojson(osm_geometries[osm_only]).tolist()):
+            properties = {'osm_type': str(osm['osm_type'][i]), 'osm_id': int(osm['osm_id'][i]), **osm['tags'][i]}
+            writer.write(f'{{"type": "Feature", "geometry": {geometry}, "properties": {json.dumps(properties)}}}\n')
+
+    summary = {
+        'n_dumped': int(len(oids)),
+        'n_no_oid': n_no_oid,
+        'n_osm': int(len(osm_geometries)),
+        'n_osm_skipped': osm['skipped'],
+        'n_tiles': len(tasks),
+        **{f'n_{category}': int((categories == category).sum()) for category in CONFLATION_CATEGORIES},
+        'n_osm_only': int(len(osm_only)),
+        'match_iou': match_iou,
+        'elapsed': time.perf_counter() - start,
+    }
+
+    dump_json(summary, os.path.join(outfolderpath, f'{layername}_conflation_summary.json'))
+    logging.info(f"Conflation of {dump_folderpath} with {osm_path}: {json.dumps(summary)}")
+
+    return summary
@@ -16,5 +16,8 @@ LAYER_IDS = {
     'buildings_alt': '62'
 }
 
-# for tiled functions (yet to be implemented)
+# default folder of the HTTP response cache (see http_cache.py)
+HTTP_CACHE_FOLDER = 'cache/http'
+
+# zoom level of the slippy-map tiles used by the tiled functions (see tiles.py)
 ZOOM_LEVEL = 17
\ No newline at end of file
@@ -0,0 +1,506 @@
+import math
+import struct
+
+import numpy as np
+
+# decoder of the Esri FeatureCollection protocol buffers (query responses with 'f=pbf'),
+# into the layout of the Esri JSON responses, without needing the protobuf runtime
+
+GEOMETRY_TYPES = {
+    0: 'esriGeometryPoint',
+    1: 'esriGeometryMultipoint',
+    2: 'esriGeometryPolyline',
+    3: 'esriGeometryPolygon',
+    4: 'esriGeometryMultipatch',
+    127: 'esriGeometryNull',
+}
+
+FIELD_TYPES = {
+    0: 'esriFieldTypeSmallInteger',
+    1: 'esriFieldTypeInteger',
+    2: 'esriFieldTypeSingle',
+    3: 'esriFieldTypeDouble',
+    4: 'esriFieldTypeString',
+    5: 'esriFieldTypeDate',
+    6: 'esriFieldTypeOID',
+    7: 'esriFieldTypeGeometry',
+    8: 'esriFieldTypeBlob',
+    9: 'esriFieldTypeRaster',
+    10: 'esriFieldTypeGUID',
+    11: 'esriFieldTypeGlobalID',
+    12: 'esriFieldTypeXML',
+}
+
+def read_varint(buf, pos):
+    """
+    Reads one varint.
+
+    Args:
+        buf (memoryview): The buffer.
+        pos (int): The position of the varint.
+
+    Returns:
+        tuple: The value and the position after it.
+    """
+    result = 0
+    shift = 0
+
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def encode_varint(value):
+    """
+    Encodes one varint.
+
+    Args:
+        value (int): The (unsigned) value.
+
+    Returns:
+        bytes: The varint.
+    """
+    out = bytearray()
+
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if not value:
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+def iter_fields(buf):
+    """
+    Iterates over the fields of a protobuf message.
+
+    Args:
+        buf (memoryview): The message.
+
+    Yields:
+        tuple: The (field number, wire type, value) of each field; the value is an int for
+               varints and a memoryview for the others.
+
+    Raises:
+        ValueError: If the message is truncated or uses an unsupported wire type.
+    """
+    pos = 0
+    end = len(buf)
+
+    try:
+        while pos < end:
+            key, pos = read_varint(buf, pos)
+            number, wire_type = key >> 3, key & 7
+
+            if wire_type == 0:
+                value, pos = read_varint(buf, pos)
+            elif wire_type == 2:
+                length, pos = read_varint(buf, pos)
+                value = buf[pos:pos + length]
+                pos += length
+            elif wire_type == 1:
+                value = buf[pos:pos + 8]
+                pos += 8
+            elif wire_type == 5:
+                value = buf[pos:pos + 4]
+                pos += 4
+            else:
+                raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+            if pos > end:
+                raise ValueError("Truncated protobuf message")
+
+            yield number, wire_type, value
+    except IndexError:
+        raise ValueError("Truncated protobuf message")
+
+def read_packed_varints(buf):
+    """
+    Reads a short packed field of varints (see `decode_varints` for long ones).
+
+    Args:
+        buf (memoryview): The packed field.
+
+    Returns:
+        list: The values.
+    """
+    values = []
+    pos = 0
+
+    try:
+        while pos < len(buf):
+            value, pos = read_varint(buf, pos)
+            values.append(value)
+    except IndexError:
+        raise ValueError("Truncated packed varints")
+
+    return values
+
+def decode_varints(buf):
+    """
+    Vectorized decoding of a packed field of varints.
+
+    Args:
+        buf (memoryview): The packed field.
+
+    Returns:
+        np.ndarray: The values, as uint64.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.flatnonzero(data < 0x80)
+    if not len(ends) or ends[-1] != len(data) - 1:
+        raise ValueError("Truncated packed varints")
+
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+
+    # the 7 bit groups don't overlap, so adding them is or-ing them
+    return np.add.reduceat((data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts)
+
+def encode_varints(values):
+    """
+    Vectorized encoding of varints, e.g. for a packed field.
+
+    Args:
+        values (np.ndarray): The (unsigned) values; int64 ones are taken as their two's complement.
+
+    Returns:
+        bytes: The concatenated varints.
+    """
+    values = np.asarray(values).astype(np.int64).view(np.uint64)
+
+    if not len(values):
+        return b''
+
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+
+    out = np.empty(n_bytes.sum(), dtype=np.uint8)
+    starts = np.cumsum(n_bytes) - n_bytes
+
+    for k in range(n_bytes.max()):
+        active = n_bytes > k
+        group = ((values[active] >> np.uint64(7 * k)) & np.uint64(0x7f)).astype(np.uint8)
+        # the continuation bit on every byte but the last one
+        out[starts[active] + k] = group | ((n_bytes[active] > k + 1).astype(np.uint8) << 7)
+
+    return out.tobytes()
+
+def encode_zigzag(values):
+    """
+    Zigzag encodes (sint64) values.
+
+    Args:
+        values (np.ndarray): The values, as int64.
+
+    Returns:
+        np.ndarray: The raw uint64 values.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+def zigzag(values):
+    """
+    Decodes zigzag encoded (sint64) values.
+
+    Args:
+        values (np.ndarray): The raw uint64 values.
+
+    Returns:
+        np.ndarray: The values, as int64.
+    """
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def decode_value(buf):
+    """
+    Decodes an attribute value message.
+
+    Args:
+        buf (memoryview): The message.
+
+    Returns:
+        The value; None for an empty message (a null).
+    """
+    value = None
+
+    for number, _, raw in iter_fields(buf):
+        if number == 1:
+            value = bytes(raw).decode('utf-8')
+        elif number == 2:
+            value = struct.unpack('<f', raw)[0]
+        elif number == 3:
+            value = struct.unpack('<d', raw)[0]
+        elif number in (4, 8):
+            value = (raw >> 1) ^ -(raw & 1)
+        elif number in (5, 7):
+            value = raw
+        elif number == 6:
+            value = raw - (1 << 64) if raw >= 1 << 63 else raw
+        elif number == 9:
+            value = bool(raw)
+
+    return value
+
+def decode_transform(buf):
+    """
+    Decodes the quantization transform of a feature result.
+
+    Args:
+        buf (memoryview): The transform message.
+
+    Returns:
+        dict: The 'upper_left' origin flag, and the 'scale' and 'translate' (x, y, m, z) tuples.
+    """
+    transform = {'upper_left': True, 'scale': [1.0, 1.0, 1.0, 1.0], 'translate': [0.0, 0.0, 0.0, 0.0]}
+
+    for number, _, value in iter_fields(buf):
+        if number == 1:
+            transform['upper_left'] = value == 0
+        elif number in (2, 3):
+            key = 'scale' if number == 2 else 'translate'
+            for sub_number, _, raw in iter_fields(value):
+                if 1 <= sub_number <= 4:
+                    transform[key][sub_number - 1] = struct.unpack('<d', raw)[0]
+
+    return transform
+
+def decode_geometries(raw_geometries, geometry_type, transform, has_z=False, has_m=False, precision=None):
+    """
+    Decodes the geometry messages of a page into Esri JSON geometries.
+
+    The coordinates are quantized integers, delta encoded within each part (ring, path...),
+    which are dequantized with the transform of the feature result. The coordinates of all
+    the geometries are decoded at once, with vectorized operations.
+
+    Args:
+        raw_geometries (list): The geometry messages (memoryviews).
+        geometry_type (str): The Esri geometry type.
+        transform (dict): The transform, from `decode_transform`.
+        has_z (bool, optional): Whether the coordinates have a z value. Defaults to False.
+        has_m (bool, optional): Whether the coordinates have a m value. Defaults to False.
+        precision (int, optional): The number of decimals to round the coordinates to.
+                                   Defaults to None (no rounding).
+
+    Returns:
+        list: The geometries.
+    """
+    dims = 2 + has_z + has_m
+    part_lengths = []
+    parts_per_geometry = []
+    packed_coords = []
+
+    for buf in raw_geometries:
+        lengths = []
+        coords = []
+        for number, wire_type, value in iter_fields(buf):
+            if number == 2:
+                lengths.extend(read_packed_varints(value) if wire_type == 2 else [value])
+            elif number == 3:
+                # non packed coordinates are re-encoded as a packed varint
+                coords.append(bytes(value) if wire_type == 2 else encode_varint(value))
+
+        coords = b''.join(coords)
+        if not lengths:
+            lengths = [sum(1 for byte in coords if byte < 0x80) // dims]
+
+        part_lengths.extend(lengths)
+        parts_per_geometry.append(len(lengths))
+        packed_coords.append(coords)
+
+    if not raw_geometries:
+        return []
+
+    points = zigzag(decode_varints(b''.join(packed_coords))).reshape(-1, dims)
+    lengths = np.array(part_lengths, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+
+    # undoing the delta encoding, restarting at each part
+    totals = np.cumsum(points, axis=0)
+    bases = np.zeros((len(lengths), dims), dtype=np.int64)
+    nonempty = starts > 0
+    bases[nonempty] = totals[starts[nonempty] - 1]
+    absolute = totals - np.repeat(bases, lengths, axis=0)
+
+    scale, translate = transform['scale'], transform['translate']
+    values = np.empty(absolute.shape, dtype=np.float64)
+    values[:, 0] = translate[0] + absolute[:, 0] * scale[0]
+    if transform['upper_left']:
+        values[:, 1] = translate[1] - absolute[:, 1] * scale[1]
+    else:
+        values[:, 1] = translate[1] + absolute[:, 1] * scale[1]
+    if has_z:
+        values[:, 2] = translate[3] + absolute[:, 2] * scale[3]
+    if has_m:
+        values[:, -1] = translate[2] + absolute[:, -1] * scale[2]
+
+    if precision is not None:
+        values = values.round(precision)
+
+    values = values.tolist()
+    parts = [values[start:start + length] for start, length in zip(starts.tolist(), part_lengths)]
+
+    geometries = []
+    part_index = 0
+
+    for n_parts in parts_per_geometry:
+        geometry_parts = parts[part_index:part_index + n_parts]
+        part_index += n_parts
+
+        if geometry_type == 'esriGeometryPoint':
+            point = geometry_parts[0][0]
+            geometry = {'x': point[0], 'y': point[1]}
+            if has_z:
+                geometry['z'] = point[2]
+            if has_m:
+                geometry['m'] = point[-1]
+        elif geometry_type == 'esriGeometryMultipoint':
+            geometry = {'points': [point for part in geometry_parts for point in part]}
+        elif geometry_type == 'esriGeometryPolyline':
+            geometry = {'paths': geometry_parts}
+        else:
+            geometry = {'rings': geometry_parts}
+
+        geometries.append(geometry)
+
+    return geometries
+
+def decode_feature_collection(data, precision=None):
+    """
+    Decodes a 'f=pbf' query response.
+
+    Args:
+        data (bytes): The response body.
+        precision (int, optional): The number of decimals to round the coordinates to.
+                                   Defaults to None (no rounding).
+
+    Returns:
+        dict: The response, laid out as the Esri JSON one ('features' with 'attributes' and
+              'geometry', 'fields', 'exceededTransferLimit'...); or {'count': ...} and
+              {'objectIds': [...]} for count and ids only queries.
+
+    Raises:
+        ValueError: If the response is not a valid feature collection.
+    """
+    query_result = None
+
+    for number, _, value in iter_fields(memoryview(data)):
+        if number == 2:
+            query_result = value
+
+    if query_result is None:
+        raise ValueError("No query result in the protobuf response")
+
+    for number, _, value in iter_fields(query_result):
+        if number == 2:
+            return {'count': next((raw for sub_number, _, raw in iter_fields(value) if sub_number == 1), 0)}
+        elif number == 3:
+            oids = []
+            for sub_number, wire_type, raw in iter_fields(value):
+                if sub_number == 3:
+                    oids.extend(decode_varints(raw).tolist() if wire_type == 2 else [raw])
+            return {'objectIds': oids}
+        elif number == 1:
+            return decode_feature_result(value, precision=precision)
+
+    raise ValueError("Empty query result in the protobuf response")
+
+def decode_feature_result(buf, precision=None):
+    """
+    Decodes the feature result message of a query response; see `decode_feature_collection`.
+    """
+    result = {'geometryType': 'esriGeometryNull', 'exceededTransferLimit': False, 'fields': [], 'features': []}
+    transform = {'upper_left': True, 'scale': [1.0, 1.0, 1.0, 1.0], 'translate': [0.0, 0.0, 0.0, 0.0]}
+    has_z = has_m = False
+    raw_features = []
+
+    for number, _, value in iter_fields(buf):
+        if number == 1:
+            result['objectIdFieldName'] = bytes(value).decode('utf-8')
+        elif number == 7:
+            result['geometryType'] = GEOMETRY_TYPES.get(value, 'esriGeometryNull')
+        elif number == 8:
+            for sub_number, _, raw in iter_fields(value):
+                if sub_number == 1:
+                    result['spatialReference'] = {'wkid': raw}
+        elif number == 9:
+            result['exceededTransferLimit'] = bool(value)
+        elif number == 10:
+            has_z = bool(value)
+        elif number == 11:
+            has_m = bool(value)
+        elif number == 12:
+            transform = decode_transform(value)
+        elif number == 13:
+            field = {}
+            for sub_number, _, raw in iter_fields(value):
+                if sub_number == 1:
+                    field['name'] = bytes(raw).decode('utf-8')
+                elif sub_number == 2:
+                    field['type'] = FIELD_TYPES.get(raw)
+            result['fields'].append(field)
+        elif number == 15:
+            raw_features.append(value)
+
+    names = [field.get('name') for field in result['fields']]
+    geometry_type = result['geometryType']
+
+    raw_geometries = []
+
+    for raw_feature in raw_features:
+        values = []
+        raw_geometry = None
+
+        for number, _, value in iter_fields(raw_feature):
+            if number == 1:
+                values.append(decode_value(value))
+            elif number == 2:
+                raw_geometry = value
+
+        feature = {'attributes': dict(zip(names, values))}
+        if raw_geometry is not None:
+            raw_geometries.append((feature, raw_geometry))
+        result['features'].append(feature)
+
+    geometries = decode_geometries([raw for _, raw in raw_geometries], geometry_type, transform, has_z=has_z, has_m=has_m, precision=precision)
+
+    for (feature, _), geometry in zip(raw_geometries, geometries):
+        feature['geometry'] = geometry
+
+    return result
+
+def features_match(features, reference, tolerance):
+    """
+    Checks that decoded features match the same features requested as JSON.
+
+    Args:
+        features (list): The decoded Esri features.
+        reference (list): The Esri JSON features.
+        tolerance (float): The maximum coordinate difference.
+
+    Returns:
+        bool: Whether the attributes are equal (floats up to single precision) and the
+              coordinates within the tolerance.
+    """
+    def close(a, b):
+        if isinstance(a, dict) and isinstance(b, dict):
+            return a.keys() == b.keys() and all(close(a[key], b[key]) for key in a)
+        if isinstance(a, list) and isinstance(b, list):
+            return len(a) == len(b) and all(close(x, y) for x, y in zip(a, b))
+        if isinstance(a, float) or isinstance(b, float):
+            return isinstance(a, (int, float)) and isinstance(b, (int, float)) and math.isclose(a, b, rel_tol=1e-6, abs_tol=tolerance)
+        return a == b
+
+    return len(features) == len(reference) and all(
+        close(feature['attributes'], expected['attributes']) and close(feature.get('geometry'), expected.get('geometry'))
+        for feature, expected in zip(features, reference)
+    )
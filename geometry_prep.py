@@ -0,0 +1,366 @@
+from lib import *
+
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from checker import chunk_sort_key, fastjson
+
+# metres per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320.0
+
+# the OSM coordinate grid: 7 decimals, about 1 cm
+OSM_GRID_SIZE = 10 ** -OSM_GEOMETRY_PRECISION
+
+# consecutive vertices closer than this (in degrees) are the same vertex
+DUPLICATE_VERTEX_TOLERANCE = OSM_GRID_SIZE
+
+# Douglas-Peucker tolerance of the simplification, in metres: drops the nearly collinear vertices
+# of the cadastral footprints, well below what can be checked on the imagery of the OSM editors
+SIMPLIFY_TOLERANCE = 0.1
+
+# polygon parts thinner than this (twice their area over their perimeter, in metres) are slivers
+SLIVER_WIDTH = 0.01
+
+# minimum intersection over union of two footprints to be near-duplicates
+NEAR_DUPLICATE_IOU = 0.9
+
+# the objectid of the features without one, in the objectid arrays
+NO_OID = -1
+
+GEOMETRY_ISSUES = ('no_geometry', 'not_polygonal', 'duplicate_vertices', 'invalid', 'sliver', 'collapsed', 'near_duplicate')
+
+def to_local_meters(geometries):
+    """
+    Scales longitude/latitude geometries to approximate metres around their mean latitude,
+    enough for the areas and widths of buildings.
+
+    Args:
+        geometries (np.ndarray): The shapely geometries, without missing ones.
+
+    Returns:
+        np.ndarray: The scaled geometries.
+    """
+    if not len(geometries):
+        return geometries
+
+    latitude = np.nanmean(shapely.bounds(geometries)[:, [1, 3]])
+    scale = np.array([METERS_PER_DEGREE * np.cos(np.radians(latitude)), METERS_PER_DEGREE])
+
+    return shapely.transform(geometries, lambda coords: coords * scale)
+
+def prepare_block_geometries(geometries, simplify_tolerance=SIMPLIFY_TOLERANCE, sliver_width=SLIVER_WIDTH):
+    """
+    Validates and cleans a block of longitude/latitude footprints with array-wide shapely operations.
+
+    In order: repeated vertices are removed, invalid geometries are made valid (`make_valid`),
+    the footprints are simplified (keeping the original where the simplified one would be
+    invalid), non-polygonal parts and slivers are dropped, and the coordinates are snapped to
+    the OSM grid (keeping the output valid). Non-polygonal features are left untouched.
+
+    Args:
+        geometries (np.ndarray): The shapely geometries, None for the features without one.
+        simplify_tolerance (float, optional): The simplification tolerance, in metres.
+                                              Defaults to SIMPLIFY_TOLERANCE.
+        sliver_width (float, optional): The width under which a part is a sliver, in metres.
+                                        Defaults to SLIVER_WIDTH.
+
+    Returns:
+        tuple: A tuple containing:
+            - np.ndarray: The prepared geometries (None where nothing is left).
+            - np.ndarray: The (n, len(GEOMETRY_ISSUES)) boolean matrix of the issues found.
+            - np.ndarray: The invalidity reason of the invalid geometries, None for the others.
+            - np.ndarray: The number of vertices of each geometry, before and after, as (n, 2).
+    """
+    n = len(geometries)
+    issues = np.zeros((n, len(GEOMETRY_ISSUES)), dtype=bool)
+    flag = {issue: issues[:, i] for i, issue in enumerate(GEOMETRY_ISSUES)}
+    reasons = np.full(n, None, dtype=object)
+    prepared = geometries.copy()
+
+    missing = shapely.is_missing(geometries) | shapely.is_empty(geometries)
+    polygonal = np.isin(shapely.get_type_id(geometries), [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON])
+    flag['no_geometry'][:] = missing
+    flag['not_polygonal'][:] = ~missing & ~polygonal
+
+    vertices = np.zeros((n, 2), dtype=np.int64)
+    vertices[:, 0] = shapely.get_num_coordinates(geometries)
+    vertices[:, 1] = vertices[:, 0]
+
+    work = np.flatnonzero(~missing & polygonal)
+    if not len(work):
+        return prepared, issues, reasons, vertices
+
+    g = shapely.remove_repeated_points(geometries[work], tolerance=DUPLICATE_VERTEX_TOLERANCE)
+    flag['duplicate_vertices'][work] = shapely.get_num_coordinates(g) < vertices[work, 0]
+
+    invalid = ~shapely.is_valid(g)
+    if invalid.any():
+        # 'Ring Self-intersection[-49.27 -25.43]' -> 'Ring Self-intersection'
+        reasons[work[invalid]] = [reason.split('[')[0] for reason in shapely.is_valid_reason(g[invalid])]
+        g[invalid] = shapely.make_valid(g[invalid])
+    flag['invalid'][work] = invalid
+
+    simplified = shapely.simplify(g, simplify_tolerance / METERS_PER_DEGREE, preserve_topology=True)
+    g = np.where(shapely.is_valid(simplified), simplified, g)
+
+    # make_valid may have left lines and points (collapsed spikes) next to the polygons
+    parts, part_index = shapely.get_parts(g, return_index=True)
+    keep = shapely.get_type_id(parts) == shapely.GeometryType.POLYGON
+    local = to_local_meters(parts[keep])
+    widths = 2 * shapely.area(local) / np.maximum(shapely.length(local), 1e-12)
+    keep[keep] = widths >= sliver_width
+
+    n_parts = np.bincount(part_index, minlength=len(work))
+    n_kept = np.bincount(part_index[keep], minlength=len(work))
+    flag['sliver'][work] = n_kept < n_parts
+
+    rebuilt = np.full(len(work), None, dtype=object)
+    if keep.any():
+        # the features left without parts stay None
+        shapely.multipolygons(parts[keep], indices=part_index[keep], out=rebuilt)
+        single = n_kept == 1
+        rebuilt[single] = shapely.get_geometry(rebuilt[single], 0)
+
+    rebuilt = shapely.set_precision(rebuilt, OSM_GRID_SIZE)
+    collapsed = shapely.is_missing(rebuilt) | shapely.is_empty(rebuilt)
+    rebuilt[collapsed] = None
+    flag['collapsed'][work] = collapsed
+
+    prepared[work] = rebuilt
+    vertices[work, 1] = shapely.get_num_coordinates(rebuilt)
+
+    return prepared, issues, reasons, vertices
+
+def prep_block(block, oid_field='objectid', simplify_tolerance=SIMPLIFY_TOLERANCE, sliver_width=SLIVER_WIDTH):
+    """
+    Prepares a block of features: a task of the process pool.
+
+    Args:
+        block (bytes or pa.RecordBatch): GeoJSONL lines, or a batch of a GeoParquet file.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+        simplify_tolerance (float, optional): The simplification tolerance, in metres.
+                                              Defaults to SIMPLIFY_TOLERANCE.
+        sliver_width (float, optional): The width under which a part is a sliver, in metres.
+                                        Defaults to SLIVER_WIDTH.
+
+    Returns:
+        tuple: The prepared GeoJSONL lines (bytes), the objectids (np.ndarray, NO_OID for the
+               features without one), the issues, reasons and vertex counts (see
+               `prepare_block_geometries`) and the prepared geometries as WKB, which is much
+               cheaper to send between processes than shapely objects.
+    """
+    if isinstance(block, bytes):
+        lines = [line for line in block.split(b'\n') if line.strip()]
+        properties = [fastjson.loads(line).get('properties') or {} for line in lines]
+        geometries = shapely.from_geojson([line.decode('utf-8') for line in lines], on_invalid='ignore')
+    else:
+        geometries = shapely.from_wkb(block.column('geometry').to_numpy(zero_copy_only=False))
+        properties = block.drop_columns(['geometry']).to_pylist()
+
+    prepared, issues, reasons, vertices = prepare_block_geometries(geometries, simplify_tolerance, sliver_width)
+
+    out = []
+    for feature_properties, geometry in zip(properties, shapely.to_geojson(prepared).tolist()):
+        out.append(f'{{"type": "Feature", "geometry": {geometry or "null"}, "properties": {json.dumps(feature_properties)}}}\n')
+
+    oids = [feature_properties.get(oid_field) for feature_properties in properties]
+    oids = np.array([NO_OID if oid is None else oid for oid in oids], dtype=np.int64)
+
+    return ''.join(out).encode('utf-8'), oids, issues, reasons, vertices, shapely.to_wkb(prepared)
+
+def iter_input_blocks(input_path, block_size):
+    """
+    Splits the features to prepare into blocks.
+
+    Args:
+        input_path (str): A folder of GeoJSONL chunks, a single GeoJSONL file (plain or
+                          compressed) or a GeoParquet file (as written by `streaming_dumper`).
+        block_size (int): The maximum number of features per block.
+
+    Yields:
+        tuple: The name of the output file of the block, and the block (see `prep_block`).
+    """
+    if input_path.endswith('.parquet'):
+        outname = os.path.basename(input_path)[:-len('.parquet')] + '.geojsonl'
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=block_size):
+            yield outname, batch
+        return
+
+    if os.path.isdir(input_path):
+        filepaths = sorted(listdir_fullpath(input_path, extension=CHUNK_EXTENSIONS), key=chunk_sort_key)
+    else:
+        filepaths = [input_path]
+
+    for filepath in filepaths:
+        lines = []
+        for line in iter_chunk_lines(filepath):
+            lines.append(line)
+            if len(lines) >= block_size:
+                yield os.path.basename(filepath), b'\n'.join(lines)
+                lines = []
+        if lines:
+            yield os.path.basename(filepath), b'\n'.join(lines)
+
+def find_near_duplicates(geometries, min_iou=NEAR_DUPLICATE_IOU):
+    """
+    Finds the pairs of footprints covering nearly the same area, with a bulk STRtree query.
+
+    Args:
+        geometries (np.ndarray): The shapely geometries, None for the features without one.
+        min_iou (float, optional): Minimum intersection over union of a pair.
+                                   Defaults to NEAR_DUPLICATE_IOU.
+
+    Returns:
+        tuple: The positions of the two footprints of each pair (np.ndarray, first < second),
+               and their intersection over union.
+    """
+    located = np.flatnonzero(~shapely.is_missing(geometries) & np.isin(shapely.get_type_id(geometries),
+                                                                      [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]))
+    polygons = geometries[located]
+
+    first, second = shapely.STRtree(polygons).query(polygons, predicate='intersects')
+    pairs = first < second
+    first, second = first[pairs], second[pairs]
+
+    # at the size of a building, longitude/latitude areas are distorted by a constant factor, which cancels out
+    areas = shapely.area(polygons)
+    intersections = shapely.area(shapely.intersection(polygons[first], polygons[second]))
+    iou = intersections / np.maximum(areas[first] + areas[second] - intersections, 1e-30)
+
+    duplicates = iou >= min_iou
+
+    return located[first[duplicates]], located[second[duplicates]], iou[duplicates]
+
+def prepare_geometries(input_path, outfolderpath, layername='buildings', block_size=5000, simplify_tolerance=SIMPLIFY_TOLERANCE,
+                       sliver_width=SLIVER_WIDTH, near_duplicate_iou=NEAR_DUPLICATE_IOU, max_workers=None, oid_field='objectid'):
+    """
+    Validates and cleans the geometries of dumped buildings before the import to OSM.
+
+    The features are read in blocks of `block_size`, prepared in a process pool (see
+    `prepare_block_geometries`: repeated vertices, `make_valid`, simplification, slivers, OSM
+    grid) and written again with the same attributes. Then the footprints covering nearly the
+    same area as another one (`near_duplicate_iou`) are flagged, over the whole dump.
+
+    Written to `outfolderpath`:
+        - The prepared GeoJSONL chunks, with the names of the input ones ('<name>.geojsonl' for
+          a GeoParquet input).
+        - '<layername>_geometry_issues.jsonl': per feature with some issue, its objectid (null
+          if it has none), issues, invalidity reason and near-duplicate objectids.
+        - '<layername>_geometry_report.json': the counts of each issue and invalidity reason,
+          and of the features without an objectid (prepared all the same).
+
+    Args:
+        input_path (str): A folder of GeoJSONL chunks, a single GeoJSONL file or a GeoParquet
+                          file, in longitude/latitude.
+        outfolderpath (str): The output folder, which must not be the input one.
+        layername (str, optional): The prefix of the report files. Defaults to 'buildings'.
+        block_size (int, optional): The number of features per task. Defaults to 5000.
+        simplify_tolerance (float, optional): The simplification tolerance, in metres.
+                                              Defaults to SIMPLIFY_TOLERANCE.
+        sliver_width (float, optional): The width under which a part is a sliver, in metres.
+                                        Defaults to SLIVER_WIDTH.
+        near_duplicate_iou (float, optional): Minimum intersection over union of near-duplicate
+                                              footprints. Defaults to NEAR_DUPLICATE_IOU.
+        max_workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        dict: The report.
+
+    Raises:
+        ValueError: If the input has no features, or the output folder is the input one.
+    """
+    if os.path.isdir(input_path) and os.path.abspath(input_path) == os.path.abspath(outfolderpath):
+        raise ValueError("outfolderpath cannot be the input folder")
+
+    start = time.perf_counter()
+    create_dir(outfolderpath)
+
+    all_oids, all_issues, all_reasons, all_vertices, all_wkb = [], [], [], [], []
+    writers = {}
+
+    def collect(outname, result):
+        lines, oids, issues, reasons, vertices, wkb = result
+
+        if outname not in writers:
+            # the blocks come in order: the previous file is complete
+            for writer in writers.values():
+                writer.close()
+            writers.clear()
+            writers[outname] = ChunkWriter(os.path.join(outfolderpath, outname))
+
+        writers[outname].write(lines.decode('utf-8'))
+
+        all_oids.append(oids)
+        all_issues.append(issues)
+        all_reasons.append(reasons)
+        all_vertices.append(vertices)
+        all_wkb.append(wkb)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        window = 2 * (max_workers or os.cpu_count() or 1)
+        pending = collections.deque()
+
+        for outname, block in tqdm(iter_input_blocks(input_path, block_size), desc='preparing blocks'):
+            pending.append((outname, executor.submit(prep_block, block, oid_field, simplify_tolerance, sliver_width)))
+            if len(pending) >= window:
+                outname, future = pending.popleft()
+                collect(outname, future.result())
+
+        while pending:
+            outname, future = pending.popleft()
+            collect(outname, future.result())
+
+    for writer in writers.values():
+        writer.close()
+
+    if not all_oids:
+        raise ValueError(f"No features in {input_path}")
+
+    oids = np.concatenate(all_oids)
+    issues = np.concatenate(all_issues)
+    reasons = np.concatenate(all_reasons)
+    vertices = np.concatenate(all_vertices)
+    geometries = shapely.from_wkb(np.concatenate(all_wkb))
+    del all_oids, all_issues, all_reasons, all_vertices, all_wkb
+
+    first, second, iou = find_near_duplicates(geometries, near_duplicate_iou)
+    issues[first, GEOMETRY_ISSUES.index('near_duplicate')] = True
+    issues[second, GEOMETRY_ISSUES.index('near_duplicate')] = True
+
+    # by position, as the features without an objectid share NO_OID
+    duplicates = collections.defaultdict(list)
+    for a, b in zip(first.tolist(), second.tolist()):
+        duplicates[a].append(int(oids[b]))
+        duplicates[b].append(int(oids[a]))
+
+    flagged = np.flatnonzero(issues.any(axis=1))
+    with ChunkWriter(os.path.join(outfolderpath, f'{layername}_geometry_issues.jsonl')) as writer:
+        for i in flagged.tolist():
+            oid = int(oids[i])
+            writer.write(json.dumps({
+                oid_field: None if oid == NO_OID else oid,
+                'issues': [issue for issue, found in zip(GEOMETRY_ISSUES, issues[i]) if found],
+                'invalid_reason': reasons[i],
+                'near_duplicates': sorted(other for other in duplicates.get(i, []) if other != NO_OID),
+            }) + '\n')
+
+    report = {
+        'n_features': int(len(oids)),
+        'n_no_oid': int((oids == NO_OID).sum()),
+        'n_flagged': int(len(flagged)),
+        **{f'n_{issue}': int(issues[:, i].sum()) for i, issue in enumerate(GEOMETRY_ISSUES)},
+        'n_near_duplicate_pairs': int(len(iou)),
+        'invalid_reasons': dict(collections.Counter(reason for reason in reasons if reason is not None).most_common()),
+        'n_vertices_before': int(vertices[:, 0].sum()),
+        'n_vertices_after': int(vertices[:, 1].sum()),
+        'simplify_tolerance': simplify_tolerance,
+        'sliver_width': sliver_width,
+        'near_duplicate_iou': near_duplicate_iou,
+        'elapsed': time.perf_counter() - start,
+    }
+
+    dump_json(report, os.path.join(outfolderpath, f'{layername}_geometry_report.json'))
+    logging.info(f"Geometry preparation of {input_path}: {json.dumps(report)}")
+
+    return report
@@ -0,0 +1,253 @@
+import os, json
+import gzip
+import hashlib
+import logging
+import threading
+import time
+
+import requests
+
+from esri_pbf import decode_feature_collection
+
+class CacheMissError(requests.exceptions.ConnectionError):
+    """
+    Raised by an offline ResponseCache for a request that is not cached.
+    """
+
+def is_cacheable_body(body):
+    """
+    Tells whether a 200 response body is complete and successful: a JSON object without an
+    Esri error, or a protocol buffer feature collection that decodes.
+
+    Args:
+        body (bytes): The response body.
+
+    Returns:
+        bool: Whether the body can be cached.
+    """
+    if body.lstrip().startswith(b'{'):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return False
+        return isinstance(data, dict) and not data.get('error')
+
+    try:
+        decode_feature_collection(body)
+    except ValueError:
+        return False
+
+    return True
+
+class ResponseCache:
+    """
+    On-disk, content-addressed cache of HTTP responses.
+
+    A request is keyed by the hash of its method, URL and query/form arguments; the key points
+    ('refs/') to a gzip-compressed response body stored under the hash of its content ('blobs/'),
+    so identical responses are stored once. Entries older than `ttl` seconds are ignored, and
+    the least recently used blobs are evicted once the blobs exceed `max_bytes`. Only successful
+    responses are cached: HTTP 200 with a body that parses (as JSON or as a protocol buffer)
+    and has no Esri error payload, so a truncated body is never served again.
+
+    In offline mode no request is sent at all: misses raise CacheMissError.
+
+    Args:
+        folderpath (str): The folder of the cache.
+        ttl (float, optional): The maximum age of the entries, in seconds. Defaults to one day.
+                               None means entries never expire.
+        max_bytes (int, optional): The maximum (compressed) size of the cached bodies.
+                                   Defaults to 2 GiB.
+        offline (bool, optional): Whether to serve only from the cache. Defaults to False.
+    """
+    def __init__(self, folderpath, ttl=24 * 3600, max_bytes=2 * 1024 ** 3, offline=False):
+        self.folderpath = folderpath
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def request_key(method, url, params=None, data=None):
+        """
+        Computes the cache key of a request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            params (dict, optional): The query string arguments. Defaults to None.
+            data (dict, optional): The form arguments. Defaults to None.
+
+        Returns:
+            str: The hex sha256 key.
+        """
+        payload = json.dumps([method.upper(), url, sorted((params or {}).items()), sorted((data or {}).items())], default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, kind, digest):
+        return os.path.join(self.folderpath, kind, digest[:2], digest)
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _blob_paths(self):
+        blobs_folderpath = os.path.join(self.folderpath, 'blobs')
+        for dirpath, _, filenames in os.walk(blobs_folderpath):
+            for filename in filenames:
+                if not filename.endswith('.tmp'):
+                    yield os.path.join(dirpath, filename)
+
+    def get(self, key):
+        """
+        Looks up a request key.
+
+        Args:
+            key (str): The request key.
+
+        Returns:
+            tuple: The (ref, body) of the cached response, or None on a miss.
+        """
+        ref_path = self._path('refs', key)
+
+        try:
+            with open(ref_path, encoding='utf-8') as f:
+                ref = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl is not None and time.time() - ref['created'] > self.ttl:
+            return None
+
+        blob_path = self._path('blobs', ref['sha256'])
+
+        try:
+            with open(blob_path, 'rb') as f:
+                body = gzip.decompress(f.read())
+            # the modification time of the blobs is their last use, for the LRU eviction
+            os.utime(blob_path)
+        except (OSError, EOFError):
+            return None
+
+        return ref, body
+
+    def put(self, key, response):
+        """
+        Stores a response, if it is a successful one.
+
+        Args:
+            key (str): The request key.
+            response (requests.Response): The response.
+        """
+        body = response.content
+
+        if response.status_code != 200 or not is_cacheable_body(body):
+            return
+
+        sha256 = hashlib.sha256(body).hexdigest()
+        blob_path = self._path('blobs', sha256)
+
+        with self._lock:
+            if not os.path.exists(blob_path):
+                compressed = gzip.compress(body, compresslevel=6)
+                self._write(blob_path, compressed)
+
+                if self._size is not None:
+                    self._size += len(compressed)
+
+            ref = {
+                'url': response.url,
+                'sha256': sha256,
+                'created': time.time(),
+                'content_type': response.headers.get('Content-Type'),
+            }
+            self._write(self._path('refs', key), json.dumps(ref).encode('utf-8'))
+
+            self._evict()
+
+    def evict(self, key):
+        """
+        Forgets a request key, e.g. when its cached response turned out to be unusable. The blob
+        stays, as other keys may point to it, until the LRU eviction.
+
+        Args:
+            key (str): The request key.
+        """
+        with self._lock:
+            try:
+                os.remove(self._path('refs', key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not evict cached request {key}: {e}")
+
+    def _evict(self):
+        if self._size is None:
+            self._size = sum(os.path.getsize(path) for path in self._blob_paths())
+
+        if self._size <= self.max_bytes:
+            return
+
+        # least recently used first; refs to evicted blobs become misses
+        for path in sorted(self._blob_paths(), key=os.path.getmtime):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._size -= size
+            except OSError as e:
+                logging.warning(f"Could not evict cached response {path}: {e}")
+
+    def request(self, method, url, send, params=None, data=None):
+        """
+        Serves a request from the cache, or sends it with `send` and caches the response.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            send (callable): Sends the request and returns a requests.Response.
+            params (dict, optional): The query string arguments. Defaults to None.
+            data (dict, optional): The form arguments. Defaults to None.
+
+        Returns:
+            requests.Response: The (possibly cached) response.
+
+        Raises:
+            CacheMissError: If offline and the request is not cached.
+        """
+        key = self.request_key(method, url, params=params, data=data)
+        cached = self.get(key)
+
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            ref, body = cached
+
+            response = requests.Response()
+            response.status_code = 200
+            response._content = body
+            response.url = ref['url']
+            response.headers['Content-Type'] = ref.get('content_type') or 'application/json'
+            response.request = requests.Request(method, url, params=params, data=data).prepare()
+
+            return response
+
+        with self._lock:
+            self.misses += 1
+
+        if self.offline:
+            raise CacheMissError(f"Offline cache miss for {method} {url} {params or data}")
+
+        response = send()
+        self.put(key, response)
+
+        return response
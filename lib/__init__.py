@@ -0,0 +1,150 @@
+"""
+The dumping library, split into submodules that import their heavy dependencies only when used:
+
+    lib.files       - files and JSON helpers (standard library only)
+    lib.crs         - CRS lookups and vectorized reprojection (pyproj, numpy)
+    lib.esri        - the map server client: EsriDumper, response cache, host budget, layer metadata (esridump)
+    lib.endpoints   - the main and alternative servers of a layer: equivalence check and failover pool
+    lib.geoparquet  - GeoParquet schemas and streaming writer (pyarrow, shapely)
+    lib.compression - chunk codecs (gzip, zstd), streaming chunk readers and feature serialization
+    lib.chunks      - chunk files and their manifests
+    lib.paging      - the checkpointed, retrying pager and fetch profiles
+    lib.dumpers     - the dumpers
+
+Importing `lib` itself is cheap and has no side effects: its names are resolved from the
+submodules on first access, and creating the working folders and configuring the log file is
+done by `init`. `from lib import *` still provides everything it always did (the submodule
+names plus the modules and names the scripts rely on: gpd, np, pq, tqdm...), at the cost of
+importing all of it.
+"""
+import importlib
+import logging
+
+from constants import *
+
+# public name -> submodule defining it
+_EXPORTS = {
+    'lib.files': ['create_dir', 'create_folderlist', 'read_json', 'Int64Encoder', 'dump_json', 'append_to_file',
+                  'read_file_as_list', 'listdir_fullpath', 'file_sha256', 'list_of_set_of_list'],
+    'lib.crs': ['OSM_CRS', 'get_layer_crs', 'crs_wkid', 'get_transformer', 'transform_coords', 'reproject_features'],
+    'lib.esri': ['set_http_cache', 'evict_cached_response', 'HostBudget', 'set_host_budget', 'EsriDumper', 'get_layer_url',
+                 'get_layer_metadata', 'get_basic_layer_stuff', 'get_layer_oid_stats', 'TRANSIENT_HTTP_STATUSES', 'TransientDownloadError',
+                 'PermanentDownloadError', 'parse_esri_response'],
+    'lib.endpoints': ['LayerEndpoint', 'get_layer_endpoints', 'check_endpoints_equivalent', 'EndpointPool'],
+    'lib.geoparquet': ['ESRI_ARROW_TYPES', 'arrow_schema_from_metadata', 'features_to_arrow', 'write_geoparquet_stream'],
+    'lib.compression': ['CHUNK_CODECS', 'CHUNK_EXTENSIONS', 'DEFAULT_LEVELS', 'chunk_extension', 'chunk_codec',
+                        'strip_chunk_extension', 'get_compressor', 'get_decompressor', 'open_chunk', 'read_chunk',
+                        'iter_chunk_lines', 'chunk_sha256', 'round_coordinates', 'serialize_feature'],
+    'lib.chunks': ['ChunkWriter', 'ChunkManifest'],
+    'lib.paging': ['AdaptiveBackoff', 'PageSizeController', 'OSM_GEOMETRY_PRECISION', 'PROJECTED_PRECISION_OFFSET',
+                   'FetchProfile', 'choose_reprojection', 'CheckpointedPager'],
+    'lib.dumpers': ['instrumented_dumper', 'silly_dumper', 'streaming_dumper', 'geojsonl_lazy_dumper',
+                    'split_oid_ranges', 'geojsonl_parallel_dumper'],
+}
+
+# names the single-module lib used to provide through `from lib import *`: name -> (module, attribute or None)
+_COMPAT = {
+    'os': ('os', None),
+    'json': ('json', None),
+    'functools': ('functools', None),
+    'inspect': ('inspect', None),
+    'math': ('math', None),
+    'time': ('time', None),
+    'random': ('random', None),
+    'hashlib': ('hashlib', None),
+    're': ('re', None),
+    'threading': ('threading', None),
+    'ThreadPoolExecutor': ('concurrent.futures', 'ThreadPoolExecutor'),
+    'as_completed': ('concurrent.futures', 'as_completed'),
+    'urljoin': ('urllib.parse', 'urljoin'),
+    'urlparse': ('urllib.parse', 'urlparse'),
+    'JSONEncoder': ('json', 'JSONEncoder'),
+    'tqdm': ('tqdm', 'tqdm'),
+    'requests': ('requests', None),
+    'retry': ('tenacity', 'retry'),
+    'wait_exponential': ('tenacity', 'wait_exponential'),
+    'wait_random': ('tenacity', 'wait_random'),
+    'stop_after_attempt': ('tenacity', 'stop_after_attempt'),
+    'BaseEsriDumper': ('esridump.dumper', 'EsriDumper'),
+    'EsriDownloadError': ('esridump.errors', 'EsriDownloadError'),
+    'esri2geojson': ('esridump', 'esri2geojson'),
+    'gpd': ('geopandas', None),
+    'np': ('numpy', None),
+    'CRS': ('pyproj', 'CRS'),
+    'Transformer': ('pyproj', 'Transformer'),
+    'pa': ('pyarrow', None),
+    'pq': ('pyarrow.parquet', None),
+    'shapely': ('shapely', None),
+    'shape': ('shapely.geometry', 'shape'),
+    'ResponseCache': ('http_cache', 'ResponseCache'),
+    'CacheMissError': ('http_cache', 'CacheMissError'),
+    'decode_feature_collection': ('esri_pbf', 'decode_feature_collection'),
+    'features_match': ('esri_pbf', 'features_match'),
+    'RunMetrics': ('metrics', 'RunMetrics'),
+    'current_metrics': ('metrics', 'current_metrics'),
+    'timed_stage': ('metrics', 'timed_stage'),
+    'count_metric': ('metrics', 'count_metric'),
+    'with_current_metrics': ('metrics', 'with_current_metrics'),
+}
+
+_SOURCES = {name: (module, name) for module, names in _EXPORTS.items() for name in names}
+_SOURCES.update(_COMPAT)
+
+_CONSTANTS = ['DEFAULT_CRS', 'ROOT_URL', 'MAPSERVER_URL', 'MAPSERVER_URL_ALT', 'LAYER_IDS', 'HTTP_CACHE_FOLDER', 'ZOOM_LEVEL']
+
+__all__ = ['init', 'logging'] + _CONSTANTS + list(_SOURCES)
+
+_INITIALIZED = False
+
+def __getattr__(name):
+    if name not in _SOURCES:
+        raise AttributeError(f"module 'lib' has no attribute '{name}'")
+
+    module_name, attribute = _SOURCES[name]
+    value = importlib.import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+
+    # later accesses don't go through __getattr__
+    globals()[name] = value
+
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_SOURCES))
+
+def init(folders=('outputs', 'tests', 'logs'), log_path='logs/global_log.log', log_level=logging.DEBUG, log_mode='w'):
+    """
+    Sets up the working environment of the scripts: creates their folders and configures the
+    log file. Only the first call does anything.
+
+    Args:
+        folders (tuple, optional): The folders to create. Defaults to ('outputs', 'tests', 'logs').
+        log_path (str, optional): The log file, None to leave logging alone. Defaults to 'logs/global_log.log'.
+        log_level (int, optional): The logging level. Defaults to logging.DEBUG.
+        log_mode (str, optional): The mode the log file is opened with. Defaults to 'w' (overwrite).
+
+    Returns:
+        bool: Whether this call did the setup.
+    """
+    global _INITIALIZED
+
+    if _INITIALIZED:
+        return False
+
+    from lib.files import create_folderlist
+
+    create_folderlist(list(folders))
+
+    if log_path:
+        logging.basicConfig(
+            filename=log_path,
+            level=log_level,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%d-%b-%y %H:%M:%S',
+            filemode=log_mode,
+        )
+
+    _INITIALIZED = True
+
+    return True
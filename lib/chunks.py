@@ -0,0 +1,381 @@
+import os, json
+import hashlib
+import logging
+
+from metrics import timed_stage, count_metric
+
+from lib.files import create_dir, read_file_as_list
+from lib.compression import chunk_codec, get_compressor, iter_chunk_lines, chunk_sha256
+
+class ChunkWriter:
+    """
+    Writes lines to a single chunk file, keeping one handle open for its whole lifetime.
+
+    Lines are buffered in memory and flushed to a temporary '<filepath>.tmp' file whenever
+    the buffer reaches `buffer_bytes` or `buffer_features`. On `close` the temporary file is
+    fsynced and atomically renamed to `filepath`, so the chunk should only be registered (e.g.
+    in a ChunkManifest) after that. On `abort` the temporary file is discarded, so a chunk file
+    either exists complete or does not exist at all.
+
+    It can be used as a context manager: leaving the block normally closes the chunk, leaving
+    it through an exception aborts it.
+
+    Chunks named '*.gz' or '*.zst' are compressed (gzip or zstd) as they are flushed; their
+    `n_bytes` and `sha256` are then those of the compressed file, as it is on disk.
+
+    Args:
+        filepath (str): The final path of the chunk file.
+        buffer_bytes (int, optional): Maximum size in bytes of the in-memory buffer.
+                                      Defaults to 1 MiB.
+        buffer_features (int, optional): Maximum number of lines kept in the in-memory buffer.
+                                         Defaults to 1000.
+        fsync (bool, optional): Whether to fsync the file before renaming it. Defaults to True.
+        level (int, optional): The compression level of compressed chunks. Defaults to None
+                               (see lib.compression.DEFAULT_LEVELS).
+    """
+    TMP_SUFFIX = '.tmp'
+
+    def __init__(self, filepath, buffer_bytes=1024 * 1024, buffer_features=1000, fsync=True, level=None):
+        self.filepath = filepath
+        self.tmp_filepath = filepath + self.TMP_SUFFIX
+        self.buffer_bytes = buffer_bytes
+        self.buffer_features = buffer_features
+        self.fsync = fsync
+
+        self.n_lines = 0
+        self.n_bytes = 0
+        self.n_raw_bytes = 0
+
+        compression = chunk_codec(filepath)
+        self._compressor = get_compressor(compression, level) if compression else None
+
+        self._sha256 = hashlib.sha256()
+        self._buffer = []
+        self._buffered_bytes = 0
+
+        directory = os.path.dirname(filepath)
+        if directory:
+            create_dir(directory)
+
+        try:
+            self._handle = open(self.tmp_filepath, 'wb')
+        except (OSError, IOError) as e:
+            logging.error(f"Error opening chunk file {self.tmp_filepath}: {e}")
+            raise
+
+    @property
+    def closed(self):
+        return self._handle is None
+
+    @property
+    def sha256(self):
+        """
+        str: The hex sha256 checksum of the data flushed so far (the whole chunk, once closed).
+        """
+        return self._sha256.hexdigest()
+
+    def write(self, data_str):
+        """
+        Buffers a string to be written to the chunk, flushing if the buffer is full.
+
+        Args:
+            data_str (str): The string to write, usually a serialized feature plus a newline.
+        """
+        if self.closed:
+            raise ValueError(f"Chunk {self.filepath} is already closed")
+
+        data = data_str.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered_bytes += len(data)
+        self.n_lines += 1
+
+        if self._buffered_bytes >= self.buffer_bytes or len(self._buffer) >= self.buffer_features:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the in-memory buffer to the temporary chunk file.
+        """
+        if not self._buffer:
+            return
+
+        data = b''.join(self._buffer)
+        self.n_raw_bytes += len(data)
+
+        if self._compressor is not None:
+            with timed_stage('compress'):
+                data = self._compressor.compress(data)
+
+        self._write(data)
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def _write(self, data):
+        try:
+            with timed_stage('write'):
+                self._handle.write(data)
+        except (OSError, IOError) as e:
+            logging.error(f"Error writing to chunk file {self.tmp_filepath}: {e}")
+            raise
+
+        count_metric('bytes_out', len(data))
+
+        self._sha256.update(data)
+        self.n_bytes += len(data)
+
+    def close(self):
+        """
+        Flushes, fsyncs and atomically renames the chunk to its final path.
+        """
+        if self.closed:
+            return
+
+        try:
+            self.flush()
+            if self._compressor is not None:
+                self._write(self._compressor.flush())
+            with timed_stage('fsync'):
+                self._handle.flush()
+                if self.fsync:
+                    os.fsync(self._handle.fileno())
+        finally:
+            self._handle.close()
+            self._handle = None
+
+        os.replace(self.tmp_filepath, self.filepath)
+
+    def abort(self):
+        """
+        Discards the chunk: buffered lines are dropped and the temporary file is removed.
+        """
+        if self.closed:
+            return
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._handle.close()
+        self._handle = None
+
+        try:
+            os.remove(self.tmp_filepath)
+        except OSError as e:
+            logging.warning(f"Could not remove temporary chunk {self.tmp_filepath}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class ChunkManifest:
+    """
+    Append-only JSON Lines manifest of the committed chunks of a dump.
+
+    Each line describes one finished chunk: its index, its file name (relative to the folder
+    of the manifest), the objectid range it covers, its feature count, byte size and sha256
+    checksum. The manifest alone is enough to resume a dump, as the number of downloaded
+    features is the sum of the chunk counts, no matter the chunk size each run used.
+    A later line for the same chunk supersedes the earlier one (a refreshed chunk); chunks are
+    identified by their file name, or by the `key` given to `add` (e.g. a tile, whose file name
+    changes with the compression).
+
+    Args:
+        path (str): The path of the manifest file. It is created on the first `add`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.folderpath = os.path.dirname(path)
+        self.n_features = 0
+        self._entries = {}
+
+        for line in read_file_as_list(path):
+            if not line:
+                continue
+            try:
+                self._register(json.loads(line))
+            except json.JSONDecodeError:
+                # a line torn by a crash while appending; its chunk gets downloaded again
+                logging.warning(f"Ignoring unreadable line in manifest {path}: {line}")
+
+    def _register(self, entry):
+        key = entry.get('key', entry['filename'])
+        previous = self._entries.get(key)
+        if previous:
+            self.n_features -= previous['n_features']
+
+        self._entries[key] = entry
+        self.n_features += entry['n_features']
+
+    @property
+    def entries(self):
+        """
+        list: The current entries, one per chunk, in registration order.
+        """
+        return list(self._entries.values())
+
+    @property
+    def filenames(self):
+        """
+        set: The file names of all the registered chunks.
+        """
+        return {entry['filename'] for entry in self._entries.values()}
+
+    @property
+    def next_index(self):
+        """
+        int: The index to be used by the next chunk.
+        """
+        return max((entry['index'] for entry in self.entries), default=-1) + 1
+
+    def chunk_path(self, entry):
+        """
+        Returns the path of a registered chunk.
+
+        Args:
+            entry (dict): A manifest entry.
+
+        Returns:
+            str: The path of the chunk file.
+        """
+        return os.path.join(self.folderpath, entry['filename'])
+
+    def add(self, index, filepath, oid_range, n_features, n_bytes, sha256, key=None, **extra):
+        """
+        Registers a committed chunk, appending (and fsyncing) its line to the manifest.
+
+        A chunk with no features does not need to exist on disk.
+
+        Args:
+            index (int): The index of the chunk.
+            filepath (str): The path of the chunk file.
+            oid_range (tuple): The (first, last) objectids covered by the chunk.
+            n_features (int): The number of features in the chunk.
+            n_bytes (int): The size of the chunk in bytes.
+            sha256 (str): The hex sha256 checksum of the chunk.
+            key (str, optional): The identity of the chunk, if not its file name: the entry
+                                 then supersedes the earlier one with the same key, whatever
+                                 its file name. Defaults to None.
+            **extra: Additional fields to store in the entry (e.g. a tile key).
+
+        Returns:
+            dict: The new manifest entry.
+        """
+        entry = {
+            'index': index,
+            'filename': os.path.basename(filepath),
+            'oid_range': list(oid_range),
+            'n_features': n_features,
+            'n_bytes': n_bytes,
+            'sha256': sha256,
+            **({'key': key} if key is not None else {}),
+            **extra,
+        }
+
+        if self.folderpath:
+            create_dir(self.folderpath)
+
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except (OSError, IOError) as e:
+            logging.error(f"Error appending to manifest {self.path}: {e}")
+            raise
+
+        self._register(entry)
+
+        return entry
+
+    def add_writer(self, writer, index, oid_range, **extra):
+        """
+        Registers a chunk that was committed by a closed ChunkWriter.
+
+        Args:
+            writer (ChunkWriter): The closed writer of the chunk.
+            index (int): The index of the chunk.
+            oid_range (tuple): The (first, last) objectids covered by the chunk.
+            **extra: Additional fields to store in the entry (e.g. a tile key).
+
+        Returns:
+            dict: The new manifest entry.
+        """
+        return self.add(index, writer.filepath, oid_range, writer.n_lines, writer.n_bytes, writer.sha256, **extra)
+
+    def verify(self, checksum=True):
+        """
+        Checks the chunks against the manifest, without parsing their contents.
+
+        The existence, byte size and line count of each chunk are checked, and also the
+        checksum, unless `checksum` is False.
+
+        Args:
+            checksum (bool, optional): Whether to compare the sha256 checksums.
+                                       Defaults to True.
+
+        Returns:
+            list: A list of (filename, problem) tuples, empty if every chunk is fine.
+        """
+        problems = []
+
+        for entry in self.entries:
+            filepath = self.chunk_path(entry)
+            filename = entry['filename']
+
+            if not os.path.exists(filepath):
+                if entry['n_features']:
+                    problems.append((filename, 'missing'))
+                continue
+
+            if not checksum:
+                if os.path.getsize(filepath) != entry['n_bytes']:
+                    problems.append((filename, f"size is {os.path.getsize(filepath)}, expected {entry['n_bytes']}"))
+                continue
+
+            sha256, n_bytes, n_lines = chunk_sha256(filepath)
+
+            if n_bytes != entry['n_bytes']:
+                problems.append((filename, f"size is {n_bytes}, expected {entry['n_bytes']}"))
+            if n_lines != entry['n_features']:
+                problems.append((filename, f"has {n_lines} features, expected {entry['n_features']}"))
+            if sha256 != entry['sha256']:
+                problems.append((filename, 'checksum mismatch'))
+
+        return problems
+
+    @classmethod
+    def from_legacy_registry(cls, registry_path, manifest_path, oid_field='objectid'):
+        """
+        Builds a manifest out of a legacy '_downloaded_registry.txt', reading each chunk once.
+
+        The legacy chunks were paged by offset, in no objectid order, so their entries are marked
+        with 'paging': 'offset': the highest objectid of such a manifest is no checkpoint.
+
+        Args:
+            registry_path (str): The path of the legacy registry.
+            manifest_path (str): The path of the manifest to create.
+            oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+        Returns:
+            ChunkManifest: The new manifest.
+        """
+        manifest = cls(manifest_path)
+        folderpath = os.path.dirname(registry_path)
+
+        for index, registered_path in enumerate(read_file_as_list(registry_path)):
+            filepath = os.path.join(folderpath, os.path.basename(registered_path))
+
+            if not os.path.exists(filepath):
+                logging.warning(f"Registered chunk {filepath} not found, the migration stops before it")
+                break
+
+            sha256, n_bytes, n_lines = chunk_sha256(filepath)
+            oids = [json.loads(line)['properties'].get(oid_field) for line in iter_chunk_lines(filepath)]
+            oids = [oid for oid in oids if oid is not None]
+
+            manifest.add(index, filepath, (min(oids, default=None), max(oids, default=None)), n_lines, n_bytes, sha256, paging='offset')
+
+        return manifest
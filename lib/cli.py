@@ -0,0 +1,353 @@
+import os, json
+import argparse
+import sys
+
+from constants import *
+
+import lib
+
+# each subcommand imports what it needs when it runs, so e.g. `python -m lib verify` doesn't load geopandas
+
+def setup_cache(args):
+    if args.cache_dir or args.offline:
+        from http_cache import ResponseCache
+        from lib.esri import set_http_cache
+
+        set_http_cache(ResponseCache(args.cache_dir or HTTP_CACHE_FOLDER, offline=args.offline))
+
+def layers_command(args):
+    from lib.esri import get_layer_url
+
+    for layer_id_key, layer_id in LAYER_IDS.items():
+        use_alt = layer_id_key.endswith('_alt')
+        layername = layer_id_key[:-len('_alt')] if use_alt else layer_id_key
+        print(f"{layer_id_key:20} {layer_id:>4}  {get_layer_url(layername, use_alt=use_alt)}")
+
+    return 0
+
+def metadata_command(args):
+    from lib.esri import get_layer_metadata
+
+    lib.init()
+    metadata = get_layer_metadata(args.layer, use_alt=args.alt, outpath=args.output)
+    if not args.output:
+        print(json.dumps(metadata, indent=2))
+
+    return 0
+
+def dump_command(args):
+    from lib.esri import HostBudget, set_host_budget
+    from scheduler import normalize_job, run_job
+
+    lib.init()
+    setup_cache(args)
+    if args.host_concurrency:
+        set_host_budget(HostBudget(max_concurrent=args.host_concurrency))
+
+    server = 'both' if args.striped else 'alt' if args.alt else 'main'
+    job = {'layer': args.layer, 'server': server, 'mode': args.mode, 'output': args.output}
+    for key in ['chunksize', 'concurrency']:
+        if getattr(args, key) is not None:
+            job[key] = getattr(args, key)
+
+    if args.mode != 'streaming':
+        job['options'] = {key: getattr(args, key) for key in ['compression', 'precision'] if getattr(args, key) is not None}
+
+    run_job(normalize_job(job))
+
+    return 0
+
+def verify_command(args):
+    from lib.chunks import ChunkManifest
+
+    manifest = ChunkManifest(args.manifest)
+    problems = manifest.verify()
+
+    for filename, problem in problems:
+        print(f"{filename}: {problem}")
+
+    print(f"{len(manifest.entries)} chunks, {manifest.n_features} features, {len(problems)} problems")
+
+    return 1 if problems else 0
+
+def check_command(args):
+    from checker import check_objectids, chunk_sort_key
+    from lib.files import listdir_fullpath, dump_json
+    from lib.compression import CHUNK_EXTENSIONS
+
+    folder = args.folder or os.path.join('outputs', args.layer)
+    if not os.path.exists(folder):
+        print(f"Directory {folder} does not exist. Please run the dumper first.")
+        return 1
+
+    filelist = sorted(listdir_fullpath(folder, extension=CHUNK_EXTENSIONS), key=chunk_sort_key)
+    report = check_objectids(filelist, registry_path=args.registry, ids_cache_path=args.ids_cache, max_workers=args.workers)
+
+    if args.report:
+        dump_json(report, args.report)
+
+    print(f"{report['n_files']} files ({report['n_files_parsed']} parsed), {report['n_ids']} ids from {report['min_id']} to {report['max_id']}")
+    print(f"duplicated ids: {report['n_duplicated_ids']}, missing ids: {report['n_missing_ids']} in {report['n_gaps']} gaps, out of order: {report['n_out_of_order']}, without objectid: {report['n_no_oid']}")
+
+    for duplicate in report['duplicates'][:10]:
+        print(f"  duplicated: {duplicate}")
+    for first, last in report['gaps'][:10]:
+        print(f"  missing: {first}-{last}")
+    for position in report['out_of_order'][:10]:
+        print(f"  out of order: {position}")
+    for item in report['no_oid'][:10]:
+        print(f"  without objectid: {item}")
+
+    return 1 if report['n_duplicated_ids'] or report['n_missing_ids'] or report['n_out_of_order'] or report['n_no_oid'] else 0
+
+def index_command(args):
+    from spatial_index import update_spatial_index
+
+    summary = update_spatial_index(args.folder, rebuild=args.rebuild)
+    print(f"{summary['n_indexed']} chunks indexed, {summary['n_unchanged']} unchanged, {summary['n_removed']} removed, {summary['n_features']} features")
+
+    return 0
+
+def query_command(args):
+    from spatial_index import SpatialIndex
+
+    index = SpatialIndex(args.folder)
+    if not len(index):
+        print(f"No spatial index in {args.folder}, run `python -m lib index {args.folder}` first")
+        return 1
+
+    if args.point:
+        features = index.query_point(*args.point, exact=not args.bbox_only)
+    else:
+        features = index.query_bbox(args.bbox, exact=not args.bbox_only)
+
+    for feature in features:
+        print(json.dumps(feature))
+
+    return 0
+
+def conflate_command(args):
+    from conflation import conflate
+
+    lib.init()
+    folder = args.folder or os.path.join('outputs', args.layer)
+    summary = conflate(folder, args.osm, args.output or f'{folder.rstrip(os.sep)}_conflation',
+                       layername=args.layer, zoom=args.zoom, match_iou=args.match_iou, max_workers=args.workers)
+
+    print(f"{summary['n_dumped']} dumped, {summary['n_osm']} in OSM: {summary['n_matched']} matched, {summary['n_overlapping']} overlapping, "
+          f"{summary['n_new']} new, {summary['n_no_geometry']} without geometry, {summary['n_osm_only']} only in OSM")
+
+    return 0
+
+def prep_command(args):
+    from geometry_prep import prepare_geometries
+    from lib.compression import strip_chunk_extension
+
+    lib.init()
+    input_path = args.input or os.path.join('outputs', args.layer)
+    base = input_path.rstrip(os.sep)
+    output = args.output or f"{base[:-len('.parquet')] if base.endswith('.parquet') else strip_chunk_extension(base)}_prepared"
+    report = prepare_geometries(input_path, output, layername=args.layer, block_size=args.block_size,
+                                simplify_tolerance=args.simplify_tolerance, sliver_width=args.sliver_width,
+                                near_duplicate_iou=args.near_duplicate_iou, max_workers=args.workers)
+
+    issues = ', '.join(f"{report[f'n_{issue}']} {issue}" for issue in ['no_geometry', 'not_polygonal', 'invalid', 'sliver', 'collapsed', 'near_duplicate'])
+    print(f"{report['n_features']} features ({report['n_no_oid']} without objectid), {report['n_flagged']} flagged: {issues}")
+
+    return 0
+
+def export_command(args):
+    from osm_export import export_osm, read_conflation_oids
+
+    lib.init()
+    input_path = args.input or os.path.join('outputs', f'{args.layer}_prepared')
+    output = args.output or os.path.join('outputs', f'{args.layer}.osc')
+    oids = read_conflation_oids(args.conflation, categories=args.category) if args.conflation else None
+    summary = export_osm(input_path, output, mapping_path=args.mapping, oids=oids, block_size=args.block_size)
+
+    print(f"{summary['n_exported']} of {summary['n_features']} features exported ({summary['n_filtered']} filtered, "
+          f"{summary['n_no_geometry']} without geometry, {summary['n_degenerate']} degenerate): {summary['n_nodes']} nodes "
+          f"({summary['n_shared_nodes']} shared across blocks), {summary['n_ways']} ways, {summary['n_relations']} relations")
+
+    return 0
+
+def bucket_command(args):
+    from buckets import bucket_chunks
+
+    lib.init()
+    summary = bucket_chunks(args.folder or os.path.join('outputs', args.layer), args.output or os.path.join('data', args.layer),
+                            layername=args.layer, bucket_size=args.bucket_size, compression=args.compression)
+
+    print(f"{summary['n_features']} features in {summary['n_buckets']} buckets: {summary['n_written']} written "
+          f"({summary['n_bytes_written']} bytes), {summary['n_unchanged']} unchanged, {summary['n_removed']} removed")
+
+    return 0
+
+def jobs_command(args):
+    from lib.esri import HostBudget, set_host_budget
+    from scheduler import JobScheduler, read_jobs, default_jobs
+
+    lib.init()
+    setup_cache(args)
+    set_host_budget(HostBudget(max_concurrent=args.host_concurrency, max_per_second=args.host_rate))
+
+    jobs = read_jobs(args.jobs) if os.path.exists(args.jobs) else default_jobs()
+    scheduler = JobScheduler(jobs, max_jobs=args.max_jobs)
+
+    if args.reset:
+        scheduler.reset()
+
+    summary = scheduler.run()
+
+    for name, state in summary['jobs'].items():
+        print(f"{name}: {state['status']}" + (f" ({state['error']})" if state.get('error') else ''))
+
+    for layername, totals in summary['layers'].items():
+        print(f"{layername}: {totals['n_features']} features, {totals['n_bytes']} bytes in {totals['elapsed']:.1f} s "
+              f"({totals['features_per_second'] or 0:.1f} features/s, {totals['bytes_per_second'] or 0:.0f} bytes/s)")
+
+    return 1 if any(state['status'] == 'failed' for state in summary['jobs'].values()) else 0
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help=f'Cache the server responses in this folder (e.g. {HTTP_CACHE_FOLDER})')
+    parser.add_argument('--offline', action='store_true',
+                        help='Serve every request from the response cache, failing on misses')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m lib', description='Dump and check layers of the Geocuritiba portal.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    layers = subparsers.add_parser('layers', help='List the known layers and their URLs')
+    layers.set_defaults(handler=layers_command)
+
+    metadata = subparsers.add_parser('metadata', help='Fetch the metadata of a layer')
+    metadata.add_argument('layer', help='Layer name, a key of LAYER_IDS')
+    metadata.add_argument('--alt', action='store_true', help='Use the alternative map server')
+    metadata.add_argument('--output', '-o', type=str, default=None, help='JSON file to save it to (default: print it)')
+    metadata.set_defaults(handler=metadata_command)
+
+    dump = subparsers.add_parser('dump', help='Dump a layer')
+    dump.add_argument('layer', help='Layer name, a key of LAYER_IDS')
+    dump.add_argument('--alt', action='store_true', help='Use the alternative map server')
+    dump.add_argument('--striped', action='store_true',
+                      help='Split the ranges of the parallel mode between both map servers, failing over between them')
+    dump.add_argument('--mode', choices=['lazy', 'parallel', 'tiled', 'streaming'], default='lazy',
+                      help='The dumper (default: lazy)')
+    dump.add_argument('--output', '-o', type=str, default=None,
+                      help='Output folder, or .parquet file for streaming (default: as the jobs, under outputs/)')
+    dump.add_argument('--chunksize', type=int, default=None, help='Features per chunk (default: 1000)')
+    dump.add_argument('--concurrency', '-w', type=int, default=None, help='Workers of the parallel and tiled modes (default: 4)')
+    dump.add_argument('--compression', choices=['gzip', 'zstd'], default=None,
+                      help='Compress the chunks (default: plain .geojsonl)')
+    dump.add_argument('--precision', type=int, default=None,
+                      help='Round the coordinates to this many decimals before writing them (default: as received)')
+    dump.add_argument('--host-concurrency', type=int, default=None,
+                      help='Maximum simultaneous requests to the server (default: no limit)')
+    add_cache_arguments(dump)
+    dump.set_defaults(handler=dump_command)
+
+    verify = subparsers.add_parser('verify', help='Check chunk files against their manifest')
+    verify.add_argument('manifest', help='Path of the manifest (e.g. outputs/buildings/buildings_manifest.jsonl)')
+    verify.set_defaults(handler=verify_command)
+
+    check = subparsers.add_parser('check', help='Check the objectid continuity of dumped chunks')
+    check.add_argument('folder', nargs='?', default=None, help='Folder of the chunks (default: outputs/<layer>)')
+    check.add_argument('--layer', type=str, default='buildings', help='Name of the layer (default: buildings)')
+    check.add_argument('--registry', type=str, default=None,
+                       help='JSON registry of the checked files, to parse only the new or changed ones (default: parse them all)')
+    check.add_argument('--ids-cache', type=str, default=None, help='Cache of the objectids of the checked files (.npz), with --registry')
+    check.add_argument('--report', type=str, default=None, help='JSON file to save the full report to')
+    check.add_argument('--workers', '-w', type=int, default=None, help='Number of worker processes (default: one per CPU)')
+    check.set_defaults(handler=check_command)
+
+    index = subparsers.add_parser('index', help='Create or update the spatial index of a folder of chunks')
+    index.add_argument('folder', help='Folder of the chunks')
+    index.add_argument('--rebuild', action='store_true', help='Index every chunk again')
+    index.set_defaults(handler=index_command)
+
+    query = subparsers.add_parser('query', help='Print the features of a box or point, as GeoJSONL, using the spatial index')
+    query.add_argument('folder', help='Folder of the indexed chunks')
+    area = query.add_mutually_exclusive_group(required=True)
+    area.add_argument('--bbox', type=float, nargs=4, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'), help='Longitude/latitude box')
+    area.add_argument('--point', type=float, nargs=2, metavar=('X', 'Y'), help='Longitude/latitude point')
+    query.add_argument('--bbox-only', action='store_true', help='Only compare the bboxes of the features, not their geometries')
+    query.set_defaults(handler=query_command)
+
+    conflate = subparsers.add_parser('conflate', help='Compare dumped buildings with the buildings of an OSM extract')
+    conflate.add_argument('folder', nargs='?', default=None, help='Folder of the chunks (default: outputs/<layer>)')
+    conflate.add_argument('--osm', type=str, required=True, help='OSM extract (.osm.pbf)')
+    conflate.add_argument('--output', '-o', type=str, default=None, help='Output folder (default: <folder>_conflation)')
+    conflate.add_argument('--layer', type=str, default='buildings', help='Prefix of the output files (default: buildings)')
+    conflate.add_argument('--match-iou', type=float, default=0.5, help='Minimum intersection over union of a match (default: 0.5)')
+    conflate.add_argument('--zoom', type=int, default=15, help='Zoom level of the tiles the work is split into (default: 15)')
+    conflate.add_argument('--workers', '-w', type=int, default=None, help='Number of worker processes (default: one per CPU)')
+    conflate.set_defaults(handler=conflate_command)
+
+    prep = subparsers.add_parser('prep', help='Validate and clean the geometries of dumped buildings for OSM')
+    prep.add_argument('input', nargs='?', default=None,
+                      help='Folder of the chunks, or a single GeoJSONL or GeoParquet file (default: outputs/<layer>)')
+    prep.add_argument('--output', '-o', type=str, default=None, help='Output folder (default: <input>_prepared)')
+    prep.add_argument('--layer', type=str, default='buildings', help='Prefix of the report files (default: buildings)')
+    prep.add_argument('--simplify-tolerance', type=float, default=0.1, help='Simplification tolerance, in metres (default: 0.1)')
+    prep.add_argument('--sliver-width', type=float, default=0.01,
+                      help='Parts thinner than this, in metres, are dropped as slivers (default: 0.01)')
+    prep.add_argument('--near-duplicate-iou', type=float, default=0.9,
+                      help='Minimum intersection over union of near-duplicate footprints (default: 0.9)')
+    prep.add_argument('--block-size', type=int, default=5000, help='Number of features per task of the process pool (default: 5000)')
+    prep.add_argument('--workers', '-w', type=int, default=None, help='Number of worker processes (default: one per CPU)')
+    prep.set_defaults(handler=prep_command)
+
+    export = subparsers.add_parser('export', help='Convert dumped buildings into an OSM file of new data, with tags')
+    export.add_argument('input', nargs='?', default=None,
+                        help='Folder of the chunks, or a single GeoJSONL or GeoParquet file (default: outputs/<layer>_prepared)')
+    export.add_argument('output', nargs='?', default=None,
+                        help='Output file: .osm, .osc (osmChange) or .osm.pbf (default: outputs/<layer>.osc)')
+    export.add_argument('--layer', type=str, default='buildings', help='Name of the layer (default: buildings)')
+    export.add_argument('--mapping', type=str, default='metadata/buildings_tag_mapping.json',
+                        help='Attribute to tag mapping (default: metadata/buildings_tag_mapping.json)')
+    export.add_argument('--conflation', type=str, default=None, help='Conflation results (<layer>_conflation.jsonl), to export only some categories')
+    export.add_argument('--category', type=str, nargs='+', default=['new'], help='Conflation categories exported (default: new)')
+    export.add_argument('--block-size', type=int, default=5000, help='Number of features per block (default: 5000)')
+    export.set_defaults(handler=export_command)
+
+    bucket = subparsers.add_parser('bucket', help='Lay out dumped chunks as objectid buckets, rewriting only the changed ones')
+    bucket.add_argument('folder', nargs='?', default=None, help='Folder of the dumped chunks (default: outputs/<layer>)')
+    bucket.add_argument('output', nargs='?', default=None,
+                        help='Folder of the buckets, e.g. a folder under version control (default: data/<layer>)')
+    bucket.add_argument('--layer', type=str, default='buildings', help='Name of the layer (default: buildings)')
+    bucket.add_argument('--bucket-size', type=int, default=5000, help='Objectid span of each bucket (default: 5000)')
+    bucket.add_argument('--compression', choices=['gzip', 'zstd'], default=None,
+                        help='Compress the buckets (.geojsonl.gz or .geojsonl.zst; default: plain .geojsonl)')
+    bucket.set_defaults(handler=bucket_command)
+
+    jobs = subparsers.add_parser('jobs', help='Dump many layers at once, resuming unfinished jobs')
+    jobs.add_argument('--jobs', '-j', type=str, default='jobs.json',
+                      help='JSON list of the jobs (default: jobs.json, or one lazy job per layer if missing)')
+    jobs.add_argument('--max-jobs', type=int, default=2, help='Number of jobs run at the same time (default: 2)')
+    jobs.add_argument('--host-concurrency', type=int, default=4,
+                      help='Maximum simultaneous requests to each server (default: 4)')
+    jobs.add_argument('--host-rate', type=float, default=None,
+                      help='Maximum requests per second to each server (default: no limit)')
+    jobs.add_argument('--reset', action='store_true', help='Run again the jobs that are already done')
+    add_cache_arguments(jobs)
+    jobs.set_defaults(handler=jobs_command)
+
+    return parser
+
+def main(argv=None):
+    """
+    Runs the command line interface.
+
+    Args:
+        argv (list, optional): The arguments. Defaults to None (sys.argv).
+
+    Returns:
+        int: The exit status.
+    """
+    args = build_parser().parse_args(argv)
+
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
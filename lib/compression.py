@@ -0,0 +1,238 @@
+import io, json
+import gzip
+import hashlib
+import zlib
+
+# zstandard is optional, only needed for '.zst' chunks
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# codec -> suffix added to the '.geojsonl' extension of the chunks
+CHUNK_CODECS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+CHUNK_EXTENSIONS = tuple('.geojsonl' + suffix for suffix in CHUNK_CODECS.values())
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'zstd': 10,
+}
+
+def chunk_extension(compression=None):
+    """
+    Returns the extension of the chunks written with a codec.
+
+    Args:
+        compression (str, optional): 'gzip', 'zstd' or None (plain text). Defaults to None.
+
+    Returns:
+        str: '.geojsonl', '.geojsonl.gz' or '.geojsonl.zst'.
+
+    Raises:
+        ValueError: If the codec is unknown.
+    """
+    if compression not in CHUNK_CODECS:
+        raise ValueError(f"Unknown chunk compression {compression}, expected one of {list(CHUNK_CODECS)}")
+
+    return '.geojsonl' + CHUNK_CODECS[compression]
+
+def chunk_codec(filepath):
+    """
+    Finds the codec of a file from its extension.
+
+    Args:
+        filepath (str): The path of the file.
+
+    Returns:
+        str: 'gzip', 'zstd' or None (uncompressed).
+    """
+    for codec, suffix in CHUNK_CODECS.items():
+        if suffix and filepath.endswith(suffix):
+            return codec
+
+    return None
+
+def strip_chunk_extension(filename):
+    """
+    Removes the chunk extension of a file name, whatever its codec ('a_chunk_1.geojsonl.zst' -> 'a_chunk_1').
+
+    Args:
+        filename (str): The file name.
+
+    Returns:
+        str: The file name without its chunk extension.
+    """
+    for extension in sorted(CHUNK_EXTENSIONS, key=len, reverse=True):
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+
+    return filename
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd chunks need the zstandard package (pip install zstandard)")
+
+def get_compressor(compression, level=None):
+    """
+    Creates an incremental compressor, with `compress(data)` and `flush()` methods.
+
+    Args:
+        compression (str): 'gzip' or 'zstd'.
+        level (int, optional): The compression level. Defaults to None (DEFAULT_LEVELS).
+
+    Returns:
+        object: The compressor.
+
+    Raises:
+        ValueError: If the codec is unknown.
+        ImportError: For 'zstd', if zstandard is not installed.
+    """
+    level = DEFAULT_LEVELS.get(compression) if level is None else level
+
+    if compression == 'gzip':
+        # wbits=31: gzip header and trailer, so the chunks are plain .gz files
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    if compression == 'zstd':
+        _require_zstandard()
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    raise ValueError(f"Unknown chunk compression {compression}")
+
+def get_decompressor(compression):
+    """
+    Creates an incremental decompressor, with a `decompress(data)` method.
+
+    Args:
+        compression (str): 'gzip' or 'zstd'.
+
+    Returns:
+        object: The decompressor.
+    """
+    if compression == 'gzip':
+        return zlib.decompressobj(31)
+
+    if compression == 'zstd':
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    raise ValueError(f"Unknown chunk compression {compression}")
+
+def open_chunk(filepath):
+    """
+    Opens a chunk for reading its decompressed contents as a stream.
+
+    The codec is taken from the extension, so plain and compressed chunks are read alike.
+
+    Args:
+        filepath (str): The path of the chunk.
+
+    Returns:
+        io.BufferedIOBase: A binary file object, iterable by lines.
+    """
+    compression = chunk_codec(filepath)
+
+    if compression == 'gzip':
+        return gzip.open(filepath, 'rb')
+
+    if compression == 'zstd':
+        _require_zstandard()
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), closefd=True))
+
+    return open(filepath, 'rb')
+
+def read_chunk(filepath):
+    """
+    Reads the whole decompressed contents of a chunk.
+
+    Args:
+        filepath (str): The path of the chunk.
+
+    Returns:
+        bytes: The contents.
+    """
+    with open_chunk(filepath) as f:
+        return f.read()
+
+def iter_chunk_lines(filepath):
+    """
+    Streams the non-empty lines of a chunk, decompressing it on the fly.
+
+    Args:
+        filepath (str): The path of the chunk.
+
+    Yields:
+        bytes: Each line, without its newline.
+    """
+    with open_chunk(filepath) as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if line:
+                yield line
+
+def chunk_sha256(filepath, blocksize=1024 * 1024):
+    """
+    Computes the checksum and size of a chunk file, and its number of lines once decompressed,
+    in a single read.
+
+    Args:
+        filepath (str): The path of the chunk.
+        blocksize (int, optional): The size of the blocks read. Defaults to 1 MiB.
+
+    Returns:
+        tuple: The hex sha256 checksum and size in bytes of the file, and its number of lines.
+    """
+    compression = chunk_codec(filepath)
+    decompressor = get_decompressor(compression) if compression else None
+
+    sha256 = hashlib.sha256()
+    n_bytes = 0
+    n_lines = 0
+
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha256.update(block)
+            n_bytes += len(block)
+            n_lines += (decompressor.decompress(block) if decompressor else block).count(b'\n')
+
+    return sha256.hexdigest(), n_bytes, n_lines
+
+def round_coordinates(coords, precision):
+    """
+    Rounds the (nested) coordinates of a GeoJSON geometry.
+
+    Args:
+        coords (list): The coordinates.
+        precision (int): The number of decimals.
+
+    Returns:
+        list: The rounded coordinates.
+    """
+    if coords and isinstance(coords[0], list):
+        return [round_coordinates(c, precision) for c in coords]
+
+    return [round(c, precision) for c in coords]
+
+def serialize_feature(feature, precision=None):
+    """
+    Serializes a feature as a GeoJSONL line, optionally rounding its coordinates first: the
+    full repr of reprojected floats (-49.348038800000005) is mostly noise, which compresses badly.
+
+    Args:
+        feature (dict): The GeoJSON feature.
+        precision (int, optional): The number of decimals of the coordinates. Defaults to None (as is).
+
+    Returns:
+        str: The JSON line, with its newline.
+    """
+    geometry = feature.get('geometry')
+
+    if precision is not None and geometry and geometry.get('coordinates'):
+        feature = {**feature, 'geometry': {**geometry, 'coordinates': round_coordinates(geometry['coordinates'], precision)}}
+
+    return json.dumps(feature) + '\n'
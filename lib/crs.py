@@ -0,0 +1,135 @@
+from constants import *
+
+import functools
+import threading
+
+# pyproj and numpy are imported by the functions that need them, so the CRS names stay cheap to import
+
+OSM_CRS = 'EPSG:4326'
+
+def get_layer_crs(layer_metadata):
+    """
+    Finds the CRS the data of a layer is stored in.
+
+    Args:
+        layer_metadata (dict): The layer's metadata.
+
+    Returns:
+        str: The CRS, as 'EPSG:<code>', or DEFAULT_CRS if the metadata doesn't tell.
+    """
+    for spatial_reference in [layer_metadata.get('sourceSpatialReference'), (layer_metadata.get('extent') or {}).get('spatialReference')]:
+        wkid = (spatial_reference or {}).get('latestWkid') or (spatial_reference or {}).get('wkid')
+        if wkid:
+            return f'EPSG:{wkid}'
+
+    return DEFAULT_CRS
+
+def crs_wkid(crs):
+    """
+    Converts a CRS to the well-known id the map servers take as 'outSR'.
+
+    Args:
+        crs (str): The CRS, as anything pyproj understands ('EPSG:4326'...).
+
+    Returns:
+        int: The EPSG code.
+
+    Raises:
+        ValueError: If the CRS has no EPSG code.
+    """
+    from pyproj import CRS
+
+    wkid = CRS.from_user_input(crs).to_epsg()
+
+    if wkid is None:
+        raise ValueError(f"The CRS {crs} has no EPSG code")
+
+    return wkid
+
+@functools.lru_cache(maxsize=None)
+def _transformer(from_crs, to_crs, thread_id):
+    from pyproj import Transformer
+
+    return Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+def get_transformer(from_crs, to_crs=OSM_CRS):
+    """
+    Returns a cached pyproj Transformer (one per thread, as they can't be shared between threads).
+
+    Args:
+        from_crs (str): The source CRS.
+        to_crs (str, optional): The target CRS. Defaults to OSM_CRS.
+
+    Returns:
+        pyproj.Transformer: The transformer, with x/y (lon/lat) axis order.
+    """
+    return _transformer(from_crs, to_crs, threading.get_ident())
+
+def transform_coords(xy, from_crs, to_crs=OSM_CRS):
+    """
+    Reprojects an array of coordinates, in a single vectorized call.
+
+    Args:
+        xy (np.ndarray): A (n, 2) array of x/y coordinates.
+        from_crs (str): The source CRS.
+        to_crs (str, optional): The target CRS. Defaults to OSM_CRS.
+
+    Returns:
+        np.ndarray: The reprojected (n, 2) array.
+    """
+    import numpy as np
+
+    x, y = get_transformer(from_crs, to_crs).transform(xy[:, 0], xy[:, 1])
+
+    return np.column_stack([x, y])
+
+def reproject_features(features, from_crs, to_crs=OSM_CRS, precision=None):
+    """
+    Reprojects the geometries of a batch of GeoJSON features, in place.
+
+    The coordinates of the whole batch go through a single transform call; z values, if any,
+    are kept.
+
+    Args:
+        features (list): The GeoJSON features.
+        from_crs (str): The CRS of their coordinates.
+        to_crs (str, optional): The target CRS. Defaults to OSM_CRS.
+        precision (int, optional): The number of decimals to round the reprojected coordinates to.
+                                   Defaults to None (no rounding).
+
+    Returns:
+        list: The same features.
+    """
+    import numpy as np
+
+    positions = {}
+
+    def collect(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            # keyed by identity, in case a position list is shared (e.g. closing a ring)
+            positions[id(coords)] = coords
+        else:
+            for item in coords:
+                collect(item)
+
+    for feature in features:
+        geometry = feature.get('geometry')
+        if not geometry:
+            continue
+        for part in geometry.get('geometries') or [geometry]:
+            collect(part.get('coordinates') or [])
+
+    if not positions:
+        return features
+
+    positions = list(positions.values())
+    xy = transform_coords(np.array([position[:2] for position in positions], dtype=np.float64), from_crs, to_crs)
+
+    if precision is not None:
+        xy = xy.round(precision)
+
+    for position, (x, y) in zip(positions, xy.tolist()):
+        position[0] = x
+        position[1] = y
+
+    return features
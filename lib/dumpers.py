@@ -0,0 +1,580 @@
+import os, json
+import functools
+import inspect
+import logging
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+from tenacity import retry, wait_exponential, wait_random, stop_after_attempt
+from esridump.errors import EsriDownloadError
+
+from metrics import RunMetrics, timed_stage, count_metric, with_current_metrics
+
+from lib.files import create_dir, dump_json, listdir_fullpath
+from lib.crs import OSM_CRS, get_layer_crs, crs_wkid, reproject_features
+from lib.esri import EsriDumper, get_layer_url, get_basic_layer_stuff, get_layer_oid_stats
+from lib.endpoints import LayerEndpoint, get_layer_endpoints, check_endpoints_equivalent, EndpointPool
+from lib.geoparquet import arrow_schema_from_metadata, write_geoparquet_stream
+from lib.chunks import ChunkWriter, ChunkManifest
+from lib.compression import CHUNK_CODECS, CHUNK_EXTENSIONS, chunk_extension, strip_chunk_extension, serialize_feature
+from lib.paging import PageSizeController, CheckpointedPager, choose_reprojection
+
+def instrumented_dumper(func):
+    """
+    Decorator recording the metrics of each run of a dumper (see metrics.RunMetrics).
+
+    The run metrics are appended to '<layername>_metrics.jsonl' and written as
+    '<layername>_metrics.prom' in the output folder of the dumper (its `outfolderpath`, or the
+    folder of its `outpath`, with the base name of the file instead of the layer name).
+    Setting the CURITIBA_PROFILE environment variable to 'cprofile' or 'pyinstrument' also
+    profiles the run.
+
+    Args:
+        func (callable): A dumper taking `layername` and `outfolderpath` or `outpath` arguments.
+
+    Returns:
+        callable: The instrumented dumper.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs).arguments
+        layername = arguments.get('layername')
+
+        if arguments.get('outfolderpath'):
+            path_prefix = os.path.join(arguments['outfolderpath'], layername or '')
+        elif arguments.get('outpath'):
+            path_prefix = os.path.splitext(arguments['outpath'])[0]
+        else:
+            path_prefix = None
+
+        # invalid arguments are left to the dumper's own checks
+        if not layername or not path_prefix:
+            return func(*args, **kwargs)
+
+        create_dir(os.path.dirname(path_prefix) or '.')
+
+        metrics = RunMetrics(layername, path_prefix=path_prefix, labels={'dumper': func.__name__})
+        metrics.start()
+        status = 'failed'
+
+        try:
+            result = func(*args, **kwargs)
+            status = 'done'
+            return result
+        finally:
+            summary = metrics.stop(status)
+            logging.info(f"Metrics of the {func.__name__} run of {layername}: {json.dumps({key: summary[key] for key in ['status', 'elapsed', 'counters', 'features_per_second', 'peak_memory_bytes']})}")
+
+    return wrapper
+
+@instrumented_dumper
+def silly_dumper(layername, use_alt=False, outpath=None, different_crs=None, as_geoparquet=False, profile=None):
+    """
+    Dumps all features from a layer into a GeoDataFrame.
+
+    This function provides a simple way to dump all features from a layer without
+    any filtering or pagination. It is not optimized for large datasets, as the whole
+    layer is held in memory; use `streaming_dumper` for those.
+
+    Args:
+        layername (str): The name of the layer to dump.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        outpath (str, optional): The file path to save the output. If None, the
+                                 GeoDataFrame is not saved. Defaults to None.
+        different_crs (str, optional): The original CRS of the data if it's not
+                                       the default. Defaults to None.
+        as_geoparquet (bool, optional): If True, saves the output as a GeoParquet
+                                        file. Otherwise, saves as a GeoJSON file.
+                                        Defaults to False.
+        profile (FetchProfile, optional): A lighter fetch profile; the features are then
+                                          fetched by a CheckpointedPager. Defaults to None.
+
+    Returns:
+        gpd.GeoDataFrame: A GeoDataFrame containing all features from the layer.
+    
+    Raises:
+        ValueError: If layername is empty.
+        Exception: If there are issues with data retrieval or file operations.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+    
+    try:
+        _, d, total_feats, layer_metadata = get_basic_layer_stuff(layername, use_alt=use_alt)
+
+        if profile is not None:
+            oid_field = d._find_oid_field_name(layer_metadata) or 'objectid'
+            d = CheckpointedPager(d, oid_field, layer_metadata, page_size=layer_metadata.get('maxRecordCount') or 1000, profile=profile)
+
+        all_feats = []
+        batch = []
+
+        # reprojecting batch by batch, as the features arrive, rather than all of them at the end
+        for feature in tqdm(d, total=total_feats):
+            batch.append(feature)
+            if len(batch) >= 10000:
+                all_feats.extend(reproject_features(batch, different_crs) if different_crs else batch)
+                count_metric('features', len(batch))
+                batch = []
+        all_feats.extend(reproject_features(batch, different_crs) if different_crs else batch)
+        count_metric('features', len(batch))
+
+        # geopandas is only needed here, and is by far the slowest import
+        import geopandas as gpd
+
+        as_gdf = gpd.GeoDataFrame.from_features(all_feats, crs=OSM_CRS)
+
+        if outpath:
+            if as_geoparquet:
+                as_gdf.to_parquet(outpath)
+            else:
+                as_gdf.to_file(outpath)
+
+            # Create metadata path by replacing the file extension
+            base_name = os.path.splitext(outpath)[0]
+            metadata_outpath = f"{base_name}_metadata.json"
+            dump_json(layer_metadata, metadata_outpath)
+
+        return as_gdf
+    
+    except Exception as e:
+        logging.error(f"Error in silly_dumper for layer {layername}: {e}")
+        raise
+
+@instrumented_dumper
+def streaming_dumper(layername, outpath, use_alt=False, different_crs=None, batch_size=10000):
+    """
+    Dumps all features from a layer into a GeoParquet file, without holding the layer in memory.
+
+    It is the memory-bounded counterpart of `silly_dumper(..., as_geoparquet=True)`: features
+    are grouped into batches of `batch_size`, each batch is reprojected and written as a
+    row group of the file.
+
+    Args:
+        layername (str): The name of the layer to dump.
+        outpath (str): The path of the output GeoParquet file.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        different_crs (str, optional): The original CRS of the data if it's not
+                                       the default. Defaults to None.
+        batch_size (int, optional): The number of features of each batch/row group.
+                                    Defaults to 10000.
+
+    Returns:
+        int: The number of features written.
+
+    Raises:
+        ValueError: If layername is empty.
+        Exception: If there are issues with data retrieval or file operations.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+
+    try:
+        _, d, total_feats, layer_metadata = get_basic_layer_stuff(layername, use_alt=use_alt)
+
+        schema = arrow_schema_from_metadata(layer_metadata)
+        n_feats = write_geoparquet_stream(d, outpath, schema, batch_size=batch_size, different_crs=different_crs, total=total_feats)
+
+        base_name = os.path.splitext(outpath)[0]
+        dump_json(layer_metadata, f"{base_name}_metadata.json")
+
+        return n_feats
+
+    except Exception as e:
+        logging.error(f"Error in streaming_dumper for layer {layername}: {e}")
+        raise
+
+@instrumented_dumper
+def geojsonl_lazy_dumper(layername, use_alt=False, outfolderpath=None, out_crs=None, chunksize=1000, page_size=None, extra_parameters=None, timeout=None, buffer_bytes=1024 * 1024, buffer_features=1000, max_attempts=8, target_latency=10.0, profile=None, reprojection='auto', compression=None, precision=None):
+    """
+    Dumps features from a layer to a GeoJSONL file with resume capabilities.
+
+    Features are fetched in objectid order by a CheckpointedPager, which retries a failed
+    page from the last objectid handed over: transient failures (timeouts, HTTP 5xx...) are
+    retried up to `max_attempts` times with an adaptive back-off, permanent ones (HTTP 4xx,
+    invalid queries...) stop the download right away, keeping everything committed so far.
+
+    Unless a fixed `page_size` is given, the pages start at the layer's maxRecordCount and
+    are resized and paced by a PageSizeController to stay around `target_latency`. The
+    statistics of each run are saved as '<layername>_paging_stats.json'.
+
+    The features are written in `out_crs`, reprojected either by the server or, page by page,
+    on the client (see `choose_reprojection` for 'auto').
+
+    Across runs, it resumes after the highest objectid of the manifest of completed chunks
+    ('<layername>_manifest.jsonl'). Resuming only reads the manifest and works even if
+    `chunksize` changed between runs. A legacy '_downloaded_registry.txt' is migrated to a
+    manifest on the first run; as its chunks are in no objectid order, such a dump goes on by
+    offset, after the features of the manifest, until it is started afresh.
+
+    Args:
+        layername (str): The name of the layer to dump.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        outfolderpath (str, optional): The directory to save the output files.
+                                       Defaults to None.
+        out_crs (str, optional): The CRS for the output data. Defaults to None (OSM_CRS).
+        chunksize (int, optional): The number of features to save in each chunk file.
+                                   Defaults to 1000.
+        page_size (int, optional): A fixed number of features to request per page from
+                                   the server. Defaults to None (adaptive).
+        extra_parameters (dict, optional): Extra parameters to pass in the query to
+                                           the server. Defaults to None.
+        timeout (int, optional): The timeout for the HTTP requests. Defaults to None.
+        buffer_bytes (int, optional): In-memory buffer budget, in bytes, of each chunk
+                                      writer. Defaults to 1 MiB.
+        buffer_features (int, optional): In-memory buffer budget, in features, of each
+                                         chunk writer. Defaults to 1000.
+        max_attempts (int, optional): The maximum number of attempts of each page on
+                                      transient failures. Defaults to 8.
+        target_latency (float, optional): The targeted duration of the page requests, in
+                                          seconds, with adaptive pages. Defaults to 10.
+        profile (FetchProfile, optional): A lighter fetch profile (fewer fields, protocol
+                                          buffers...), saved as '<layername>_fetch_profile.json'.
+                                          Defaults to None (everything, as JSON).
+        reprojection (str, optional): Where to reproject the features: 'server', 'client' or
+                                      'auto'. Defaults to 'auto'.
+        compression (str, optional): Compress the chunks with 'gzip' or 'zstd'. Defaults to None
+                                     (plain text).
+        precision (int, optional): Round the coordinates to this many decimals before writing
+                                   them. Defaults to None (as received).
+
+    Returns:
+        dict: The paging statistics of the run (see CheckpointedPager.stats).
+    
+    Raises:
+        ValueError: If layername is empty or outfolderpath is None.
+        EsriDownloadError: If a page could not be downloaded (see CheckpointedPager).
+        Exception: If there are issues with file operations.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+    
+    if outfolderpath is None:
+        raise ValueError("outfolderpath cannot be None")
+    
+    def layer_outpath(layername, outfolderpath, j=0):
+        return os.path.join(outfolderpath, f'{layername}_chunk_{j}{chunk_extension(compression)}')
+
+    # create output folder if it doesn't exist
+    create_dir(outfolderpath)
+
+    # get layer stuff (a few bounded retries, the pages have their own)
+    get_layer_stuff = retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=10, max=120) + wait_random(min=1, max=12), reraise=True)(get_basic_layer_stuff)
+    layer_url, d, total_feats, layer_metadata = get_layer_stuff(layername, use_alt=use_alt)
+    oid_field = d._find_oid_field_name(layer_metadata) or 'objectid'
+
+    # chunk manifest, to give resume capabilities:
+    manifest_path = os.path.join(outfolderpath, f'{layername}_manifest.jsonl')
+    legacy_registry_path = os.path.join(outfolderpath, f'{layername}_downloaded_registry.txt')
+
+    if not os.path.exists(manifest_path) and os.path.exists(legacy_registry_path):
+        logging.info(f"Migrating {legacy_registry_path} to {manifest_path}")
+        ChunkManifest.from_legacy_registry(legacy_registry_path, manifest_path, oid_field=oid_field)
+        os.remove(legacy_registry_path)
+
+    manifest = ChunkManifest(manifest_path)
+
+    # the manifest holds the count and objectid range of every committed feature, so no chunk needs to be read:
+    start_idx = manifest.n_features
+    j = manifest.next_index
+    checkpoint = max((entry['oid_range'][1] for entry in manifest.entries if entry['oid_range'][1] is not None), default=None)
+
+    # chunks migrated from a legacy registry were paged by offset: objectids below their highest
+    # one may still be missing, so the dump goes on by offset
+    by_offset = any(entry.get('paging') == 'offset' for entry in manifest.entries)
+    if by_offset:
+        logging.warning(f"The chunks of {manifest_path} were paged by offset, resuming at offset {start_idx}")
+        checkpoint = None
+    chunk_extra = {'paging': 'offset'} if by_offset else {}
+
+    # deleting this layer's chunks that are not in the manifest (uncompleted, or stale from a run with another chunksize):
+    codec_suffixes = '|'.join(re.escape(suffix) for suffix in CHUNK_CODECS.values() if suffix)
+    chunk_pattern = re.compile(rf'^{re.escape(layername)}_chunk_\d+\.geojsonl({codec_suffixes})?({re.escape(ChunkWriter.TMP_SUFFIX)})?$')
+    registered = manifest.filenames
+
+    for filename in os.listdir(outfolderpath):
+        if chunk_pattern.match(filename) and filename not in registered:
+            try:
+                os.remove(os.path.join(outfolderpath, filename))
+                logging.info(f"Removed incomplete chunk: {filename}")
+            except OSError as e:
+                logging.warning(f"Could not remove file {filename}: {e}")
+
+    # for proper resuming capabilities: 
+    out_crs = out_crs or OSM_CRS
+    d = EsriDumper(layer_url, extra_query_args=extra_parameters, timeout=timeout, outSR=str(crs_wkid(out_crs)))
+
+    if reprojection == 'auto':
+        source_crs = choose_reprojection(d, oid_field, layer_metadata, out_crs=out_crs)
+    elif reprojection == 'client':
+        source_crs = get_layer_crs(layer_metadata)
+    else:
+        source_crs = None
+
+    pager_kwargs = dict(checkpoint=checkpoint, max_attempts=max_attempts, profile=profile, source_crs=source_crs, out_crs=out_crs,
+                        offset=start_idx if by_offset else None)
+
+    if page_size is None:
+        page_sizer = PageSizeController(layer_metadata.get('maxRecordCount') or 1000, target_latency=target_latency)
+        pager = CheckpointedPager(d, oid_field, layer_metadata, page_sizer=page_sizer, **pager_kwargs)
+    else:
+        pager = CheckpointedPager(d, oid_field, layer_metadata, page_size=page_size, **pager_kwargs)
+
+    if profile is not None:
+        dump_json(profile.to_dict(), os.path.join(outfolderpath, f'{layername}_fetch_profile.json'))
+
+    stats_outpath = os.path.join(outfolderpath, f'{layername}_paging_stats.json')
+
+    outpath = layer_outpath(layername, outfolderpath, j=j)
+    
+    metadata_outpath = os.path.join(outfolderpath, f'{layername}_metadata.json')
+    dump_json(layer_metadata, metadata_outpath)
+
+    def new_writer(outpath):
+        return ChunkWriter(outpath, buffer_bytes=buffer_bytes, buffer_features=buffer_features)
+
+    writer = new_writer(outpath)
+    oids = []
+
+    try:
+        for i, feature in tqdm(enumerate(pager, start=start_idx), total=total_feats, initial=start_idx):
+            if (i - start_idx) % chunksize == 0 and i > start_idx:
+                # noting that the current chunk was properly downloaded, only after it was renamed
+                writer.close()
+                manifest.add_writer(writer, j, (min(oids, default=None), max(oids, default=None)), **chunk_extra)
+
+                # updating outfile:
+                j += 1
+                outpath = layer_outpath(layername, outfolderpath, j=j)
+                writer = new_writer(outpath)
+                oids = []
+
+            oid = feature['properties'].get(oid_field)
+            if oid is not None:
+                oids.append(oid)
+
+            with timed_stage('serialize'):
+                line = serialize_feature(feature, precision)
+            writer.write(line)
+            count_metric('features')
+    except BaseException:
+        # the partial chunk is discarded, it will be downloaded again when resuming
+        writer.abort()
+        logging.error(f"Dump of {layername} stopped after objectid {pager.checkpoint} ({pager.n_retries} retries); the next run resumes after the last registered chunk")
+        raise
+    finally:
+        stats = pager.stats()
+        dump_json(stats, stats_outpath)
+        logging.info(f"Paging stats of {layername}: {stats}")
+
+    # the last chunk is kept, but not registered, so it gets refreshed on the next run
+    if writer.n_lines:
+        writer.close()
+    else:
+        writer.abort()
+
+    return stats
+
+def split_oid_ranges(oid_min, oid_max, range_size):
+    """
+    Splits an objectid interval into disjoint, contiguous, inclusive ranges.
+
+    Args:
+        oid_min (int): The first objectid of the interval.
+        oid_max (int): The last objectid of the interval.
+        range_size (int): The number of objectids spanned by each range.
+
+    Returns:
+        list: A list of (first, last) tuples covering [oid_min, oid_max].
+    
+    Raises:
+        ValueError: If range_size is not positive.
+    """
+    if range_size < 1:
+        raise ValueError("range_size must be positive")
+
+    return [(a, min(a + range_size - 1, oid_max)) for a in range(oid_min, oid_max + 1, range_size)]
+
+@instrumented_dumper
+def geojsonl_parallel_dumper(layername, use_alt=False, outfolderpath=None, chunksize=1000, max_workers=4, page_size=100, extra_parameters=None, timeout=None, range_attempts=3, compression=None, precision=None, striped=False):
+    """
+    Dumps features from a layer to GeoJSONL files, fetching objectid ranges concurrently.
+
+    The objectid interval of the layer is split into disjoint ranges, sized so that each one
+    holds about `chunksize` features, and each range is fetched by its own EsriDumper with an
+    'objectid BETWEEN a AND b' filter, writing one chunk per range. Completed ranges are
+    recorded in a manifest ('<layername>_ranges_manifest.jsonl'), so a rerun only fetches the
+    missing ones. Use a different output folder than `geojsonl_lazy_dumper`, as the chunk
+    naming and manifests are not shared.
+
+    With `striped`, the ranges are split between the main and the alternative servers, once
+    they are found to serve the same layer (see `check_endpoints_equivalent`; the check is saved
+    as '<layername>_endpoints_check.json', and the dump falls back to the `use_alt` server if it
+    fails). An EndpointPool sends each range to the server expected to finish it first and
+    leaves out the failing ones for a while, and a failed range is retried right away on the
+    other server. The server of each range is recorded in the manifest.
+
+    Args:
+        layername (str): The name of the layer to dump.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        outfolderpath (str, optional): The directory to save the output files.
+                                       Defaults to None.
+        chunksize (int, optional): The approximate number of features of each range/chunk.
+                                   Defaults to 1000.
+        max_workers (int, optional): The maximum number of ranges being fetched at the same
+                                     time, to keep the load on the server bounded. Defaults to 4.
+        page_size (int, optional): The number of features to request per page from
+                                   the server. Defaults to 100.
+        extra_parameters (dict, optional): Extra parameters to pass in the query to
+                                           the server. Defaults to None.
+        timeout (int, optional): The timeout for the HTTP requests. Defaults to None.
+        range_attempts (int, optional): How many times a failing range is tried before
+                                        giving up on it. Defaults to 3.
+        compression (str, optional): Compress the chunks with 'gzip' or 'zstd'. Defaults to None
+                                     (plain text).
+        precision (int, optional): Round the coordinates to this many decimals before writing
+                                   them. Defaults to None (as received).
+        striped (bool, optional): Whether to split the ranges between both servers. Defaults to False.
+
+    Returns:
+        dict: The statistics of each server used (see LayerEndpoint.stats).
+    
+    Raises:
+        ValueError: If layername is empty or outfolderpath is None.
+        EsriDownloadError: If any range could not be downloaded; the completed ones are kept.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+    
+    if outfolderpath is None:
+        raise ValueError("outfolderpath cannot be None")
+
+    create_dir(outfolderpath)
+
+    def range_outpath(first, last):
+        return os.path.join(outfolderpath, f'{layername}_range_{first}_{last}{chunk_extension(compression)}')
+
+    manifest = ChunkManifest(os.path.join(outfolderpath, f'{layername}_ranges_manifest.jsonl'))
+    # ranges written with another compression are done too
+    registered = {strip_chunk_extension(filename) for filename in manifest.filenames}
+
+    # leftovers of interrupted ranges:
+    for tmp_path in listdir_fullpath(outfolderpath, extension=tuple(extension + ChunkWriter.TMP_SUFFIX for extension in CHUNK_EXTENSIONS)):
+        try:
+            os.remove(tmp_path)
+        except OSError as e:
+            logging.warning(f"Could not remove file {tmp_path}: {e}")
+
+    oid_field, oid_min, oid_max, total_feats, layer_metadata = get_layer_oid_stats(layername, use_alt=use_alt)
+
+    dump_json(layer_metadata, os.path.join(outfolderpath, f'{layername}_metadata.json'))
+
+    endpoints = [LayerEndpoint('alt' if use_alt else 'main', get_layer_url(layername, use_alt=use_alt))]
+
+    if striped:
+        candidates = get_layer_endpoints(layername)
+
+        if len(candidates) > 1:
+            equivalent, report = check_endpoints_equivalent(candidates, timeout=timeout)
+            dump_json(report, os.path.join(outfolderpath, f'{layername}_endpoints_check.json'))
+
+            if equivalent:
+                endpoints = candidates
+            else:
+                logging.warning(f"Not striping {layername} across the servers: {report['differences']}")
+        else:
+            logging.warning(f"Not striping {layername}: only one server has it")
+
+    pool = EndpointPool(endpoints)
+
+    # ranges are sized by the mean objectid density, so they hold about 'chunksize' features:
+    density = (total_feats / (oid_max - oid_min + 1)) if total_feats else 1
+    range_size = max(1, math.ceil(chunksize / density))
+
+    ranges = split_oid_ranges(oid_min, oid_max, range_size)
+    pending = [(index, r) for index, r in enumerate(ranges) if strip_chunk_extension(os.path.basename(range_outpath(*r))) not in registered]
+
+    logging.info(f"{layername}: {len(ranges)} ranges of {range_size} objectids, {len(pending)} pending")
+
+    manifest_lock = threading.Lock()
+
+    # range index -> the endpoint of its last failure
+    failed_on = {}
+    backoff = wait_exponential(multiplier=1, min=10, max=120) + wait_random(min=1, max=12)
+
+    def range_wait(retry_state):
+        # failing over to another server needs no pause
+        if pool.has_alternative(failed_on.get(retry_state.args[0])):
+            return 0
+        return backoff(retry_state)
+
+    @retry(stop=stop_after_attempt(range_attempts), wait=range_wait, reraise=True)
+    def dump_range(index, first, last):
+        query_args = dict(extra_parameters or {})
+        where = f'{oid_field} BETWEEN {first} AND {last}'
+        if query_args.get('where'):
+            where = f"({query_args['where']}) AND ({where})"
+        query_args['where'] = where
+
+        endpoint = pool.acquire(exclude=failed_on.get(index))
+        start = time.monotonic()
+
+        try:
+            d = EsriDumper(endpoint.url, max_page_size=page_size, extra_query_args=query_args, timeout=timeout)
+
+            writer = ChunkWriter(range_outpath(first, last))
+
+            with writer:
+                for feature in d:
+                    with timed_stage('serialize'):
+                        line = serialize_feature(feature, precision)
+                    writer.write(line)
+                    count_metric('features')
+        except Exception as e:
+            failed_on[index] = endpoint
+            pool.release(endpoint, error=e)
+            logging.warning(f"Range {first}-{last} of {layername} failed on the {endpoint.name} server: {e}")
+            raise
+
+        pool.release(endpoint, n_features=writer.n_lines, seconds=time.monotonic() - start)
+
+        with manifest_lock:
+            manifest.add_writer(writer, index, (first, last), server=endpoint.name)
+
+        return writer.n_lines
+
+    failed = []
+    dump_range = with_current_metrics(dump_range)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(dump_range, index, *r): r for index, r in pending}
+
+        with tqdm(total=total_feats) as pbar:
+            for future in as_completed(futures):
+                first, last = futures[future]
+                try:
+                    pbar.update(future.result())
+                except Exception as e:
+                    logging.error(f"Range {first}-{last} of {layername} failed: {e}")
+                    failed.append((first, last))
+
+    endpoint_stats = pool.stats()
+    dump_json(endpoint_stats, os.path.join(outfolderpath, f'{layername}_endpoint_stats.json'))
+
+    for name, stats in endpoint_stats.items():
+        logging.info(f"{layername} on the {name} server: {stats['n_requests']} ranges, {stats['n_features']} features, {stats['n_failures']} failures")
+
+    if failed:
+        raise EsriDownloadError(f"{len(failed)} of {len(pending)} ranges of {layername} failed, rerun to resume: {sorted(failed)}")
+
+    return endpoint_stats
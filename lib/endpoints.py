@@ -0,0 +1,272 @@
+from constants import *
+
+import logging
+import random
+import threading
+import time
+
+from lib.esri import EsriDumper, get_layer_url, parse_esri_response
+
+class LayerEndpoint:
+    """
+    One of the map servers exposing a layer, with the health record of the requests sent to it.
+
+    Args:
+        name (str): 'main' (MAPSERVER_URL) or 'alt' (MAPSERVER_URL_ALT).
+        url (str): The URL of the layer on that server.
+    """
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+        self.in_flight = 0
+        self.n_requests = 0
+        self.n_features = 0
+        self.n_failures = 0
+        self.consecutive_failures = 0
+        self.n_disabled = 0
+        self.disabled_until = 0.0
+        # times left out since the last success, doubling the cooldown
+        self.strikes = 0
+        self.seconds_per_feature = None
+
+    @property
+    def use_alt(self):
+        return self.name == 'alt'
+
+    def stats(self):
+        """
+        Returns the statistics of the endpoint.
+
+        Returns:
+            dict: The request, feature and failure counts, the times it was disabled and its
+                  smoothed seconds per feature.
+        """
+        return {
+            'url': self.url,
+            'n_requests': self.n_requests,
+            'n_features': self.n_features,
+            'n_failures': self.n_failures,
+            'n_disabled': self.n_disabled,
+            'seconds_per_feature': round(self.seconds_per_feature, 6) if self.seconds_per_feature is not None else None,
+        }
+
+def get_layer_endpoints(layername):
+    """
+    Lists the servers exposing a layer: the main one if LAYER_IDS has `layername`, the
+    alternative one if it has `<layername>_alt`.
+
+    Args:
+        layername (str): The name of the layer.
+
+    Returns:
+        list: The LayerEndpoint objects, main first.
+
+    Raises:
+        ValueError: If layername is empty or no server has it.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+
+    endpoints = [LayerEndpoint(name, get_layer_url(layername, use_alt=use_alt))
+                 for name, use_alt in (('main', False), ('alt', True))
+                 if (f'{layername}_alt' if use_alt else layername) in LAYER_IDS]
+
+    if not endpoints:
+        raise ValueError(f"Layer '{layername}' not found. Available layers: {list(LAYER_IDS)}")
+
+    return endpoints
+
+def _query_ids(dumper, where):
+    query_args = dumper._build_query_args({'where': where, 'returnIdsOnly': 'true', 'f': 'json'})
+    response = dumper._request('POST', dumper._build_url('/query'), headers=dumper._build_headers(), data=query_args)
+
+    return set(parse_esri_response(response).get('objectIds') or [])
+
+def check_endpoints_equivalent(endpoints, sample_size=200, seed=None, timeout=None):
+    """
+    Checks that several servers serve the same layer, before splitting its requests among them.
+
+    The layers must have the same fields, objectid field, feature count and objectid range,
+    and the same objectids among `sample_size` random ones of that range.
+
+    Args:
+        endpoints (list): The LayerEndpoint objects.
+        sample_size (int, optional): The number of objectids looked up on every server.
+                                     Defaults to 200.
+        seed (int, optional): The seed of the sample. Defaults to None (random).
+        timeout (int, optional): The timeout for the HTTP requests. Defaults to None.
+
+    Returns:
+        tuple: A tuple containing:
+            - bool: Whether the layers are equivalent.
+            - dict: The report, with what each server answered and the differences found.
+    """
+    report = {'endpoints': {}, 'differences': []}
+    described = {}
+
+    for endpoint in endpoints:
+        d = EsriDumper(endpoint.url, timeout=timeout)
+        metadata = d.get_metadata()
+        oid_field = d._find_oid_field_name(metadata)
+        oid_min, oid_max = d._get_layer_min_max(oid_field) if oid_field else (None, None)
+
+        described[endpoint.name] = {
+            'fields': sorted(field['name'] for field in metadata.get('fields') or []),
+            'oid_field': oid_field,
+            'count': d.get_feature_count(),
+            'oid_min': oid_min,
+            'oid_max': oid_max,
+        }
+        report['endpoints'][endpoint.name] = {key: value for key, value in described[endpoint.name].items() if key != 'fields'}
+
+    reference_name = endpoints[0].name
+    reference = described[reference_name]
+
+    for name, description in described.items():
+        for key, value in description.items():
+            if value != reference[key]:
+                report['differences'].append(f"{key} of {name} differs from {reference_name}'s")
+
+    if not report['differences'] and reference['oid_field'] and reference['oid_min'] is not None:
+        rng = random.Random(seed)
+        span = reference['oid_max'] - reference['oid_min'] + 1
+        sample = sorted(rng.sample(range(reference['oid_min'], reference['oid_max'] + 1), min(sample_size, span)))
+        where = f"{reference['oid_field']} IN ({','.join(str(oid) for oid in sample)})"
+
+        found = {endpoint.name: _query_ids(EsriDumper(endpoint.url, timeout=timeout), where) for endpoint in endpoints}
+        report['sample_size'] = len(sample)
+        report['sample_found'] = {name: len(ids) for name, ids in found.items()}
+
+        for name, ids in found.items():
+            if ids != found[reference_name]:
+                report['differences'].append(f"{len(ids ^ found[reference_name])} sampled objectids differ between {name} and {reference_name}")
+
+    return not report['differences'], report
+
+class EndpointPool:
+    """
+    Splits the requests of a dump among equivalent endpoints, moving the work away from the
+    slow or failing ones.
+
+    Each request goes to the healthy endpoint expected to finish it first, from its requests in
+    flight and its smoothed seconds per feature, so a slower server gets proportionally fewer
+    requests. After `max_failures` consecutive failures an endpoint is left out for `cooldown`
+    seconds (doubling every time it is left out again before a success); it is then tried
+    again with the next request. If every endpoint is out, the one coming back first is used anyway.
+
+    Thread-safe: the workers of a dump share one pool. Note that endpoints on a same host
+    share that host's budget, if one is set with `set_host_budget`.
+
+    Args:
+        endpoints (list): The LayerEndpoint objects.
+        max_failures (int, optional): The consecutive failures after which an endpoint is left
+                                      out. Defaults to 2.
+        cooldown (float, optional): The first period an endpoint is left out, in seconds.
+                                    Defaults to 60.
+        max_cooldown (float, optional): The longest period, in seconds. Defaults to 900.
+        smoothing (float, optional): The weight of each new sample in the seconds per feature.
+                                     Defaults to 0.3.
+    """
+    def __init__(self, endpoints, max_failures=2, cooldown=60.0, max_cooldown=900.0, smoothing=0.3):
+        if not endpoints:
+            raise ValueError("endpoints cannot be empty")
+
+        self.endpoints = list(endpoints)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+
+    def _healthy(self, now):
+        return [endpoint for endpoint in self.endpoints if endpoint.disabled_until <= now]
+
+    def has_alternative(self, endpoint):
+        """
+        Tells whether another endpoint than `endpoint` can take a request right now.
+
+        Args:
+            endpoint (LayerEndpoint): The endpoint, None for any.
+
+        Returns:
+            bool: Whether a healthy endpoint other than `endpoint` exists.
+        """
+        with self._lock:
+            return any(other is not endpoint for other in self._healthy(time.monotonic())) if endpoint is not None else False
+
+    def acquire(self, exclude=None):
+        """
+        Picks the endpoint of the next request.
+
+        Args:
+            exclude (LayerEndpoint, optional): An endpoint to avoid if any other is healthy, e.g.
+                                               the one the request just failed on. Defaults to None.
+
+        Returns:
+            LayerEndpoint: The endpoint, to `release` once the request is over.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self._healthy(now) if endpoint is not exclude] or self._healthy(now)
+
+            if not candidates:
+                candidates = [min(self.endpoints, key=lambda endpoint: endpoint.disabled_until)]
+
+            # endpoints without measurements yet are assumed as fast as the measured ones
+            known = [endpoint.seconds_per_feature for endpoint in self.endpoints if endpoint.seconds_per_feature is not None]
+            default_speed = sum(known) / len(known) if known else 1.0
+
+            endpoint = min(candidates, key=lambda endpoint: (endpoint.in_flight + 1) * (endpoint.seconds_per_feature or default_speed))
+            endpoint.in_flight += 1
+            endpoint.n_requests += 1
+
+            return endpoint
+
+    def release(self, endpoint, n_features=0, seconds=None, error=None):
+        """
+        Records the outcome of a request.
+
+        Args:
+            endpoint (LayerEndpoint): The endpoint returned by `acquire`.
+            n_features (int, optional): The number of features it returned. Defaults to 0.
+            seconds (float, optional): Its duration. Defaults to None.
+            error (Exception, optional): Its failure, if it failed. Defaults to None.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+
+            if error is not None:
+                endpoint.n_failures += 1
+                endpoint.consecutive_failures += 1
+
+                if endpoint.consecutive_failures >= self.max_failures:
+                    cooldown = min(self.max_cooldown, self.cooldown * 2 ** endpoint.strikes)
+                    endpoint.disabled_until = time.monotonic() + cooldown
+                    endpoint.n_disabled += 1
+                    endpoint.strikes += 1
+                    endpoint.consecutive_failures = 0
+                    logging.warning(f"Endpoint {endpoint.name} ({endpoint.url}) failed {self.max_failures} times in a row, left out for {cooldown:.0f}s: {error}")
+                return
+
+            endpoint.consecutive_failures = 0
+            endpoint.strikes = 0
+            endpoint.n_features += n_features
+
+            if seconds is not None and n_features:
+                sample = seconds / n_features
+                if endpoint.seconds_per_feature is None:
+                    endpoint.seconds_per_feature = sample
+                else:
+                    endpoint.seconds_per_feature += self.smoothing * (sample - endpoint.seconds_per_feature)
+
+    def stats(self):
+        """
+        Returns the statistics of every endpoint.
+
+        Returns:
+            dict: The {endpoint name: statistics} dict (see LayerEndpoint.stats).
+        """
+        with self._lock:
+            return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
@@ -0,0 +1,329 @@
+from constants import *
+
+import logging
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+from esridump.dumper import EsriDumper as BaseEsriDumper
+from esridump.errors import EsriDownloadError
+
+from esri_pbf import decode_feature_collection
+from metrics import timed_stage, count_metric
+
+from lib.files import dump_json
+
+# response cache used by every EsriDumper, see set_http_cache
+HTTP_CACHE = None
+
+def set_http_cache(cache):
+    """
+    Sets (or, with None, unsets) the response cache used by all the EsriDumper requests.
+
+    Args:
+        cache (ResponseCache): The cache.
+    """
+    global HTTP_CACHE
+    HTTP_CACHE = cache
+
+def evict_cached_response(method, url, params=None, data=None):
+    """
+    Forgets a request in the response cache set with `set_http_cache`, if any, so retrying it
+    sends it again instead of getting the same (unusable) cached response.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The URL.
+        params (dict, optional): The query string arguments. Defaults to None.
+        data (dict, optional): The form arguments. Defaults to None.
+    """
+    if HTTP_CACHE is not None:
+        HTTP_CACHE.evict(HTTP_CACHE.request_key(method, url, params=params, data=data))
+
+class HostBudget:
+    """
+    Request budget per host, shared by all the EsriDumper requests of the process (all the
+    threads, so concurrent dumps of different layers of a server are limited together).
+
+    Args:
+        max_concurrent (int, optional): The maximum number of simultaneous requests to a host.
+                                        Defaults to 4.
+        max_per_second (float, optional): The maximum rate of requests to a host.
+                                          Defaults to None (no limit).
+    """
+    def __init__(self, max_concurrent=4, max_per_second=None):
+        self.max_concurrent = max_concurrent
+        self.max_per_second = max_per_second
+
+        self.n_requests = {}
+
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    def acquire(self, url):
+        """
+        Waits for a slot of the host of `url`.
+
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            str: The host, to `release` the slot with.
+        """
+        host = urlparse(url).netloc
+
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_concurrent)
+            semaphore = self._semaphores[host]
+
+        semaphore.acquire()
+
+        if self.max_per_second:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + 1 / self.max_per_second
+            if start > now:
+                time.sleep(start - now)
+
+        with self._lock:
+            self.n_requests[host] = self.n_requests.get(host, 0) + 1
+
+        return host
+
+    def release(self, host):
+        self._semaphores[host].release()
+
+HOST_BUDGET = None
+
+def set_host_budget(budget):
+    """
+    Sets (or, with None, unsets) the per-host request budget of all the EsriDumper requests.
+
+    Args:
+        budget (HostBudget): The budget.
+    """
+    global HOST_BUDGET
+    HOST_BUDGET = budget
+
+class EsriDumper(BaseEsriDumper):
+    """
+    esridump's EsriDumper, with its HTTP requests going through the response cache set with
+    `set_http_cache`, if any. With an offline cache, the pauses and retries between requests
+    are disabled, so a cache miss fails right away. The requests actually sent wait for the
+    budget set with `set_host_budget`, if any.
+
+    Setting the `pause_seconds` class attribute overrides esridump's pause between batches of
+    requests (10 s every 5 requests), e.g. 0 against a local server.
+    """
+    pause_seconds = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if self.pause_seconds is not None:
+            self._pause_seconds = self.pause_seconds
+
+        if HTTP_CACHE is not None and HTTP_CACHE.offline:
+            self._pause_seconds = 0
+            self._num_of_retry = 1
+
+    def _request(self, method, url, **kwargs):
+        base_request = super()._request
+
+        def send():
+            count_metric('requests')
+
+            if HOST_BUDGET is None:
+                with timed_stage('http'):
+                    return base_request(method, url, **kwargs)
+
+            with timed_stage('budget_wait'):
+                host = HOST_BUDGET.acquire(url)
+            try:
+                with timed_stage('http'):
+                    return base_request(method, url, **kwargs)
+            finally:
+                HOST_BUDGET.release(host)
+
+        if HTTP_CACHE is None:
+            response = send()
+        else:
+            response = HTTP_CACHE.request(method, url, send, params=kwargs.get('params'), data=kwargs.get('data'))
+
+        count_metric('bytes_in', len(response.content))
+
+        return response
+
+def get_layer_url(layername, use_alt=False):
+    """
+    Constructs the URL for a specific layer.
+
+    Args:
+        layername (str): The name of the layer.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+
+    Returns:
+        str: The full URL of the layer.
+    
+    Raises:
+        ValueError: If layername is empty or not found in LAYER_IDS.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+    
+    baseurl = MAPSERVER_URL_ALT if use_alt else MAPSERVER_URL
+
+    if not baseurl.endswith('/'):
+        baseurl += '/'
+
+    layer_id_key = f"{layername}_alt" if use_alt else layername
+    
+    if layer_id_key not in LAYER_IDS:
+        available_layers = list(LAYER_IDS.keys())
+        raise ValueError(f"Layer '{layer_id_key}' not found. Available layers: {available_layers}")
+    
+    layer_id = LAYER_IDS[layer_id_key]
+
+    return urljoin(baseurl, str(layer_id))
+
+def get_layer_metadata(layername, use_alt=False, outpath=None):
+    """
+    Retrieves and optionally saves the metadata of a map service layer.
+
+    Args:
+        layername (str): The name of the layer.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        outpath (str, optional): The file path to save the metadata as a JSON file.
+                                 If None, the metadata is not saved. Defaults to None.
+
+    Returns:
+        dict: A dictionary containing the layer's metadata.
+    """
+    d = EsriDumper(get_layer_url(layername, use_alt=use_alt))
+    md = d.get_metadata()
+
+    if outpath:
+        dump_json(md, outpath)
+
+    return md
+
+def get_basic_layer_stuff(layername, use_alt=False):
+    """
+    Initializes an EsriDumper and retrieves basic layer information.
+
+    Args:
+        layername (str): The name of the layer.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+
+    Returns:
+        tuple: A tuple containing:
+            - str: The layer's URL.
+            - EsriDumper: An EsriDumper instance for the layer.
+            - int: The total number of features in the layer.
+            - dict: The layer's metadata.
+    """
+    layer_url = get_layer_url(layername, use_alt=use_alt)
+    d = EsriDumper(layer_url)
+
+    total_feats = None
+    try:
+        total_feats = d.get_feature_count()
+    except Exception as e:
+        logging.error(e)
+    
+    layer_metadata = d.get_metadata()
+
+    return layer_url, d, total_feats, layer_metadata
+
+def get_layer_oid_stats(layername, use_alt=False):
+    """
+    Retrieves the objectid field name, range and feature count of a layer.
+
+    Args:
+        layername (str): The name of the layer.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+
+    Returns:
+        tuple: A tuple containing:
+            - str: The name of the objectid field.
+            - int: The smallest objectid in the layer.
+            - int: The largest objectid in the layer.
+            - int: The total number of features in the layer.
+            - dict: The layer's metadata.
+
+    Raises:
+        EsriDownloadError: If the server can't provide the objectid field or its min/max.
+    """
+    _, d, total_feats, layer_metadata = get_basic_layer_stuff(layername, use_alt=use_alt)
+
+    oid_field = d._find_oid_field_name(layer_metadata)
+
+    if not oid_field:
+        raise EsriDownloadError(f"Could not find the objectid field of layer {layername}")
+
+    oid_min, oid_max = d._get_layer_min_max(oid_field)
+
+    return oid_field, oid_min, oid_max, total_feats, layer_metadata
+
+# HTTP statuses (and Esri error codes) worth retrying: timeouts, throttling and server-side failures
+TRANSIENT_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class TransientDownloadError(EsriDownloadError):
+    """
+    A request failure expected to go away by itself (timeout, dropped connection, HTTP 5xx...).
+    """
+
+class PermanentDownloadError(EsriDownloadError):
+    """
+    A request failure that retrying won't fix (HTTP 4xx, invalid query...).
+    """
+
+def parse_esri_response(response, pbf=False, precision=None):
+    """
+    Parses a query response, classifying its failures as transient or permanent.
+
+    Args:
+        response (requests.Response): The response.
+        pbf (bool, optional): Whether the response may be a protobuf one (errors still come as JSON).
+                              Defaults to False.
+        precision (int, optional): The number of decimals of the decoded protobuf coordinates.
+                                   Defaults to None.
+
+    Returns:
+        dict: The parsed data, laid out as the Esri JSON responses.
+
+    Raises:
+        TransientDownloadError: On HTTP 408/429/5xx, truncated bodies and Esri 5xx errors.
+        PermanentDownloadError: On any other HTTP error status or Esri error.
+    """
+    if response.status_code != 200:
+        error_class = TransientDownloadError if response.status_code in TRANSIENT_HTTP_STATUSES else PermanentDownloadError
+        raise error_class(f"HTTP {response.status_code}: {response.text[:200]}")
+
+    if pbf and not response.content.lstrip().startswith(b'{'):
+        try:
+            return decode_feature_collection(response.content, precision=precision)
+        except ValueError as e:
+            raise TransientDownloadError(f"Could not decode the protobuf response: {e}")
+
+    try:
+        data = response.json()
+    except ValueError as e:
+        # a cut body is the usual cause of a 200 that is not JSON
+        raise TransientDownloadError(f"Could not parse the response as JSON: {e}")
+
+    error = data.get('error')
+    if error:
+        code = error.get('code') if isinstance(error, dict) else None
+        message = error.get('message') if isinstance(error, dict) else error
+        error_class = TransientDownloadError if code is None or code in TRANSIENT_HTTP_STATUSES else PermanentDownloadError
+        raise error_class(f"Esri error {code}: {message}")
+
+    return data
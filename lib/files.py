@@ -0,0 +1,210 @@
+import os, json
+import hashlib
+import logging
+from json import JSONEncoder
+
+def create_dir(path):
+    """
+    Creates a directory if it does not already exist.
+
+    Args:
+        path (str): The path of the directory to create.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+def create_folderlist(inputlist):
+    """
+    Creates a list of directories.
+
+    Args:
+        inputlist (list): A list of directory paths to create.
+    """
+    return [create_dir(dirpath) for dirpath in inputlist]
+
+def read_json(path,default={}):
+    """
+    Reads a JSON file from the specified path.
+
+    Args:
+        path (str): The path to the JSON file.
+        default (Union[dict, list, None], optional): The default value to return if the file does not exist.
+                                                    If default is a dictionary, it will be used as the default value.
+                                                    If default is a list, it will be used as the default value.
+                                                    If default is None, an empty dictionary will be used as the default value.
+                                                    Defaults to {}.
+
+    Returns:
+        dict or list: The contents of the JSON file, or the default value if the file does not exist.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    else:
+        return default
+
+class Int64Encoder(JSONEncoder):
+    """
+    A custom JSON encoder to handle numpy and pandas types that are not serializable by default.
+    """
+    def default(self, o):
+        import numpy as np
+        import pandas as pd
+        
+        # Handle numpy integer types
+        if isinstance(o, (np.integer, np.int64, np.int32, np.int16, np.int8)):
+            return int(o)
+        # Handle numpy floating point types
+        elif isinstance(o, (np.floating, np.float64, np.float32, np.float16)):
+            if np.isnan(o):
+                return None
+            return float(o)
+        # Handle numpy boolean types
+        elif isinstance(o, (np.bool_, np.bool)):
+            return bool(o)
+        # Handle numpy string types
+        elif isinstance(o, (np.str_, np.unicode_)):
+            return str(o)
+        # Handle pandas NaType
+        elif pd.isna(o):
+            return None
+        # Handle any other numpy types by converting to Python types
+        elif hasattr(o, 'item'):
+            return o.item()
+        
+        return super().default(o)
+
+def dump_json(data, path):
+    """
+    Dumps a dictionary or list to a JSON file.
+
+    Args:
+        data (dict or list): The data to dump.
+        path (str): The path to the output JSON file.
+    
+    Raises:
+        OSError: If there's an issue creating directories or writing the file.
+        TypeError: If the data is not JSON serializable.
+    """
+    try:
+        # Ensure the directory exists
+        directory = os.path.dirname(path)
+        if directory:
+            create_dir(directory)
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4, cls=Int64Encoder)
+    except (OSError, IOError) as e:
+        logging.error(f"Error writing JSON file {path}: {e}")
+        raise
+    except TypeError as e:
+        logging.error(f"Error serializing data to JSON for {path}: {e}")
+        raise
+
+def append_to_file(filepath, data_str):
+    """
+    Appends a string to a file.
+
+    Args:
+        filepath (str): The path to the file.
+        data_str (str): The string to append.
+    
+    Raises:
+        OSError: If there's an issue creating directories or writing to the file.
+    """
+    try:
+        # Ensure the directory exists
+        directory = os.path.dirname(filepath)
+        if directory:
+            create_dir(directory)
+        
+        with open(filepath, 'a', encoding='utf-8') as f:
+            f.write(data_str)
+    except (OSError, IOError) as e:
+        logging.error(f"Error appending to file {filepath}: {e}")
+        raise
+
+
+def read_file_as_list(filepath):
+    """
+    Reads a file and returns its lines as a list of strings.
+
+    Args:
+        filepath (str): The path to the file.
+
+    Returns:
+        list: A list of strings, where each string is a line from the file.
+              Returns an empty list if the file does not exist.
+    
+    Raises:
+        OSError: If there's an issue reading the file (other than file not existing).
+    """
+    if not os.path.exists(filepath):
+        return []
+    
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f.readlines()]
+    except (OSError, IOError) as e:
+        logging.error(f"Error reading file {filepath}: {e}")
+        raise
+
+
+def listdir_fullpath(inputfolderpath, extension=None):
+    """
+    Lists all files in a directory, returning their full paths.
+
+    Args:
+        inputfolderpath (str): The path to the directory.
+        extension (str or tuple, optional): If provided, only files with this extension
+                                            (or one of these) are returned. Defaults to None.
+
+    Returns:
+        list: A list of full paths to the files in the directory.
+    """
+    if not os.path.exists(inputfolderpath):
+        return []
+    else:
+        if extension:
+            return [os.path.join(inputfolderpath, filename) for filename in os.listdir(inputfolderpath) if
+                    filename.endswith(extension)]
+        else:
+            return [os.path.join(inputfolderpath, filename) for filename in os.listdir(inputfolderpath)]
+
+def file_sha256(filepath, blocksize=1024 * 1024):
+    """
+    Computes the sha256 checksum of a file, reading it in blocks.
+
+    Args:
+        filepath (str): The path to the file.
+        blocksize (int, optional): The size of the blocks read. Defaults to 1 MiB.
+
+    Returns:
+        tuple: A tuple containing:
+            - str: The hex sha256 checksum.
+            - int: The size of the file in bytes.
+            - int: The number of lines (newline characters) in the file.
+    """
+    sha256 = hashlib.sha256()
+    n_bytes = 0
+    n_lines = 0
+
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha256.update(block)
+            n_bytes += len(block)
+            n_lines += block.count(b'\n')
+
+    return sha256.hexdigest(), n_bytes, n_lines
+
+def list_of_set_of_list(inputlist):
+    """
+    Removes duplicate elements from a list by converting it to a set and back to a list.
+
+    Args:
+        inputlist (list): The input list.
+
+    Returns:
+        list: A new list with duplicate elements removed.
+    """
+    return list(set(inputlist))
@@ -0,0 +1,144 @@
+import os, json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from shapely.geometry import shape
+from pyproj import CRS
+from tqdm import tqdm
+
+from metrics import timed_stage, count_metric
+
+from lib.files import create_dir
+from lib.crs import OSM_CRS, transform_coords
+
+# arrow types for the attributes of an Esri layer, the ones not listed are stored as strings
+ESRI_ARROW_TYPES = {
+    'esriFieldTypeOID': pa.int64(),
+    'esriFieldTypeSmallInteger': pa.int16(),
+    'esriFieldTypeInteger': pa.int32(),
+    'esriFieldTypeBigInteger': pa.int64(),
+    'esriFieldTypeSingle': pa.float32(),
+    'esriFieldTypeDouble': pa.float64(),
+    # esridump keeps dates as epoch milliseconds
+    'esriFieldTypeDate': pa.int64(),
+}
+
+def arrow_schema_from_metadata(layer_metadata, crs=OSM_CRS):
+    """
+    Builds the GeoParquet (WKB-encoded) arrow schema of a layer out of its metadata fields.
+
+    Args:
+        layer_metadata (dict): The layer's metadata, as returned by `get_layer_metadata`.
+        crs (str, optional): The CRS of the geometries. Defaults to OSM_CRS.
+
+    Returns:
+        pa.Schema: The schema, with the attribute columns, a 'geometry' column and the
+                   'geo' metadata of the GeoParquet specification.
+    """
+    fields = [pa.field(field['name'], ESRI_ARROW_TYPES.get(field['type'], pa.string()))
+              for field in layer_metadata.get('fields', [])
+              if field['type'] != 'esriFieldTypeGeometry']
+    fields.append(pa.field('geometry', pa.binary()))
+
+    geo_metadata = {
+        'version': '1.0.0',
+        'primary_column': 'geometry',
+        'columns': {
+            'geometry': {
+                'encoding': 'WKB',
+                'geometry_types': [],
+                'crs': CRS.from_user_input(crs).to_json_dict(),
+            }
+        },
+    }
+
+    return pa.schema(fields, metadata={b'geo': json.dumps(geo_metadata).encode('utf-8')})
+
+def features_to_arrow(features, schema, different_crs=None):
+    """
+    Converts a batch of GeoJSON features to an arrow table, reprojecting the geometries if needed.
+
+    Args:
+        features (list): A list of GeoJSON features (dicts).
+        schema (pa.Schema): The target schema, as built by `arrow_schema_from_metadata`.
+        different_crs (str, optional): The original CRS of the data if it's not
+                                       OSM_CRS. Defaults to None.
+
+    Returns:
+        pa.Table: The batch as a table following `schema`.
+    """
+    columns = []
+
+    for field in schema:
+        if field.name == 'geometry':
+            geoms = np.array([shape(f['geometry']) if f.get('geometry') else None for f in features], dtype=object)
+            if different_crs:
+                geoms = shapely.transform(geoms, lambda xy: transform_coords(xy, different_crs))
+            columns.append(pa.array(shapely.to_wkb(geoms), type=pa.binary()))
+        else:
+            values = [f['properties'].get(field.name) for f in features]
+            try:
+                columns.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # values that do not match the declared type are kept as their string representation
+                columns.append(pa.array([None if v is None else str(v) for v in values]).cast(field.type, safe=False))
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def write_geoparquet_stream(features, outpath, schema, batch_size=10000, different_crs=None, total=None, compression='zstd'):
+    """
+    Writes a stream of GeoJSON features to a GeoParquet file, one row group per batch.
+
+    Only one batch of features is held in memory at a time, so the peak memory is bounded
+    by `batch_size` and not by the size of the stream. The file is written to
+    '<outpath>.tmp' and renamed when complete.
+
+    Args:
+        features (iterable): An iterable of GeoJSON features (dicts), e.g. an EsriDumper.
+        outpath (str): The path of the output GeoParquet file.
+        schema (pa.Schema): The schema of the file, as built by `arrow_schema_from_metadata`.
+        batch_size (int, optional): The number of features of each batch/row group.
+                                    Defaults to 10000.
+        different_crs (str, optional): The original CRS of the data if it's not
+                                       OSM_CRS. Defaults to None.
+        total (int, optional): The expected number of features, for the progress bar.
+                               Defaults to None.
+        compression (str, optional): The parquet compression codec. Defaults to 'zstd'.
+
+    Returns:
+        int: The number of features written.
+    """
+    directory = os.path.dirname(outpath)
+    if directory:
+        create_dir(directory)
+
+    tmp_outpath = outpath + '.tmp'
+    n_feats = 0
+    batch = []
+
+    def write_batch(writer, batch):
+        with timed_stage('convert'):
+            table = features_to_arrow(batch, schema, different_crs=different_crs)
+        with timed_stage('write'):
+            writer.write_table(table)
+        count_metric('features', len(batch))
+
+    with pq.ParquetWriter(tmp_outpath, schema, compression=compression) as writer:
+        for feature in tqdm(features, total=total):
+            batch.append(feature)
+
+            if len(batch) >= batch_size:
+                write_batch(writer, batch)
+                n_feats += len(batch)
+                batch = []
+
+        if batch:
+            write_batch(writer, batch)
+            n_feats += len(batch)
+
+    os.replace(tmp_outpath, outpath)
+    count_metric('bytes_out', os.path.getsize(outpath))
+
+    return n_feats
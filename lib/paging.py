@@ -0,0 +1,736 @@
+import json
+import logging
+import random
+import time
+
+import requests
+from esridump import esri2geojson
+from esridump.errors import EsriDownloadError
+from pyproj import CRS
+
+from http_cache import CacheMissError
+from esri_pbf import features_match
+from metrics import timed_stage, count_metric
+
+from lib.crs import OSM_CRS, get_layer_crs, crs_wkid, reproject_features
+from lib.esri import TransientDownloadError, PermanentDownloadError, parse_esri_response, evict_cached_response
+
+class AdaptiveBackoff:
+    """
+    Exponential back-off whose base delay follows the observed latency of the server.
+
+    A slow (overloaded) server gets proportionally longer pauses than a fast one that just
+    dropped a connection; a 'Retry-After' header, when present, takes precedence.
+
+    Args:
+        min_wait (float, optional): The minimum base delay, in seconds. Defaults to 1.
+        max_wait (float, optional): The maximum delay, in seconds. Defaults to 120.
+        latency_factor (float, optional): The base delay, in multiples of the average latency.
+                                          Defaults to 4.
+        smoothing (float, optional): The weight of each new latency sample in the average.
+                                     Defaults to 0.2.
+    """
+    def __init__(self, min_wait=1, max_wait=120, latency_factor=4, smoothing=0.2):
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+        self.latency = None
+
+    def observe(self, latency):
+        """
+        Records the latency of a successful request.
+
+        Args:
+            latency (float): The request duration, in seconds.
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Computes the pause before a retry.
+
+        Args:
+            attempt (int): The number of failed attempts so far (1 for the first retry).
+            retry_after (str, optional): The 'Retry-After' header of the failed response. Defaults to None.
+
+        Returns:
+            float: The delay, in seconds.
+        """
+        if retry_after is not None:
+            try:
+                return min(self.max_wait, float(retry_after))
+            except ValueError:
+                pass
+
+        base = max(self.min_wait, self.latency_factor * (self.latency or 0))
+        delay = min(self.max_wait, base * 2 ** (attempt - 1))
+
+        # full jitter on the upper half, so parallel workers don't retry in lockstep
+        return delay / 2 + random.uniform(0, delay / 2)
+
+class PageSizeController:
+    """
+    Adapts the page size to keep page requests around a target latency, and paces them.
+
+    It starts from the largest page the server gives (its maxRecordCount). After each full
+    page, or each slow one, the size moves to what the measured time per feature predicts for
+    the target latency, at most doubling or halving at a time. Transient failures halve it.
+    Responses slower than `slow_factor` times the target add a pause before the next request,
+    which halves away with every fast response.
+
+    Args:
+        initial_size (int): The starting page size.
+        min_size (int, optional): The minimum page size. Defaults to 10.
+        max_size (int, optional): The maximum page size. Defaults to `initial_size`.
+        target_latency (float, optional): The targeted duration of a page request, in seconds.
+                                          Defaults to 10.
+        slow_factor (float, optional): The latency, in multiples of the target, from which a
+                                       response counts as slow. Defaults to 2.
+        max_pause (float, optional): The maximum pause between requests, in seconds. Defaults to 60.
+    """
+    def __init__(self, initial_size, min_size=10, max_size=None, target_latency=10.0, slow_factor=2.0, max_pause=60):
+        self.min_size = min(min_size, initial_size)
+        self.max_size = max_size or initial_size
+        self.size = max(self.min_size, min(self.max_size, initial_size))
+        self.target_latency = target_latency
+        self.slow_factor = slow_factor
+        self.max_pause = max_pause
+        self.pause = 0.0
+
+        self.started = time.monotonic()
+        self.latencies = []
+        self.sizes = []
+        self.n_features = 0
+        self.n_bytes = 0
+        self.n_errors = 0
+        self.n_grown = 0
+        self.n_shrunk = 0
+
+    def _resize(self, size):
+        size = int(max(self.min_size, min(self.max_size, size)))
+
+        if size > self.size:
+            self.n_grown += 1
+        elif size < self.size:
+            self.n_shrunk += 1
+
+        self.size = size
+
+    def observe(self, page_size, n_features, latency, n_bytes):
+        """
+        Records a successful page request and adapts the page size and pause.
+
+        Args:
+            page_size (int): The requested page size.
+            n_features (int): The number of features returned.
+            latency (float): The request duration, in seconds.
+            n_bytes (int): The size of the response body.
+        """
+        self.latencies.append(latency)
+        self.sizes.append(page_size)
+        self.n_features += n_features
+        self.n_bytes += n_bytes
+
+        if latency > self.slow_factor * self.target_latency:
+            self.pause = min(self.max_pause, latency)
+        else:
+            self.pause = self.pause / 2 if self.pause > 0.1 else 0.0
+
+        # a short, fast page (the end of the data) says nothing about larger ones
+        if (n_features >= page_size or latency > self.target_latency) and n_features and latency > 0:
+            ideal = self.target_latency * n_features / latency
+            self._resize(min(max(ideal, page_size / 2), page_size * 2))
+
+    def failure(self, error):
+        """
+        Records a failed page request, halving the page size if the failure was transient.
+
+        Args:
+            error (EsriDownloadError): The failure.
+        """
+        self.n_errors += 1
+
+        if isinstance(error, TransientDownloadError):
+            self._resize(self.size // 2)
+
+    def stats(self):
+        """
+        Returns the statistics of the run so far.
+
+        Returns:
+            dict: The page, feature, byte and error counts, the throughputs, the page size
+                  range and the latency percentiles.
+        """
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            return round(latencies[int(q * (len(latencies) - 1))], 3) if latencies else None
+
+        return {
+            'n_pages': len(latencies),
+            'n_features': self.n_features,
+            'n_bytes': self.n_bytes,
+            'n_errors': self.n_errors,
+            'elapsed_seconds': round(elapsed, 3),
+            'features_per_second': round(self.n_features / elapsed, 3) if elapsed else None,
+            'bytes_per_second': round(self.n_bytes / elapsed, 3) if elapsed else None,
+            'page_size_min': min(self.sizes, default=None),
+            'page_size_max': max(self.sizes, default=None),
+            'page_size_final': self.size,
+            'n_grown': self.n_grown,
+            'n_shrunk': self.n_shrunk,
+            'latency_p50': percentile(0.5),
+            'latency_p95': percentile(0.95),
+            'latency_max': percentile(1.0),
+        }
+
+# OSM stores coordinates with 7 decimals (~1 cm)
+OSM_GEOMETRY_PRECISION = 7
+
+# decimals dropped when the coordinates are requested in meters rather than degrees
+# (1e-7 degrees are ~1 cm, so 7 decimals of degrees are safely kept by 3 decimals of meters)
+PROJECTED_PRECISION_OFFSET = 4
+
+class FetchProfile:
+    """
+    What the page requests ask the server for: which attributes, at which geometry precision,
+    in which wire format.
+
+    The fields known to always have the same value (usually null) are not requested at all, and
+    are restored locally with that value, so the features come out as with a full request, for
+    as long as the profile matches the data (refresh 'metadata/unique_building_values.json' and
+    'metadata/building_columns_profile.json' with 'scripts/check_unique_building_values.py'
+    when in doubt).
+
+    With `pbf`, the pages are requested as protocol buffers ('f=pbf'), with coordinates quantized
+    at the profile precision; a page is then a fraction of the JSON size.
+
+    Args:
+        constants (dict, optional): {field: value} of the fields left out of the requests.
+                                    Defaults to None.
+        geometry_precision (int, optional): The number of decimals of the coordinates, in the
+                                            output SR. Defaults to OSM_GEOMETRY_PRECISION.
+        max_allowable_offset (float, optional): The generalization tolerance, in output SR units.
+                                                Defaults to None (no generalization).
+        pbf (bool, optional): Whether to request protocol buffers; None to do it if the layer
+                              supports them. Defaults to None.
+    """
+    def __init__(self, constants=None, geometry_precision=OSM_GEOMETRY_PRECISION, max_allowable_offset=None, pbf=None):
+        self.constants = constants or {}
+        self.geometry_precision = geometry_precision
+        self.max_allowable_offset = max_allowable_offset
+        self.pbf = pbf
+
+    @classmethod
+    def from_unique_values(cls, unique_values, column_profiles, **kwargs):
+        """
+        Builds a profile from the distinct values of each column (as in 'metadata/unique_building_values.json').
+
+        A single listed value is not enough: past its exact counting, the profiler only keeps the
+        most frequent values of a column. So a field is a constant only if its column profile
+        (as in 'metadata/building_columns_profile.json') is exact with a single distinct value.
+
+        Args:
+            unique_values (dict): {field: [distinct values]}.
+            column_profiles (dict): {field: ColumnProfile summary}.
+            **kwargs: The other FetchProfile arguments.
+
+        Returns:
+            FetchProfile: The profile, with the single valued fields as constants.
+        """
+        def is_constant(field, values):
+            column = column_profiles.get(field) or {}
+            return len(values) == 1 and column.get('exact') is True and column.get('distinct_estimate') == 1
+
+        constants = {field: values[0] for field, values in unique_values.items() if is_constant(field, values)}
+
+        return cls(constants=constants, **kwargs)
+
+    def to_dict(self):
+        return {
+            'constants': self.constants,
+            'geometry_precision': self.geometry_precision,
+            'max_allowable_offset': self.max_allowable_offset,
+            'pbf': self.pbf,
+        }
+
+    def query_args(self, field_order, keep=(), pbf=False, precision=None):
+        """
+        Computes the query arguments of the profile.
+
+        Args:
+            field_order (list): The attribute fields of the layer.
+            keep (tuple, optional): Fields to request even if they are constants (the objectid).
+                                    Defaults to ().
+            pbf (bool, optional): Whether to request protocol buffers. Defaults to False.
+            precision (int, optional): The number of decimals, in the requested SR units, if
+                                       it's not the one of the profile. Defaults to None.
+
+        Returns:
+            dict: The arguments.
+        """
+        if precision is None:
+            precision = self.geometry_precision
+
+        out_fields = [field for field in field_order if field not in self.constants or field in keep]
+
+        args = {
+            'outFields': ','.join(out_fields) if len(out_fields) < len(field_order) else '*',
+            'geometryPrecision': precision,
+        }
+
+        if self.max_allowable_offset:
+            args['maxAllowableOffset'] = self.max_allowable_offset
+
+        if pbf:
+            args['f'] = 'pbf'
+            args['quantizationParameters'] = json.dumps({
+                'mode': 'edit',
+                'originPosition': 'upperLeft',
+                'tolerance': 10 ** -precision,
+            })
+
+        return args
+
+    def restore(self, properties, field_order):
+        """
+        Adds the constant fields back to the properties of a feature, in the layer's field order.
+
+        Args:
+            properties (dict): The properties, as returned by the server.
+            field_order (list): The attribute fields of the layer.
+
+        Returns:
+            dict: The complete properties.
+        """
+        if not self.constants:
+            return properties
+
+        restored = {}
+        for field in field_order:
+            if field in properties:
+                restored[field] = properties[field]
+            elif field in self.constants:
+                restored[field] = self.constants[field]
+
+        for field, value in properties.items():
+            if field not in restored:
+                restored[field] = value
+
+        return restored
+
+def choose_reprojection(dumper, oid_field, layer_metadata, out_crs=OSM_CRS, probe_size=200, rounds=2):
+    """
+    Chooses whether to have the server reproject the features, or to do it on the client.
+
+    A page of `probe_size` geometries is requested both in `out_crs` and in the layer's own
+    CRS, `rounds` times each, alternately; the client side cost is the fastest native request
+    plus the time to reproject it locally. If the probe fails, the server does it.
+
+    Args:
+        dumper (EsriDumper): A dumper of the layer.
+        oid_field (str): The name of the objectid field.
+        layer_metadata (dict): The layer's metadata.
+        out_crs (str, optional): The CRS wanted for the features. Defaults to OSM_CRS.
+        probe_size (int, optional): The number of features of the probe pages. Defaults to 200.
+        rounds (int, optional): The number of requests of each kind. Defaults to 2.
+
+    Returns:
+        str: The layer's CRS, to request the pages in and reproject them on the client,
+             or None to request them in `out_crs`.
+    """
+    source_crs = get_layer_crs(layer_metadata)
+
+    if CRS.from_user_input(source_crs) == CRS.from_user_input(out_crs):
+        return None
+
+    query_url = dumper._build_url('/query')
+    headers = dumper._build_headers()
+
+    def probe(crs):
+        query_args = dumper._build_query_args({
+            'where': '1=1',
+            'resultOffset': 0,
+            'resultRecordCount': probe_size,
+            'outFields': oid_field,
+            'returnGeometry': 'true',
+            'outSR': crs_wkid(crs),
+            'f': 'json',
+        })
+        start = time.monotonic()
+        data = parse_esri_response(dumper._request('POST', query_url, headers=headers, data=query_args))
+        return time.monotonic() - start, data
+
+    try:
+        server_latencies, client_latencies = [], []
+        for _ in range(rounds):
+            server_latencies.append(probe(out_crs)[0])
+            latency, data = probe(source_crs)
+            client_latencies.append(latency)
+    except (EsriDownloadError, requests.exceptions.RequestException) as e:
+        logging.warning(f"Reprojection probe failed, leaving it to the server: {e}")
+        return None
+
+    start = time.monotonic()
+    reproject_features([esri2geojson(feature) for feature in data.get('features') or []], source_crs, out_crs)
+    client_cost = min(client_latencies) + time.monotonic() - start
+    server_cost = min(server_latencies)
+
+    logging.info(f"Reprojection probe: {server_cost:.3f}s on the server, {client_cost:.3f}s on the client")
+
+    return source_crs if client_cost < server_cost else None
+
+class CheckpointedPager:
+    """
+    Iterates over the features of a layer in objectid order, retrying failed pages in place.
+
+    Pages are requested by objectid ('<oid> > <checkpoint>') rather than by offset, so the
+    `checkpoint` (the objectid of the last feature handed over) is all that is needed to resume:
+    a failed page is retried from exactly that point, without going back to the start or
+    skipping anything. Layers with pagination get keyset pages ordered by objectid; the others
+    get fixed objectid windows between the layer's min and max objectids, whose features are
+    put in objectid order before they are yielded.
+
+    With an `offset`, the pages are requested by offset instead, in the server's order, as
+    esridump did: only to carry on with dumps started that way, whose objectids are in no
+    order (the `offset` is then the number of features handed over, the position to resume at).
+
+    Transient failures are retried up to `max_attempts` times, permanent ones up to
+    `max_permanent_attempts` times, with pauses from an AdaptiveBackoff.
+
+    With a PageSizeController, the page size and the pauses between requests follow it;
+    otherwise pages have a fixed size and esridump's periodic pauses are kept.
+
+    With a FetchProfile, its fields, precision and wire format are requested instead of the
+    dumper's. The first protobuf page is also requested as JSON, and protobuf is given up on
+    if the decoded features don't match.
+
+    With a `source_crs`, the pages are requested in it (the dumper's outSR is ignored) and each
+    one is reprojected to `out_crs` on the client, with a single transform call per page.
+
+    Args:
+        dumper (EsriDumper): A dumper of the layer; its URL, query arguments, fields, output
+                             SR, precision and pauses are used, its iteration is not.
+        oid_field (str): The name of the objectid field.
+        layer_metadata (dict): The layer's metadata.
+        checkpoint (int, optional): The objectid to resume after. Defaults to None (from the start).
+        page_size (int, optional): The number of features per page. Defaults to 100.
+        max_attempts (int, optional): The maximum number of attempts of a page on transient
+                                      failures. Defaults to 8.
+        max_permanent_attempts (int, optional): The maximum number of attempts of a page on
+                                                permanent failures. Defaults to 2.
+        backoff (AdaptiveBackoff, optional): The back-off policy. Defaults to a new AdaptiveBackoff.
+        page_sizer (PageSizeController, optional): The adaptive page size controller; `page_size`
+                                                   is ignored if given. Defaults to None.
+        profile (FetchProfile, optional): The fetch profile. Defaults to None.
+        source_crs (str, optional): The CRS to request the pages in, to reproject them on the
+                                    client. Defaults to None (reprojected by the server).
+        out_crs (str, optional): The CRS of the features, with `source_crs`. Defaults to OSM_CRS.
+        query_args (dict, optional): Extra arguments of every request, e.g. an envelope filter;
+                                     they can't set the 'where' clause. Defaults to None.
+        where (str, optional): A where clause restricting the features, ANDed with the
+                               objectid clauses of the pages, e.g. 'objectid IN (...)'.
+                               Defaults to None.
+        offset (int, optional): The offset to resume at, to page by offset rather than by
+                                objectid. Defaults to None.
+    """
+    def __init__(self, dumper, oid_field, layer_metadata, checkpoint=None, page_size=100, max_attempts=8, max_permanent_attempts=2, backoff=None, page_sizer=None, profile=None, source_crs=None, out_crs=OSM_CRS, query_args=None, where=None, offset=None):
+        self.dumper = dumper
+        self.oid_field = oid_field
+        self.checkpoint = checkpoint
+        self.offset = offset
+        self.page_size = min(page_size, layer_metadata.get('maxRecordCount') or page_size)
+        self.max_attempts = max_attempts
+        self.max_permanent_attempts = max_permanent_attempts
+        self.backoff = backoff or AdaptiveBackoff()
+        self.page_sizer = page_sizer
+        self.profile = profile
+        self.query_args = query_args or {}
+        self.where = where
+
+        self.field_order = [field['name'] for field in layer_metadata.get('fields') or [] if field.get('type') != 'esriFieldTypeGeometry']
+        supports_pbf = 'PBF' in (layer_metadata.get('supportedQueryFormats') or '').upper()
+        self.pbf = profile is not None and profile.pbf is not False and supports_pbf
+        self.pbf_checked = False
+
+        self.source_crs = source_crs
+        self.out_crs = out_crs
+        # the requested precision is in the units of the requested SR
+        self.precision = profile.geometry_precision if profile is not None else self.dumper._precision
+        self.request_precision = self.precision
+        if source_crs is not None and CRS.from_user_input(source_crs).is_projected:
+            self.request_precision = max(0, self.precision - PROJECTED_PRECISION_OFFSET)
+
+        capabilities = layer_metadata.get('advancedQueryCapabilities') or {}
+        self.order_by = capabilities.get('supportsOrderBy', True)
+        self.keyset = bool(layer_metadata.get('supportsPagination') or capabilities.get('supportsPagination')) and self.order_by
+        self.oid_max = None
+
+        self.n_requests = 0
+        self.n_retries = 0
+
+    def _page_args(self, page_size, lower, upper=None, pbf=None):
+        where = '1=1' if lower is None or self.offset is not None else f'{self.oid_field} > {lower}'
+        args = {
+            'where': where,
+            'geometryPrecision': self.request_precision,
+            'returnGeometry': self.dumper._request_geometry,
+            'outSR': crs_wkid(self.source_crs) if self.source_crs is not None else self.dumper._outSR,
+            'outFields': ','.join(self.dumper._fields or ['*']),
+            'f': 'json',
+        }
+
+        if self.profile is not None:
+            args.update(self.profile.query_args(self.field_order, keep=(self.oid_field,), pbf=self.pbf if pbf is None else pbf,
+                                                precision=self.request_precision))
+
+        if self.offset is not None:
+            args.update({'resultOffset': lower, 'resultRecordCount': page_size})
+        elif self.keyset:
+            args.update({'orderByFields': f'{self.oid_field} ASC', 'resultOffset': 0, 'resultRecordCount': page_size})
+        else:
+            args['where'] = f'{self.oid_field} > {lower} AND {self.oid_field} <= {upper}'
+            if self.order_by:
+                args['orderByFields'] = f'{self.oid_field} ASC'
+
+        args['where'] = self._restrict(args['where'])
+
+        return self.dumper._build_query_args({**self.query_args, **args})
+
+    def _restrict(self, where):
+        if not self.where:
+            return where
+        return self.where if where == '1=1' else f'({self.where}) AND ({where})'
+
+    def fetch_page(self, build_args, observe=True):
+        """
+        Requests one page, retrying it on failures.
+
+        Args:
+            build_args (callable): Builds the query arguments of the page out of a page size
+                                   (which may shrink between attempts).
+            observe (bool, optional): Whether the request is reported to the page size controller.
+                                      Defaults to True.
+
+        Returns:
+            tuple: A tuple containing:
+                - dict: The parsed response.
+                - int: The page size it was requested with.
+
+        Raises:
+            EsriDownloadError: Once the attempts are exhausted.
+            CacheMissError: Right away, if the response cache is offline and the page is not cached.
+        """
+        query_url = self.dumper._build_url('/query')
+        headers = self.dumper._build_headers()
+        attempts = {TransientDownloadError: 0, PermanentDownloadError: 0}
+
+        while True:
+            self.n_requests += 1
+
+            if self.page_sizer is not None:
+                page_size = self.page_sizer.size
+                if self.page_sizer.pause:
+                    time.sleep(self.page_sizer.pause)
+            else:
+                page_size = self.page_size
+                # keeping esridump's pause every few requests, to be gentle with the server
+                if self.dumper._requests_to_pause and self.n_requests % self.dumper._requests_to_pause == 0:
+                    time.sleep(self.dumper._pause_seconds)
+
+            response = None
+            start = time.monotonic()
+
+            try:
+                try:
+                    query_args = build_args(page_size)
+                    response = self.dumper._request('POST', query_url, headers=headers, data=query_args)
+                except CacheMissError:
+                    # serving only from the cache, another attempt would miss again
+                    logging.error(f"Giving up on the page after objectid {self.checkpoint}: not in the offline cache")
+                    raise
+                except requests.exceptions.RequestException as e:
+                    raise TransientDownloadError(f"{type(e).__name__}: {e}")
+
+                with timed_stage('decode'):
+                    data = parse_esri_response(response, pbf=query_args.get('f') == 'pbf', precision=self.request_precision)
+                latency = time.monotonic() - start
+                self.backoff.observe(latency)
+
+                if observe and self.page_sizer is not None:
+                    self.page_sizer.observe(page_size, len(data.get('features') or []), latency, len(response.content))
+
+                return data, page_size
+            except (TransientDownloadError, PermanentDownloadError) as e:
+                error_class = type(e)
+                attempts[error_class] += 1
+                limit = self.max_attempts if error_class is TransientDownloadError else self.max_permanent_attempts
+
+                if self.page_sizer is not None:
+                    self.page_sizer.failure(e)
+
+                if response is not None and response.status_code == 200 and error_class is TransientDownloadError:
+                    # a body that doesn't parse may come from the cache, it must not be served again
+                    evict_cached_response('POST', query_url, data=query_args)
+
+                if attempts[error_class] >= limit:
+                    logging.error(f"Giving up on the page after objectid {self.checkpoint} ({attempts[error_class]} attempts): {e}")
+                    raise
+
+                retry_after = response.headers.get('Retry-After') if response is not None else None
+                delay = self.backoff.delay(sum(attempts.values()), retry_after=retry_after)
+                self.n_retries += 1
+                count_metric('retries')
+                logging.warning(f"{error_class.__name__} on the page after objectid {self.checkpoint}, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def oid_min_max(self):
+        """
+        Requests the minimum and maximum objectids of the layer, with the same retries as the pages.
+
+        Returns:
+            tuple: The (min, max) objectids, (None, None) if no feature matches the query arguments.
+        """
+        query_args = self.dumper._build_query_args({
+            **self.query_args,
+            'where': self._restrict('1=1'),
+            'outFields': '',
+            'outStatistics': json.dumps([
+                {'statisticType': 'min', 'onStatisticField': self.oid_field, 'outStatisticFieldName': 'THE_MIN'},
+                {'statisticType': 'max', 'onStatisticField': self.oid_field, 'outStatisticFieldName': 'THE_MAX'},
+            ]),
+            'f': 'json',
+        })
+        data, _ = self.fetch_page(lambda page_size: query_args, observe=False)
+
+        # some servers don't keep the requested names, so just the values are used (like esridump does)
+        values = [int(value) for value in data['features'][0]['attributes'].values() if value is not None]
+
+        return (min(values), max(values)) if values else (None, None)
+
+    def __iter__(self):
+        if self.offset is not None:
+            yield from self._iter_offsets()
+            return
+
+        lower = self.checkpoint
+
+        if not self.keyset:
+            oid_min, self.oid_max = self.oid_min_max()
+            if oid_min is None:
+                return
+            if lower is None:
+                lower = oid_min - 1
+
+        while True:
+            if self.keyset:
+                upper = None
+                data, page_size = self.fetch_page(lambda page_size: self._page_args(page_size, lower))
+            else:
+                if lower >= self.oid_max:
+                    return
+                data, page_size = self.fetch_page(lambda page_size: self._page_args(page_size, lower, min(lower + page_size, self.oid_max)))
+                upper = min(lower + page_size, self.oid_max)
+
+            if self.pbf and not self.pbf_checked:
+                data = self._check_pbf(data, page_size, lower, upper)
+
+            features = data.get('features') or []
+            geojson_features = self._convert(features)
+
+            if not self.keyset:
+                # the checkpoint follows the features, so a window must be in objectid order
+                # even from servers that ignore orderByFields
+                geojson_features.sort(key=lambda feature: (feature.get('properties') or {}).get(self.oid_field) or 0)
+
+            for feature in geojson_features:
+                oid = (feature.get('properties') or {}).get(self.oid_field)
+
+                yield feature
+
+                # reached only once the consumer asked for the next feature, i.e. took this one
+                if oid is not None:
+                    self.checkpoint = oid
+
+            if self.keyset:
+                if not features or (len(features) < page_size and not data.get('exceededTransferLimit')):
+                    return
+                lower = self.checkpoint
+            else:
+                # the whole window is done, even the objectids it didn't have
+                lower = self.checkpoint = upper
+
+    def _iter_offsets(self):
+        while True:
+            lower = self.offset
+            data, page_size = self.fetch_page(lambda page_size: self._page_args(page_size, lower))
+
+            if self.pbf and not self.pbf_checked:
+                data = self._check_pbf(data, page_size, lower, None)
+
+            features = data.get('features') or []
+
+            for feature in self._convert(features):
+                oid = (feature.get('properties') or {}).get(self.oid_field)
+
+                yield feature
+
+                self.offset += 1
+                if oid is not None:
+                    self.checkpoint = oid
+
+            if not features or (len(features) < page_size and not data.get('exceededTransferLimit')):
+                return
+
+    def _convert(self, features):
+        with timed_stage('convert'):
+            geojson_features = [esri2geojson(esri_feature) for esri_feature in features]
+
+        if self.source_crs is not None:
+            geographic = CRS.from_user_input(self.out_crs).is_geographic
+            with timed_stage('reproject'):
+                reproject_features(geojson_features, self.source_crs, self.out_crs, precision=self.precision if geographic else None)
+
+        if self.profile is not None:
+            for feature in geojson_features:
+                feature['properties'] = self.profile.restore(feature.get('properties') or {}, self.field_order)
+
+        return geojson_features
+
+    def _check_pbf(self, data, page_size, lower, upper):
+        self.pbf_checked = True
+
+        reference, _ = self.fetch_page(lambda _: self._page_args(page_size, lower, upper, pbf=False), observe=False)
+        tolerance = 2 * 10 ** -self.request_precision
+
+        if features_match(data.get('features') or [], reference.get('features') or [], tolerance):
+            return data
+
+        logging.warning("The protobuf page does not match the JSON one, falling back to JSON")
+        self.pbf = False
+
+        return reference
+
+    def stats(self):
+        """
+        Returns the statistics of the iteration so far.
+
+        Returns:
+            dict: The request and retry counts and the checkpoint, plus the page size
+                  controller statistics, if any.
+        """
+        stats = {'n_requests': self.n_requests, 'n_retries': self.n_retries, 'checkpoint': self.checkpoint, 'pbf': self.pbf,
+                 'reprojection': 'client' if self.source_crs is not None else 'server'}
+
+        if self.offset is not None:
+            stats['offset'] = self.offset
+
+        if self.page_sizer is not None:
+            stats.update(self.page_sizer.stats())
+
+        return stats
@@ -0,0 +1,372 @@
+import os, json
+import bisect
+import contextlib
+import functools
+import logging
+import threading
+import time
+
+# upper bounds of the timing histogram buckets, in seconds (Prometheus style, plus +Inf)
+TIMING_BUCKETS = (0.00001, 0.00003, 0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0, 100.0)
+
+# environment variable enabling the profiling of the instrumented runs: 'cprofile' or 'pyinstrument'
+PROFILE_ENV_VAR = 'CURITIBA_PROFILE'
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations, cheap enough to be fed once per feature.
+
+    Args:
+        buckets (tuple, optional): The sorted upper bounds of the buckets. Defaults to TIMING_BUCKETS.
+    """
+    def __init__(self, buckets=TIMING_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Estimates a quantile, as the upper bound of the bucket holding it.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, or None without observations.
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max,
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+def peak_memory_bytes():
+    """
+    Returns the peak resident memory of the process, or None where it is not available.
+
+    Returns:
+        int: The peak resident set size, in bytes.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+class RunMetrics:
+    """
+    Metrics of one run of a dumper: per-stage timing histograms ('http', 'decode', 'reproject',
+    'serialize', 'write'...), counters (features, requests, retries, bytes in and out...) and,
+    at the end, the elapsed time, throughputs and peak memory of the process.
+
+    While a run is active (between `start` and `stop`, or in a `with` block) it is the current
+    metrics of its thread, which the instrumented code records into through `timed_stage` and `count_metric`;
+    worker threads of the run join it with `activate`. Stopping a run appends its summary to
+    '<path_prefix>_metrics.jsonl' and writes '<path_prefix>_metrics.prom' (Prometheus text
+    format). If the PROFILE_ENV_VAR environment variable is set to 'cprofile' or 'pyinstrument',
+    the run is also profiled into '<path_prefix>_profile.prof' (or '.html').
+
+    Args:
+        name (str): The name of the run, usually the layer name.
+        path_prefix (str, optional): The prefix of the output files. Defaults to None (nothing written).
+        labels (dict, optional): Extra labels of the run (dumper, mode...). Defaults to None.
+    """
+    def __init__(self, name, path_prefix=None, labels=None):
+        self.name = name
+        self.path_prefix = path_prefix
+        self.labels = labels or {}
+
+        self.histograms = {}
+        self.counters = {}
+
+        self.started = None
+        self.elapsed = None
+        self.status = None
+
+        self._lock = threading.Lock()
+        self._start = None
+        self._profiler = None
+        self._previous = None
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, stage):
+        """
+        Returns a context manager timing its block into the histogram of `stage`.
+        """
+        return _StageTimer(self, stage)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def activate(self):
+        """
+        Makes this run the current metrics of the calling thread.
+
+        Returns:
+            RunMetrics: The metrics that were current before, to be restored with `deactivate`.
+        """
+        previous = current_metrics()
+        _CURRENT.metrics = self
+        return previous
+
+    def deactivate(self, previous=None):
+        _CURRENT.metrics = previous
+
+    def start(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._previous = self.activate()
+        self._start_profiler()
+        return self
+
+    def stop(self, status='done'):
+        """
+        Ends the run and writes its files.
+
+        Args:
+            status (str, optional): The outcome of the run. Defaults to 'done'.
+
+        Returns:
+            dict: The summary of the run (see `summary`).
+        """
+        self.elapsed = time.perf_counter() - self._start
+        self.status = status
+        self.deactivate(self._previous)
+        self._stop_profiler()
+
+        summary = self.summary()
+
+        if self.path_prefix:
+            try:
+                with open(f'{self.path_prefix}_metrics.jsonl', 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(summary) + '\n')
+                with open(f'{self.path_prefix}_metrics.prom', 'w', encoding='utf-8') as f:
+                    f.write(self.to_prometheus())
+            except OSError as e:
+                logging.warning(f"Could not write the metrics of {self.name}: {e}")
+
+        return summary
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop('done' if exc_type is None else 'failed')
+
+    def _start_profiler(self):
+        kind = os.environ.get(PROFILE_ENV_VAR, '').lower()
+
+        if kind == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # only one profiler at a time, e.g. with concurrent runs
+                logging.warning(f"Not profiling {self.name}: {e}")
+                return
+            self._profiler = profiler
+        elif kind == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logging.warning(f"{PROFILE_ENV_VAR}=pyinstrument, but pyinstrument is not installed")
+                return
+            self._profiler = Profiler()
+            self._profiler.start()
+        elif kind:
+            logging.warning(f"Unknown {PROFILE_ENV_VAR} value '{kind}', must be 'cprofile' or 'pyinstrument'")
+
+    def _stop_profiler(self):
+        if self._profiler is None:
+            return
+
+        profiler, self._profiler = self._profiler, None
+
+        if hasattr(profiler, 'disable'):
+            profiler.disable()
+            if self.path_prefix:
+                profiler.dump_stats(f'{self.path_prefix}_profile.prof')
+        else:
+            profiler.stop()
+            if self.path_prefix:
+                with open(f'{self.path_prefix}_profile.html', 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+
+    def summary(self):
+        """
+        Returns the metrics of the run.
+
+        Returns:
+            dict: The name, labels, status, start time, elapsed time, counters, features and bytes
+                  per second, peak memory and the per-stage histograms.
+        """
+        elapsed = self.elapsed if self.elapsed is not None else (time.perf_counter() - self._start if self._start else None)
+
+        def rate(counter):
+            return self.counters.get(counter, 0) / elapsed if elapsed else None
+
+        with self._lock:
+            return {
+                'name': self.name,
+                'labels': self.labels,
+                'status': self.status,
+                'started': self.started,
+                'elapsed': elapsed,
+                'counters': dict(self.counters),
+                'features_per_second': rate('features'),
+                'bytes_in_per_second': rate('bytes_in'),
+                'bytes_out_per_second': rate('bytes_out'),
+                'peak_memory_bytes': peak_memory_bytes(),
+                'stages': {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+            }
+
+    def to_prometheus(self, prefix='curitiba_dump'):
+        """
+        Renders the metrics of the run in the Prometheus text exposition format.
+
+        Args:
+            prefix (str, optional): The prefix of the metric names. Defaults to 'curitiba_dump'.
+
+        Returns:
+            str: The metrics.
+        """
+        labels = {'run': self.name, **self.labels}
+
+        def fmt(extra=None):
+            items = {**labels, **(extra or {})}
+            return '{' + ','.join(f'{key}="{value}"' for key, value in items.items()) + '}'
+
+        summary = self.summary()
+        lines = []
+
+        for counter, value in sorted(summary['counters'].items()):
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            lines.append(f'{prefix}_{counter}_total{fmt()} {value}')
+
+        for gauge in ['elapsed', 'features_per_second', 'peak_memory_bytes']:
+            if summary[gauge] is not None:
+                lines.append(f'# TYPE {prefix}_{gauge} gauge')
+                lines.append(f'{prefix}_{gauge}{fmt()} {summary[gauge]}')
+
+        lines.append(f'# TYPE {prefix}_stage_seconds histogram')
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{fmt({"stage": stage, "le": bound})} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{fmt({"stage": stage})} {histogram.sum}')
+            lines.append(f'{prefix}_stage_seconds_count{fmt({"stage": stage})} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+_CURRENT = threading.local()
+
+_NO_TIMER = contextlib.nullcontext()
+
+def current_metrics():
+    """
+    Returns the RunMetrics active in the calling thread, if any.
+    """
+    return getattr(_CURRENT, 'metrics', None)
+
+def timed_stage(name):
+    """
+    Times a block into the `name` histogram of the current run; does nothing outside a run.
+
+    Args:
+        name (str): The stage.
+
+    Returns:
+        A context manager.
+    """
+    metrics = getattr(_CURRENT, 'metrics', None)
+    return _NO_TIMER if metrics is None else metrics.timer(name)
+
+def count_metric(counter, n=1):
+    """
+    Increments a counter of the current run; does nothing outside a run.
+
+    Args:
+        counter (str): The counter.
+        n (int, optional): The increment. Defaults to 1.
+    """
+    metrics = getattr(_CURRENT, 'metrics', None)
+    if metrics is not None:
+        metrics.count(counter, n)
+
+def with_current_metrics(func):
+    """
+    Wraps a function so that it records into the run current at wrapping time, in whatever
+    thread it is called (e.g. the workers of a ThreadPoolExecutor).
+
+    Args:
+        func (callable): The function.
+
+    Returns:
+        callable: The wrapped function, or `func` itself outside a run.
+    """
+    metrics = current_metrics()
+
+    if metrics is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = metrics.activate()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.deactivate(previous)
+
+    return wrapper
@@ -0,0 +1,417 @@
+from lib import *
+
+import collections
+import functools
+import pickle
+import tempfile
+from xml.sax.saxutils import quoteattr
+
+import pandas as pd
+
+from checker import fastjson
+from geometry_prep import iter_input_blocks
+from osm_pbf import PbfWriter
+from tag_mapping import DEFAULT_TAG_MAPPING_PATH, read_tag_mapping, apply_tag_mapping, tag_rows
+
+# the OSM coordinates: integers of 1e-7 degrees
+OSM_COORDINATE_SCALE = 10 ** OSM_GEOMETRY_PRECISION
+
+OSM_FORMATS = {'.osm': 'osm', '.osc': 'osc', '.pbf': 'pbf'}
+
+# the same keys and values come again and again
+quote = functools.lru_cache(maxsize=65536)(quoteattr)
+
+def osm_format(path):
+    """
+    Finds the format of an OSM file from its extension.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        str: 'osm' (OSM XML), 'osc' (osmChange XML) or 'pbf'.
+
+    Raises:
+        ValueError: If the extension is not '.osm', '.osc' or '.pbf' ('.osm.pbf').
+    """
+    extension = os.path.splitext(path)[1]
+
+    if extension not in OSM_FORMATS:
+        raise ValueError(f"Unknown OSM file extension '{extension}' of {path}, expected one of {list(OSM_FORMATS)}")
+
+    return OSM_FORMATS[extension]
+
+class OsmXmlWriter:
+    """
+    Writes an OSM XML (.osm) or osmChange (.osc, every element created) file of new data,
+    element by element.
+
+    Args:
+        path (str): The path of the file.
+        change (bool, optional): Whether to write an osmChange file. Defaults to False.
+        generator (str, optional): The generator attribute. Defaults to 'geocuritiba'.
+    """
+    def __init__(self, path, change=False, generator='geocuritiba'):
+        self.path = path
+        self.change = change
+        self.file = open(path, 'w', encoding='utf-8')
+        self.indent = '    ' if change else '  '
+
+        self.file.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.file.write(f'<osmChange version="0.6" generator={quoteattr(generator)}>\n  <create>\n' if change else
+                        f'<osm version="0.6" generator={quoteattr(generator)}>\n')
+
+    def _tags(self, tags):
+        return ''.join(f'{self.indent}  <tag k={quote(key)} v={quote(str(value))}/>\n' for key, value in tags.items())
+
+    def write_nodes(self, ids, lons, lats):
+        """
+        Writes untagged nodes (see PbfWriter.write_nodes).
+        """
+        self.file.write(''.join(f'{self.indent}<node id="{node_id}" lat="{lat / OSM_COORDINATE_SCALE:.7f}" lon="{lon / OSM_COORDINATE_SCALE:.7f}"/>\n'
+                                for node_id, lon, lat in zip(ids.tolist(), lons.tolist(), lats.tolist())))
+
+    def write_ways(self, ids, refs, counts, tags):
+        """
+        Writes ways (see PbfWriter.write_ways).
+        """
+        starts = np.cumsum(counts) - counts
+        refs = refs.tolist()
+
+        for way_id, start, count, way_tags in zip(ids.tolist(), starts.tolist(), counts.tolist(), tags):
+            nds = ''.join(f'{self.indent}  <nd ref="{ref}"/>\n' for ref in refs[start:start + count])
+            self.file.write(f'{self.indent}<way id="{way_id}">\n{nds}{self._tags(way_tags)}{self.indent}</way>\n')
+
+    def write_relations(self, ids, member_ids, member_types, roles, counts, tags):
+        """
+        Writes relations (see PbfWriter.write_relations).
+        """
+        starts = np.cumsum(counts) - counts
+        member_ids = member_ids.tolist()
+
+        for relation_id, start, count, relation_tags in zip(ids.tolist(), starts.tolist(), counts.tolist(), tags):
+            members = ''.join(f'{self.indent}  <member type="{member_type}" ref="{member_id}" role={quoteattr(role)}/>\n'
+                              for member_id, member_type, role in zip(member_ids[start:start + count], member_types[start:start + count], roles[start:start + count]))
+            self.file.write(f'{self.indent}<relation id="{relation_id}">\n{members}{self._tags(relation_tags)}{self.indent}</relation>\n')
+
+    def close(self):
+        self.file.write('  </create>\n</osmChange>\n' if self.change else '</osm>\n')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def get_osm_writer(path, file_format=None, generator='geocuritiba'):
+    """
+    Opens the writer of an OSM file.
+
+    Args:
+        path (str): The path of the file.
+        file_format (str, optional): 'osm', 'osc' or 'pbf'. Defaults to None (from the extension,
+                                     see `osm_format`).
+        generator (str, optional): The program recorded in the file. Defaults to 'geocuritiba'.
+
+    Returns:
+        OsmXmlWriter or PbfWriter: The writer.
+    """
+    file_format = file_format or osm_format(path)
+
+    if file_format == 'pbf':
+        return PbfWriter(path, writing_program=generator)
+
+    return OsmXmlWriter(path, change=file_format == 'osc', generator=generator)
+
+def ring_nodes(geometries):
+    """
+    Splits polygons into rings of OSM nodes: the coordinates on the OSM grid, without the
+    closing one nor consecutive repeats.
+
+    Args:
+        geometries (np.ndarray): The polygons and multipolygons.
+
+    Returns:
+        tuple: A tuple containing:
+            - np.ndarray: The (n, 2) grid coordinates (int64 lon, lat) of the nodes of all the rings.
+            - np.ndarray: The ring of each node.
+            - np.ndarray: The feature of each ring.
+            - np.ndarray: Whether each ring is an outer one.
+    """
+    parts, part_feature = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    outer = np.r_[True, ring_part[1:] != ring_part[:-1]] if len(rings) else np.zeros(0, dtype=bool)
+
+    coords, node_ring = shapely.get_coordinates(rings, return_index=True)
+    grid = np.round(coords * OSM_COORDINATE_SCALE).astype(np.int64)
+
+    # a node equal to the previous one of its ring, which covers the closing one after the first
+    repeated = np.zeros(len(grid), dtype=bool)
+    repeated[1:] = (node_ring[1:] == node_ring[:-1]) & (grid[1:] == grid[:-1]).all(axis=1)
+    ring_starts = np.flatnonzero(np.r_[True, node_ring[1:] != node_ring[:-1]]) if len(grid) else np.zeros(0, dtype=np.int64)
+    ring_ends = np.r_[ring_starts[1:], len(grid)] - 1
+    repeated[ring_ends] |= (grid[ring_ends] == grid[ring_starts]).all(axis=1)
+
+    return grid[~repeated], node_ring[~repeated], part_feature[ring_part], outer
+
+def build_elements(geometries, first_id=-1):
+    """
+    Converts footprints into new OSM elements, with incremental negative ids.
+
+    A polygon without holes becomes a closed way, which gets the tags of its feature. Any other
+    footprint becomes a multipolygon relation, with the tags, of untagged outer and inner ways.
+    Nodes at the same coordinates are shared. Footprints with a ring of less than 3 distinct
+    nodes are skipped.
+
+    Args:
+        geometries (np.ndarray): The polygons and multipolygons.
+        first_id (int, optional): The id of the first element; the next ones go down. Defaults to -1.
+
+    Returns:
+        dict: The 'nodes' (ids, lons, lats), 'ways' (ids, refs, counts, feature, the index of
+              the feature of the tagged ways and -1 for the members of relations), 'relations'
+              (ids, member_ids, roles, counts, feature), the 'skipped' mask of the features and
+              the 'next_id'.
+    """
+    grid, node_ring, ring_feature, outer = ring_nodes(geometries)
+
+    n_nodes = np.bincount(node_ring, minlength=len(ring_feature))
+    skipped = np.zeros(len(geometries), dtype=bool)
+    skipped[ring_feature[n_nodes < 3]] = True
+
+    if skipped.any():
+        kept = ~skipped[ring_feature][node_ring]
+        ring_kept = ~skipped[ring_feature]
+        # renumber the kept rings
+        ring_number = np.cumsum(ring_kept) - 1
+        grid, node_ring = grid[kept], ring_number[node_ring[kept]]
+        ring_feature, outer = ring_feature[ring_kept], outer[ring_kept]
+        n_nodes = n_nodes[ring_kept]
+
+    next_id = first_id
+
+    # nodes, numbered in order of first appearance
+    if len(grid):
+        unique, first_index, inverse = np.unique(grid, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first_index)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        unique = unique[order]
+        node_ids = next_id - np.arange(len(unique))
+        next_id -= len(unique)
+        refs = node_ids[rank[inverse.reshape(-1)]]
+    else:
+        unique = np.zeros((0, 2), dtype=np.int64)
+        node_ids = refs = np.zeros(0, dtype=np.int64)
+
+    # ways: one per ring, closed by repeating their first node
+    ring_starts = np.cumsum(n_nodes) - n_nodes
+    way_refs = np.insert(refs, ring_starts + n_nodes, refs[ring_starts]) if len(refs) else refs
+    way_ids = next_id - np.arange(len(ring_feature))
+    next_id -= len(ring_feature)
+
+    rings_per_feature = np.bincount(ring_feature, minlength=len(geometries))
+    simple = rings_per_feature[ring_feature] == 1
+    way_feature = np.where(simple, ring_feature, -1)
+
+    # relations: the other footprints, their rings as members
+    relation_features = np.flatnonzero(rings_per_feature > 1)
+    members = np.flatnonzero(~simple)
+    relation_ids = next_id - np.arange(len(relation_features))
+    next_id -= len(relation_features)
+
+    return {
+        'nodes': (node_ids, unique[:, 0], unique[:, 1]),
+        'ways': (way_ids, way_refs, n_nodes + 1, way_feature),
+        'relations': (relation_ids, way_ids[members], np.where(outer[members], 'outer', 'inner').tolist(),
+                      rings_per_feature[relation_features], relation_features),
+        'skipped': skipped,
+        'next_id': next_id,
+    }
+
+def dedup_nodes(ids, lons, lats):
+    """
+    Finds the nodes at the same grid coordinates, to share them between the footprints of
+    different blocks: each one is replaced by its first occurrence.
+
+    Args:
+        ids (np.ndarray): The node ids.
+        lons (np.ndarray): Their longitudes, in 1e-7 degrees.
+        lats (np.ndarray): Their latitudes, in 1e-7 degrees.
+
+    Returns:
+        tuple: A tuple containing:
+            - np.ndarray: Whether each node is the first at its coordinates (the ones to write).
+            - np.ndarray: The id of the first node at the coordinates of each node.
+    """
+    # both coordinates fit in 32 bits
+    keys = (lons.astype(np.int64) << 32) | (lats.astype(np.int64) & 0xFFFFFFFF)
+    _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    canonical = ids[first_index][inverse.reshape(-1)]
+
+    return canonical == ids, canonical
+
+def block_frame(block):
+    """
+    Reads the attributes, as a DataFrame, and the geometries of a block of features.
+
+    Args:
+        block (bytes or pa.RecordBatch): GeoJSONL lines, or a batch of a GeoParquet file
+                                         (see `geometry_prep.iter_input_blocks`).
+
+    Returns:
+        tuple: The attributes (pd.DataFrame) and the geometries (np.ndarray).
+    """
+    if isinstance(block, bytes):
+        lines = [line for line in block.split(b'\n') if line.strip()]
+        frame = pd.DataFrame.from_records([fastjson.loads(line).get('properties') or {} for line in lines])
+        geometries = shapely.from_geojson([line.decode('utf-8') for line in lines], on_invalid='ignore')
+    else:
+        frame = block.drop_columns(['geometry']).to_pandas()
+        geometries = shapely.from_wkb(block.column('geometry').to_numpy(zero_copy_only=False))
+
+    return frame, geometries
+
+def _spooled(spool):
+    spool.seek(0)
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+def read_conflation_oids(path, categories=('new',), oid_field='objectid'):
+    """
+    Reads the objectids of some categories of a conflation (see `conflation.conflate`).
+
+    Args:
+        path (str): The '<layername>_conflation.jsonl' file.
+        categories (iterable, optional): The categories kept. Defaults to ('new',).
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        set: The objectids.
+    """
+    categories = set(categories)
+
+    with open(path, 'rb') as f:
+        rows = (fastjson.loads(line) for line in f if line.strip())
+        return {row[oid_field] for row in rows if row.get('category') in categories}
+
+def export_osm(input_path, outpath, mapping_path=DEFAULT_TAG_MAPPING_PATH, oids=None, block_size=5000,
+               oid_field='objectid', generator='geocuritiba'):
+    """
+    Converts dumped buildings into an OSM file of new data, in a single streaming pass.
+
+    The features are read in blocks of `block_size`; the tags of each block are computed column
+    by column from a declarative mapping (see `tag_mapping.read_tag_mapping`), and its
+    footprints become new nodes, ways and relations (see `build_elements`) with incremental
+    negative ids. The elements are spooled to temporary files and written at the end, nodes
+    first, so the file is sorted as the OSM tools expect. Before that, the nodes at the same
+    coordinates in different blocks are merged (see `dedup_nodes`), so that adjacent buildings
+    share their walls whatever block they came in; this needs about 40 bytes per node, the
+    rest of the memory does not depend on the size of the input. The file is written to
+    '<outpath>.tmp' first, and renamed when complete.
+
+    Args:
+        input_path (str): A folder of GeoJSONL chunks, a single GeoJSONL file or a GeoParquet
+                          file, in longitude/latitude (ideally prepared with `geometry_prep`).
+        outpath (str): The output file: '.osm' (OSM XML), '.osc' (osmChange) or '.osm.pbf'.
+        mapping_path (str, optional): The tag mapping. Defaults to DEFAULT_TAG_MAPPING_PATH.
+        oids (set, optional): Export only these objectids, e.g. the 'new' buildings of the
+                              conflation. Defaults to None (all).
+        block_size (int, optional): The number of features per block. Defaults to 5000.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+        generator (str, optional): The program recorded in the file. Defaults to 'geocuritiba'.
+
+    Returns:
+        dict: The summary: the features read, exported and skipped, the elements written and
+              the number of features with each tag.
+
+    Raises:
+        ValueError: If the output extension or the tag mapping are not valid.
+    """
+    file_format = osm_format(outpath)
+    mapping = read_tag_mapping(mapping_path)
+    start = time.perf_counter()
+
+    create_dir(os.path.dirname(outpath) or '.')
+    tmp_path = outpath + '.tmp'
+
+    summary = {'n_features': 0, 'n_exported': 0, 'n_filtered': 0, 'n_no_geometry': 0, 'n_degenerate': 0,
+               'n_nodes': 0, 'n_shared_nodes': 0, 'n_ways': 0, 'n_relations': 0}
+    tag_counts = collections.Counter()
+    next_id = -1
+
+    writer = get_osm_writer(tmp_path, file_format=file_format, generator=generator)
+
+    with writer, tempfile.TemporaryFile() as node_spool, tempfile.TemporaryFile() as way_spool, tempfile.TemporaryFile() as relation_spool:
+        for _, block in tqdm(iter_input_blocks(input_path, block_size), desc='exporting blocks'):
+            frame, geometries = block_frame(block)
+            summary['n_features'] += len(frame)
+
+            selected = np.ones(len(frame), dtype=bool)
+            if oids is not None:
+                selected = frame[oid_field].isin(oids).to_numpy() if oid_field in frame.columns else np.zeros(len(frame), dtype=bool)
+                summary['n_filtered'] += int((~selected).sum())
+
+            polygonal = np.isin(shapely.get_type_id(geometries), [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]) & ~shapely.is_empty(geometries)
+            summary['n_no_geometry'] += int((selected & ~polygonal).sum())
+            selected = selected & polygonal
+
+            if not selected.any():
+                continue
+
+            elements = build_elements(geometries[selected], next_id)
+            next_id = elements['next_id']
+            summary['n_degenerate'] += int(elements['skipped'].sum())
+
+            tags = apply_tag_mapping(frame[selected].reset_index(drop=True), mapping)
+            tags.loc[elements['skipped']] = None
+            tag_counts.update({key: int(count) for key, count in tags.notna().sum().items()})
+            rows = tag_rows(tags)
+
+            pickle.dump(elements['nodes'], node_spool)
+
+            way_ids, refs, counts, way_feature = elements['ways']
+            pickle.dump((way_ids, refs, counts, [rows[f] if f >= 0 else {} for f in way_feature.tolist()]), way_spool)
+
+            relation_ids, member_ids, roles, member_counts, relation_features = elements['relations']
+            pickle.dump((relation_ids, member_ids, ['way'] * len(member_ids), roles, member_counts,
+                         [{'type': 'multipolygon', **rows[f]} for f in relation_features.tolist()]), relation_spool)
+
+            summary['n_exported'] += int(len(geometries[selected]) - elements['skipped'].sum())
+            summary['n_ways'] += len(way_ids)
+            summary['n_relations'] += len(relation_ids)
+
+        # the nodes shared across blocks, and the way refs to them
+        nodes = list(_spooled(node_spool))
+        if nodes:
+            node_ids, lons, lats = (np.concatenate(arrays) for arrays in zip(*nodes))
+        else:
+            node_ids = lons = lats = np.zeros(0, dtype=np.int64)
+        first, canonical = dedup_nodes(node_ids, lons, lats)
+        del nodes
+
+        remap = np.zeros(-next_id, dtype=np.int64)
+        remap[-node_ids - 1] = canonical
+
+        writer.write_nodes(node_ids[first], lons[first], lats[first])
+        summary['n_nodes'] = int(first.sum())
+        summary['n_shared_nodes'] = int(len(node_ids) - first.sum())
+        del node_ids, lons, lats, first, canonical
+
+        for way_ids, refs, counts, tags in _spooled(way_spool):
+            writer.write_ways(way_ids, remap[-refs - 1], counts, tags)
+        for relations in _spooled(relation_spool):
+            writer.write_relations(*relations)
+
+    os.replace(tmp_path, outpath)
+
+    summary['tags'] = dict(tag_counts.most_common())
+    summary['elapsed'] = time.perf_counter() - start
+
+    logging.info(f"OSM export of {input_path} to {outpath}: {json.dumps(summary)}")
+
+    return summary
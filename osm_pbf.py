@@ -0,0 +1,645 @@
+import os
+import collections
+import struct
+import zlib
+import lzma
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+
+from esri_pbf import iter_fields, read_packed_varints, decode_varints, zigzag, encode_varint, encode_varints, encode_zigzag
+
+# reader of OpenStreetMap extracts in the PBF format (.osm.pbf), for the areas with a given tag
+# (buildings), and writer of new data, without needing the protobuf runtime nor osmium; see
+# https://wiki.openstreetmap.org/wiki/PBF_Format
+
+# the entities per block recommended by the format
+MAX_BLOCK_ENTITIES = 8000
+
+# PrimitiveGroup fields
+DENSE_NODES, WAYS, RELATIONS = 2, 3, 4
+
+# relation member types
+MEMBER_TYPES = {'node': 0, 'way': 1, 'relation': 2}
+
+def to_int64(value):
+    """
+    Converts the raw (unsigned) varint of an int64 field to a signed int.
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def decode_blob(buf):
+    """
+    Decompresses the data of a file block.
+
+    Args:
+        buf (memoryview): The Blob message.
+
+    Returns:
+        memoryview: The uncompressed block.
+
+    Raises:
+        ValueError: If the block uses an unsupported compression.
+    """
+    for number, _, value in iter_fields(buf):
+        if number == 1:
+            return value
+        if number == 3:
+            return memoryview(zlib.decompress(value))
+        if number == 4:
+            return memoryview(lzma.decompress(value))
+        if number == 7:
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError("The OSM PBF file uses zstd compression, which needs the zstandard package")
+            return memoryview(zstandard.ZstdDecompressor().decompress(value))
+        if number in (5, 6):
+            raise ValueError("Unsupported OSM PBF block compression (bzip2 or lz4)")
+
+    raise ValueError("Empty OSM PBF block")
+
+def iter_blobs(path):
+    """
+    Iterates over the (still compressed) data blocks of an .osm.pbf file.
+
+    Args:
+        path (str): The path of the file.
+
+    Yields:
+        bytes: Each Blob message.
+
+    Raises:
+        ValueError: If the file is truncated or not in the PBF format.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if not size:
+                return
+            if len(size) < 4:
+                raise ValueError(f"Truncated OSM PBF file {path}")
+
+            header = memoryview(f.read(struct.unpack('>I', size)[0]))
+            block_type, data_size = None, 0
+            for number, _, value in iter_fields(header):
+                if number == 1:
+                    block_type = bytes(value).decode('utf-8')
+                elif number == 3:
+                    data_size = value
+
+            blob = f.read(data_size)
+            if len(blob) < data_size:
+                raise ValueError(f"Truncated OSM PBF file {path}")
+
+            if block_type == 'OSMData':
+                yield blob
+            elif block_type != 'OSMHeader':
+                raise ValueError(f"Unknown OSM PBF block type {block_type} in {path}")
+
+def iter_blocks(path):
+    """
+    Iterates over the uncompressed data blocks (PrimitiveBlock messages) of an .osm.pbf file.
+    """
+    for blob in iter_blobs(path):
+        yield decode_blob(memoryview(blob))
+
+class PrimitiveBlock:
+    """
+    The string table, coordinate scaling and groups of a PBF data block.
+
+    Args:
+        buf (memoryview): The uncompressed PrimitiveBlock message.
+    """
+    def __init__(self, buf):
+        self.strings = []
+        self.groups = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+
+        for number, _, value in iter_fields(buf):
+            if number == 1:
+                self.strings = [bytes(string).decode('utf-8') for field, _, string in iter_fields(value) if field == 1]
+            elif number == 2:
+                self.groups.append(value)
+            elif number == 17:
+                self.granularity = value
+            elif number == 19:
+                self.lat_offset = to_int64(value)
+            elif number == 20:
+                self.lon_offset = to_int64(value)
+
+    def iter_group_items(self, kind):
+        """
+        Yields the raw messages of a kind in the groups: 1 nodes, 2 dense nodes, 3 ways, 4 relations.
+        """
+        for group in self.groups:
+            for number, _, value in iter_fields(group):
+                if number == kind:
+                    yield value
+
+    def tags(self, keys, values):
+        return {self.strings[key]: self.strings[value] for key, value in zip(keys, values)}
+
+    def coordinates(self, raw_lon, raw_lat):
+        # in nanodegrees, then degrees
+        lon = (self.lon_offset + self.granularity * raw_lon) * 1e-9
+        lat = (self.lat_offset + self.granularity * raw_lat) * 1e-9
+        return lon, lat
+
+def delta_decode(buf):
+    """
+    Decodes a packed, delta coded sint64 field (ids, coordinates, refs).
+
+    Args:
+        buf (memoryview): The packed field.
+
+    Returns:
+        np.ndarray: The values, as int64.
+    """
+    return np.cumsum(zigzag(decode_varints(buf)))
+
+def delta_decode_many(buffers):
+    """
+    Decodes many short packed, delta coded sint64 fields at once (e.g. the refs of all the ways).
+
+    Args:
+        buffers (list): The packed fields, as bytes.
+
+    Returns:
+        tuple: The values of all the fields, concatenated (np.ndarray of int64), and the number
+               of values of each field.
+    """
+    data = b''.join(buffers)
+    sizes = np.array([len(buf) for buf in buffers], dtype=np.int64)
+
+    # the number of varints of each field is the number of its bytes ending a varint
+    ends = np.concatenate([[0], np.cumsum(np.frombuffer(data, dtype=np.uint8) < 0x80)])
+    field_bounds = np.concatenate([[0], np.cumsum(sizes)])
+    counts = ends[field_bounds[1:]] - ends[field_bounds[:-1]]
+
+    # a single cumulative sum over everything, minus its value before each field
+    totals = np.cumsum(zigzag(decode_varints(data)))
+    value_starts = np.cumsum(counts) - counts
+    before = np.concatenate([[0], totals])[value_starts]
+
+    return totals - np.repeat(before, counts), counts
+
+def read_element(buf):
+    """
+    Reads the id, tag indexes and other fields of a way or relation message, without decoding them.
+
+    Returns:
+        tuple: The id, the key and value string indexes, and the {field number: raw value} of the other fields.
+    """
+    element_id, keys, values, fields = None, [], [], {}
+
+    for number, _, value in iter_fields(buf):
+        if number == 1:
+            element_id = to_int64(value)
+        elif number == 2:
+            keys = read_packed_varints(value)
+        elif number == 3:
+            values = read_packed_varints(value)
+        else:
+            fields[number] = value
+
+    return element_id, keys, values, fields
+
+def scan_block(blob, key):
+    """
+    Finds the ways and multipolygon relations tagged with `key` in a data block.
+
+    Args:
+        blob (bytes): The compressed block.
+        key (str): The tag key.
+
+    Returns:
+        tuple: The {way id: (packed refs, tags)} and {relation id: (member way ids, roles, tags)} dicts.
+    """
+    ways = {}
+    relations = {}
+
+    block = PrimitiveBlock(decode_blob(memoryview(blob)))
+    if key not in block.strings:
+        return ways, relations
+    key_index = block.strings.index(key)
+
+    for buf in block.iter_group_items(3):
+        way_id, keys, values, fields = read_element(buf)
+        if key_index in keys:
+            # decoded later, all at once
+            ways[way_id] = (bytes(fields.get(8, b'')), block.tags(keys, values))
+
+    for buf in block.iter_group_items(4):
+        relation_id, keys, values, fields = read_element(buf)
+        if key_index not in keys:
+            continue
+        tags = block.tags(keys, values)
+        if tags.get('type') != 'multipolygon':
+            continue
+
+        member_ids = delta_decode(fields.get(9, b''))
+        roles = [block.strings[sid] for sid in read_packed_varints(fields.get(8, b''))]
+        types = read_packed_varints(fields.get(10, b''))
+
+        # only the way members make the rings
+        members = [(member_id, role) for member_id, role, member_type in zip(member_ids.tolist(), roles, types) if member_type == 1]
+        relations[relation_id] = ([member_id for member_id, _ in members], [role for _, role in members], tags)
+
+    return ways, relations
+
+def scan_areas(path, key, max_workers=None):
+    """
+    First pass: finds the ways and multipolygon relations tagged with `key`, scanning the
+    blocks in a process pool (a few blocks ahead of the results, to bound memory).
+
+    Returns:
+        tuple: The {way id: (packed refs, tags)} and {relation id: (member way ids, roles, tags)} dicts.
+    """
+    ways = {}
+    relations = {}
+
+    max_workers = max_workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        window = 4 * max_workers
+        pending = collections.deque()
+
+        for blob in iter_blobs(path):
+            pending.append(executor.submit(scan_block, blob, key))
+            if len(pending) >= window:
+                block_ways, block_relations = pending.popleft().result()
+                ways.update(block_ways)
+                relations.update(block_relations)
+
+        while pending:
+            block_ways, block_relations = pending.popleft().result()
+            ways.update(block_ways)
+            relations.update(block_relations)
+
+    return ways, relations
+
+def scan_member_ways(path, way_ids):
+    """
+    Second pass, only with relations: reads the refs of their member ways.
+
+    Returns:
+        dict: The {way id: packed refs}.
+    """
+    refs = {}
+
+    for data in iter_blocks(path):
+        block = PrimitiveBlock(data)
+
+        for buf in block.iter_group_items(3):
+            way_id, _, _, fields = read_element(buf)
+            if way_id in way_ids:
+                refs[way_id] = bytes(fields.get(8, b''))
+
+    return refs
+
+def scan_nodes(path, node_ids):
+    """
+    Last pass: reads the coordinates of the given nodes.
+
+    Args:
+        path (str): The path of the file.
+        node_ids (np.ndarray): The sorted, unique node ids.
+
+    Returns:
+        tuple: The sorted ids of the nodes found, and their (n, 2) longitude/latitude array.
+    """
+    found_ids = []
+    found_coords = []
+
+    def collect(block, ids, raw_lon, raw_lat):
+        positions = np.minimum(np.searchsorted(node_ids, ids), len(node_ids) - 1)
+        hit = node_ids[positions] == ids
+        if hit.any():
+            lon, lat = block.coordinates(raw_lon[hit], raw_lat[hit])
+            found_ids.append(ids[hit])
+            found_coords.append(np.column_stack([lon, lat]))
+
+    if not len(node_ids):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2))
+
+    for data in iter_blocks(path):
+        block = PrimitiveBlock(data)
+
+        for buf in block.iter_group_items(2):
+            fields = {number: value for number, _, value in iter_fields(buf)}
+            collect(block, delta_decode(fields.get(1, b'')), delta_decode(fields.get(9, b'')), delta_decode(fields.get(8, b'')))
+
+        for buf in block.iter_group_items(1):
+            fields = {number: value for number, _, value in iter_fields(buf)}
+            raw = [zigzag(np.array([fields.get(number, 0)], dtype=np.uint64)) for number in (1, 9, 8)]
+            collect(block, *raw)
+
+    if not found_ids:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2))
+
+    ids = np.concatenate(found_ids)
+    coords = np.concatenate(found_coords)
+    order = np.argsort(ids, kind='stable')
+
+    return ids[order], coords[order]
+
+def lookup_coords(refs, node_ids, node_coords):
+    """
+    Looks up the coordinates of node refs.
+
+    Returns:
+        tuple: The (n, 2) coordinates and the mask of the refs that were found.
+    """
+    if not len(node_ids):
+        return np.zeros((len(refs), 2)), np.zeros(len(refs), dtype=bool)
+
+    positions = np.minimum(np.searchsorted(node_ids, refs), len(node_ids) - 1)
+    found = node_ids[positions] == refs
+
+    return node_coords[positions], found
+
+def read_osm_areas(path, key='building', bbox=None, max_workers=None):
+    """
+    Reads the polygons of the ways and multipolygon relations tagged with `key` from an .osm.pbf extract.
+
+    The file is read in two or three streaming passes (tagged elements, member ways of the
+    relations if any, then only the coordinates of their nodes), so memory follows the number
+    of tagged areas, not the size of the extract. Closed ways become polygons in one vectorized
+    call; relations are polygonized from their outer and inner member ways. Unclosed ways and
+    areas with nodes missing from the extract are skipped. The first pass, which parses every
+    way and relation, runs block by block in a process pool.
+
+    Args:
+        path (str): The path of the .osm.pbf file.
+        key (str, optional): The tag key of the areas. Defaults to 'building'.
+        bbox (tuple, optional): Keep only the areas whose bbox intersects this (xmin, ymin,
+                                xmax, ymax) longitude/latitude box. Defaults to None (all).
+        max_workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+
+    Returns:
+        dict: The 'osm_type' ('way' or 'relation'), 'osm_id' and 'geometry' arrays and the
+              'tags' list of the areas, plus the counts of the 'skipped' ones.
+    """
+    ways, relations = scan_areas(path, key, max_workers=max_workers)
+
+    member_ids = {member_id for members, _, _ in relations.values() for member_id in members}
+    member_ways = {way_id: ways[way_id][0] for way_id in member_ids if way_id in ways}
+    missing_members = member_ids - set(member_ways)
+    if missing_members:
+        member_ways.update(scan_member_ways(path, missing_members))
+
+    refs, lengths = delta_decode_many([packed for packed, _ in ways.values()])
+    member_refs, member_lengths = delta_decode_many(list(member_ways.values()))
+    member_starts = np.concatenate([[0], np.cumsum(member_lengths)])
+    member_refs = {way_id: member_refs[member_starts[i]:member_starts[i + 1]] for i, way_id in enumerate(member_ways)}
+
+    node_ids = np.unique(np.concatenate([refs, *member_refs.values()]))
+    node_ids, node_coords = scan_nodes(path, node_ids)
+
+    skipped = {'unclosed': 0, 'missing_nodes': 0, 'relations': 0}
+
+    # closed ways: one vectorized polygon construction
+    way_ids = np.array(list(ways), dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    closed = lengths >= 4
+    closed[closed] = refs[starts[closed]] == refs[starts[closed] + lengths[closed] - 1]
+    skipped['unclosed'] = int((~closed).sum())
+
+    coords, found = lookup_coords(refs, node_ids, node_coords)
+    way_index = np.repeat(np.arange(len(ways)), lengths)
+    complete = np.ones(len(ways), dtype=bool)
+    complete[way_index[~found]] = False
+    skipped['missing_nodes'] = int((closed & ~complete).sum())
+
+    keep = closed & complete
+    kept_points = keep[way_index]
+    if keep.any():
+        rings = shapely.linearrings(coords[kept_points], indices=np.searchsorted(np.flatnonzero(keep), way_index[kept_points]))
+        way_geometries = shapely.polygons(rings)
+    else:
+        way_geometries = np.empty(0, dtype=object)
+
+    way_tags = [tags for (_, tags), kept in zip(ways.values(), keep) if kept]
+
+    # multipolygon relations
+    relation_ids, relation_geometries, relation_tags = [], [], []
+
+    for relation_id, (members, roles, tags) in relations.items():
+        lines = {'outer': [], 'inner': []}
+        for member_id, role in zip(members, roles):
+            member_coords, member_found = lookup_coords(member_refs.get(member_id, np.zeros(0, dtype=np.int64)), node_ids, node_coords)
+            if len(member_coords) >= 2 and member_found.all():
+                lines['inner' if role == 'inner' else 'outer'].append(shapely.linestrings(member_coords))
+
+        outer = shapely.union_all(shapely.get_parts(shapely.polygonize(lines['outer'])))
+        if shapely.is_empty(outer):
+            skipped['relations'] += 1
+            continue
+        if lines['inner']:
+            outer = shapely.difference(outer, shapely.union_all(shapely.get_parts(shapely.polygonize(lines['inner']))))
+
+        relation_ids.append(relation_id)
+        relation_geometries.append(outer)
+        relation_tags.append(tags)
+
+    areas = {
+        'osm_type': np.array(['way'] * len(way_tags) + ['relation'] * len(relation_ids), dtype=str),
+        'osm_id': np.concatenate([way_ids[keep], np.array(relation_ids, dtype=np.int64)]),
+        'geometry': np.concatenate([way_geometries, np.array(relation_geometries, dtype=object)]),
+        'tags': way_tags + relation_tags,
+        'skipped': skipped,
+    }
+
+    if bbox is not None and len(areas['geometry']):
+        bounds = shapely.bounds(areas['geometry'])
+        xmin, ymin, xmax, ymax = bbox
+        inside = (bounds[:, 2] >= xmin) & (bounds[:, 0] <= xmax) & (bounds[:, 3] >= ymin) & (bounds[:, 1] <= ymax)
+        areas.update({name: areas[name][inside] for name in ['osm_type', 'osm_id', 'geometry']})
+        areas['tags'] = [tags for tags, kept in zip(areas['tags'], inside) if kept]
+
+    return areas
+
+def encode_field(number, data):
+    """
+    Encodes a length-delimited field (bytes, string, message or packed values).
+    """
+    return encode_varint(number << 3 | 2) + encode_varint(len(data)) + data
+
+def encode_int_field(number, value):
+    """
+    Encodes a varint field, negative values as their two's complement (int64).
+    """
+    return encode_varint(number << 3) + encode_varint(value & 0xffffffffffffffff)
+
+def encode_delta(number, values):
+    """
+    Encodes a packed, delta coded sint64 field (ids, coordinates, refs).
+    """
+    return encode_field(number, encode_varints(encode_zigzag(np.diff(np.asarray(values, dtype=np.int64), prepend=0))))
+
+def encode_delta_many(values, counts):
+    """
+    Encodes many packed, delta coded sint64 fields at once (e.g. the refs of all the ways), the
+    inverse of `delta_decode_many`.
+
+    Args:
+        values (np.ndarray): The values of all the fields, concatenated.
+        counts (np.ndarray): The number of values of each field.
+
+    Returns:
+        list: The packed contents of each field, as bytes.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+
+    deltas = np.diff(values, prepend=0)
+    deltas[starts[counts > 0]] = values[starts[counts > 0]]
+    raw = encode_zigzag(deltas)
+    data = encode_varints(raw)
+
+    sizes = np.ones(len(raw), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += raw >= np.uint64(1 << 7 * k)
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+
+    return [data[start:end] for start, end in zip(bounds[starts].tolist(), bounds[starts + counts].tolist())]
+
+def encode_packed_small(number, values):
+    """
+    Encodes a short packed field of (unsigned) varints, without the overhead of numpy.
+    """
+    return encode_field(number, b''.join(encode_varint(value) for value in values))
+
+def encode_blob(block_type, data, level=6):
+    """
+    Compresses a file block and frames it with its header.
+
+    Args:
+        block_type (str): 'OSMHeader' or 'OSMData'.
+        data (bytes): The HeaderBlock or PrimitiveBlock message.
+        level (int, optional): The zlib compression level. Defaults to 6.
+
+    Returns:
+        bytes: The length of the BlobHeader, the BlobHeader and the Blob.
+    """
+    blob = encode_int_field(2, len(data)) + encode_field(3, zlib.compress(data, level))
+    header = encode_field(1, block_type.encode('utf-8')) + encode_int_field(3, len(blob))
+
+    return struct.pack('>I', len(header)) + header + blob
+
+class StringTable:
+    """
+    The string table of a PrimitiveBlock being built, the empty string first as the format requires.
+    """
+    def __init__(self):
+        self.index = {'': 0}
+
+    def __call__(self, string):
+        return self.index.setdefault(string, len(self.index))
+
+    def encode(self):
+        return encode_field(1, b''.join(encode_field(1, string.encode('utf-8')) for string in self.index))
+
+def encode_tags(tags, strings):
+    if not tags:
+        return b''
+    return encode_packed_small(2, [strings(key) for key in tags]) + encode_packed_small(3, [strings(str(value)) for value in tags.values()])
+
+class PbfWriter:
+    """
+    Writes an .osm.pbf file of new data, block by block, so memory doesn't depend on its size.
+
+    Coordinates are given in 1e-7 degrees, the default granularity of the format (and the
+    precision of the OSM database). The elements are written in the order they are given:
+    readers expect all the nodes first, then the ways, then the relations.
+
+    Args:
+        path (str): The path of the file.
+        writing_program (str, optional): The program recorded in the header. Defaults to 'geocuritiba'.
+    """
+    def __init__(self, path, writing_program='geocuritiba'):
+        self.path = path
+        self.file = open(path, 'wb')
+
+        header = encode_field(4, b'OsmSchema-V0.6') + encode_field(4, b'DenseNodes') + encode_field(16, writing_program.encode('utf-8'))
+        self.file.write(encode_blob('OSMHeader', header))
+
+    def _write_group(self, strings, group):
+        # a PrimitiveBlock of a single PrimitiveGroup
+        self.file.write(encode_blob('OSMData', strings.encode() + encode_field(2, group)))
+
+    def write_nodes(self, ids, lons, lats):
+        """
+        Writes untagged nodes.
+
+        Args:
+            ids (np.ndarray): The node ids.
+            lons (np.ndarray): Their longitudes, in 1e-7 degrees.
+            lats (np.ndarray): Their latitudes, in 1e-7 degrees.
+        """
+        for start in range(0, len(ids), MAX_BLOCK_ENTITIES):
+            end = start + MAX_BLOCK_ENTITIES
+            dense = encode_delta(1, ids[start:end]) + encode_delta(8, lats[start:end]) + encode_delta(9, lons[start:end])
+            self._write_group(StringTable(), encode_field(DENSE_NODES, dense))
+
+    def write_ways(self, ids, refs, counts, tags):
+        """
+        Writes ways.
+
+        Args:
+            ids (np.ndarray): The way ids.
+            refs (np.ndarray): The node ids of all the ways, concatenated.
+            counts (np.ndarray): The number of nodes of each way.
+            tags (list): The tags (dict) of each way.
+        """
+        packed_refs = encode_delta_many(refs, counts)
+        ids = ids.tolist()
+
+        for start in range(0, len(ids), MAX_BLOCK_ENTITIES):
+            strings = StringTable()
+            ways = []
+            for i in range(start, min(start + MAX_BLOCK_ENTITIES, len(ids))):
+                way = encode_int_field(1, ids[i]) + encode_tags(tags[i], strings) + encode_field(8, packed_refs[i])
+                ways.append(encode_field(WAYS, way))
+            self._write_group(strings, b''.join(ways))
+
+    def write_relations(self, ids, member_ids, member_types, roles, counts, tags):
+        """
+        Writes relations.
+
+        Args:
+            ids (np.ndarray): The relation ids.
+            member_ids (np.ndarray): The ids of the members of all the relations, concatenated.
+            member_types (list): The type of each member ('node', 'way' or 'relation').
+            roles (list): The role of each member.
+            counts (np.ndarray): The number of members of each relation.
+            tags (list): The tags (dict) of each relation.
+        """
+        starts = (np.cumsum(counts) - counts).tolist()
+        packed_members = encode_delta_many(member_ids, counts)
+        ids = ids.tolist()
+
+        for start in range(0, len(ids), MAX_BLOCK_ENTITIES):
+            strings = StringTable()
+            relations = []
+            for i in range(start, min(start + MAX_BLOCK_ENTITIES, len(ids))):
+                members = slice(starts[i], starts[i] + int(counts[i]))
+                relation = (encode_int_field(1, ids[i]) + encode_tags(tags[i], strings) +
+                            encode_packed_small(8, [strings(role) for role in roles[members]]) +
+                            encode_field(9, packed_members[i]) +
+                            encode_packed_small(10, [MEMBER_TYPES[member_type] for member_type in member_types[members]]))
+                relations.append(encode_field(RELATIONS, relation))
+            self._write_group(strings, b''.join(relations))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
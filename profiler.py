@@ -0,0 +1,247 @@
+import json
+import hashlib
+import math
+from tqdm import tqdm
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from checker import fastjson
+from lib.compression import iter_chunk_lines
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch, with 2**p registers.
+
+    Args:
+        p (int, optional): The precision; the relative error is about 1.04 / sqrt(2**p).
+                           Defaults to 12 (~1.6%, 4 KiB of registers).
+    """
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(repr(value).encode('utf-8'), digest_size=8).digest(), 'little')
+        index = h & (self.m - 1)
+        rest = h >> self.p
+        rank = (64 - self.p) - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def cardinality(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        # small range correction (linear counting)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+
+        return int(round(estimate))
+
+class ColumnProfile:
+    """
+    Streaming profile of one attribute column: value/null counts, type histogram and distinct values.
+
+    The distinct values are counted exactly up to `max_distinct`; past that the column switches
+    to a HyperLogLog sketch for its cardinality and a Misra-Gries summary of its `top_k` most
+    frequent values, so memory stays bounded whatever the cardinality.
+
+    Args:
+        max_distinct (int, optional): The maximum number of exactly counted distinct values.
+                                      Defaults to 10000.
+        top_k (int, optional): The number of frequent values kept once the exact counting
+                               is over. Defaults to 100.
+    """
+    def __init__(self, max_distinct=10000, top_k=100):
+        self.max_distinct = max_distinct
+        self.top_k = top_k
+
+        self.n_values = 0
+        self.n_nulls = 0
+        self.types = Counter()
+        self.counts = Counter()
+        self.sketch = None
+
+    @property
+    def exact(self):
+        return self.sketch is None
+
+    def _to_sketch(self):
+        self.sketch = HyperLogLog()
+        for value in self.counts:
+            self.sketch.add(value)
+        self._prune()
+
+    def _prune(self):
+        # Misra-Gries: keep the top_k counters, discounting the (top_k + 1)-th count from all of them
+        if len(self.counts) <= self.top_k:
+            return
+        most_common = self.counts.most_common(self.top_k + 1)
+        floor = most_common[-1][1]
+        self.counts = Counter({value: count - floor for value, count in most_common[:-1] if count > floor})
+
+    def add(self, value):
+        self.n_values += 1
+        self.types[type(value).__name__] += 1
+
+        if value is None:
+            self.n_nulls += 1
+            return
+
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, sort_keys=True)
+
+        self.counts[value] += 1
+
+        if self.exact:
+            if len(self.counts) > self.max_distinct:
+                self._to_sketch()
+        else:
+            self.sketch.add(value)
+            if len(self.counts) > 2 * self.top_k:
+                self._prune()
+
+    def merge(self, other):
+        """
+        Merges the profile of another partition of the same column into this one.
+
+        Args:
+            other (ColumnProfile): The other profile.
+        """
+        self.n_values += other.n_values
+        self.n_nulls += other.n_nulls
+        self.types.update(other.types)
+
+        if self.exact and other.exact:
+            self.counts.update(other.counts)
+            if len(self.counts) > self.max_distinct:
+                self._to_sketch()
+            return
+
+        if self.exact:
+            self._to_sketch()
+
+        if other.exact:
+            for value in other.counts:
+                self.sketch.add(value)
+        else:
+            self.sketch.merge(other.sketch)
+
+        self.counts.update(other.counts)
+        self._prune()
+
+    def distinct_values(self):
+        """
+        Returns the distinct values (null included, if any), sorted; only the most frequent
+        ones if the column is not exact anymore.
+
+        Returns:
+            list: The values.
+        """
+        values = sorted(self.counts, key=lambda v: (type(v).__name__, v))
+
+        if self.n_nulls:
+            values = [None] + values
+
+        return values
+
+    def summary(self):
+        """
+        Returns the statistics of the column.
+
+        Returns:
+            dict: The count, null count and ratio, cardinality of the non null values (estimated
+                  or exact), number of distinct values with null (`distinct_estimate`), type
+                  histogram and whether the distinct values are exact (when not, `distinct_values`
+                  is only the Misra-Gries summary and may hold a single value of many).
+        """
+        cardinality = len(self.counts) if self.exact else self.sketch.cardinality()
+
+        return {
+            'n_values': self.n_values,
+            'n_nulls': self.n_nulls,
+            'null_ratio': self.n_nulls / self.n_values if self.n_values else None,
+            'cardinality': cardinality,
+            'distinct_estimate': cardinality + (1 if self.n_nulls else 0),
+            'exact': self.exact,
+            'types': dict(self.types.most_common()),
+        }
+
+def feature_properties(line):
+    """
+    Parses only the properties of a GeoJSONL line, skipping the geometry.
+
+    The dumpers write the properties as the last member of each feature, so only the text
+    after it is parsed; lines with another layout are fully parsed.
+
+    Args:
+        line (bytes): A GeoJSONL line.
+
+    Returns:
+        dict: The properties of the feature.
+    """
+    start = line.rfind(b'"properties": ')
+
+    if start != -1:
+        try:
+            return fastjson.loads(line[start + len(b'"properties": '):].rstrip()[:-1]) or {}
+        except ValueError:
+            pass
+
+    return fastjson.loads(line).get('properties') or {}
+
+def profile_file(filepath, max_distinct=10000, top_k=100):
+    """
+    Profiles the attribute columns of one GeoJSONL chunk.
+
+    Args:
+        filepath (str): The path of the chunk.
+        max_distinct (int, optional): See ColumnProfile. Defaults to 10000.
+        top_k (int, optional): See ColumnProfile. Defaults to 100.
+
+    Returns:
+        dict: A {column: ColumnProfile} dict.
+    """
+    profiles = {}
+
+    for line in iter_chunk_lines(filepath):
+        for column, value in feature_properties(line).items():
+            if column not in profiles:
+                profiles[column] = ColumnProfile(max_distinct=max_distinct, top_k=top_k)
+            profiles[column].add(value)
+
+    return profiles
+
+def profile_columns(filepaths, max_workers=None, max_distinct=10000, top_k=100):
+    """
+    Profiles the attribute columns of many GeoJSONL chunks, in parallel, in a single pass.
+
+    Args:
+        filepaths (list): The chunk paths.
+        max_workers (int, optional): The number of worker processes. Defaults to None (one per CPU).
+        max_distinct (int, optional): See ColumnProfile. Defaults to 10000.
+        top_k (int, optional): See ColumnProfile. Defaults to 100.
+
+    Returns:
+        dict: A {column: ColumnProfile} dict with the merged profiles.
+    """
+    merged = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        partials = executor.map(profile_file, filepaths, [max_distinct] * len(filepaths), [top_k] * len(filepaths), chunksize=8)
+
+        for partial in tqdm(partials, total=len(filepaths)):
+            for column, profile in partial.items():
+                if column in merged:
+                    merged[column].merge(profile)
+                else:
+                    merged[column] = profile
+
+    return merged
@@ -0,0 +1,324 @@
+from lib import *
+
+from tiles import tiled_dumper
+
+JOB_MODES = ('lazy', 'parallel', 'tiled', 'streaming')
+
+# server -> use_alt; 'both' stripes a parallel dump across the two, from the main server's stats
+JOB_SERVERS = {'main': False, 'alt': True, 'both': False}
+
+JOB_DEFAULTS = {
+    'server': 'main',
+    'mode': 'lazy',
+    'chunksize': 1000,
+    'concurrency': 4,
+    'priority': 0,
+    'options': {},
+}
+
+JOBS_STATE_PATH = 'outputs/_jobs_state.json'
+
+def normalize_job(job):
+    """
+    Fills the defaults of a job description and checks it.
+
+    A job is a dict with the keys:
+        - layer (str): The layer name, a key of LAYER_IDS (without the '_alt' suffix).
+        - server (str, optional): 'main' (MAPSERVER_URL), 'alt' (MAPSERVER_URL_ALT) or 'both' (the ranges
+                                  split between the two, 'parallel' mode only). Defaults to 'main'.
+        - mode (str, optional): The dumper, one of 'lazy' (geojsonl_lazy_dumper), 'parallel'
+                                (geojsonl_parallel_dumper), 'tiled' (tiled_dumper) or 'streaming'
+                                (streaming_dumper). Defaults to 'lazy'.
+        - chunksize (int, optional): The features per chunk (or per batch, for 'streaming'). Defaults to 1000.
+        - concurrency (int, optional): The workers of the 'parallel' and 'tiled' modes. Defaults to 4.
+        - priority (int, optional): Jobs with higher priorities are started first. Defaults to 0.
+        - output (str, optional): The output folder ('.parquet' file, for 'streaming'). Defaults to
+                                  'outputs/<layer>', with a '_parallel', '_tiles' or '.parquet' suffix
+                                  for the other modes, as the dumping scripts do.
+        - name (str, optional): The name of the job in the state file. Defaults to '<layer>_<server>_<mode>'.
+        - options (dict, optional): Further keyword arguments of the dumper. Defaults to {}.
+
+    Args:
+        job (dict): The job description.
+
+    Returns:
+        dict: The complete job description.
+
+    Raises:
+        ValueError: If the layer, server or mode are not valid, or 'both' is used with another
+                    mode than 'parallel'.
+    """
+    job = {**JOB_DEFAULTS, **job}
+
+    if job['server'] not in JOB_SERVERS:
+        raise ValueError(f"Unknown server '{job['server']}', must be one of {list(JOB_SERVERS)}")
+
+    if job['mode'] not in JOB_MODES:
+        raise ValueError(f"Unknown mode '{job['mode']}', must be one of {list(JOB_MODES)}")
+
+    if job['server'] == 'both' and job['mode'] != 'parallel':
+        raise ValueError(f"Server 'both' needs the 'parallel' mode, not '{job['mode']}'")
+
+    # also raises ValueError for empty or unknown layers
+    get_layer_url(job.get('layer'), use_alt=JOB_SERVERS[job['server']])
+
+    if not job.get('output'):
+        suffixes = {'lazy': '', 'parallel': '_parallel', 'tiled': '_tiles', 'streaming': '.parquet'}
+        job['output'] = os.path.join('outputs', f"{job['layer']}{suffixes[job['mode']]}")
+
+    if not job.get('name'):
+        job['name'] = f"{job['layer']}_{job['server']}_{job['mode']}"
+
+    return job
+
+def default_jobs():
+    """
+    Builds one lazy dump job per layer of LAYER_IDS, from the alternative server for the
+    layers that have an '_alt' id.
+
+    Returns:
+        list: The job descriptions.
+    """
+    layernames = [layername for layername in LAYER_IDS if not layername.endswith('_alt')]
+
+    return [normalize_job({'layer': layername, 'server': 'alt' if f'{layername}_alt' in LAYER_IDS else 'main'})
+            for layername in layernames]
+
+def read_jobs(path):
+    """
+    Reads a JSON list of job descriptions (see `normalize_job`).
+
+    Args:
+        path (str): The path of the jobs file.
+
+    Returns:
+        list: The complete job descriptions.
+
+    Raises:
+        ValueError: If the names of the jobs are not unique, or a job is not valid.
+    """
+    jobs = [normalize_job(job) for job in read_json(path, [])]
+
+    names = [job['name'] for job in jobs]
+    if len(names) != len(set(names)):
+        raise ValueError(f"The job names of {path} must be unique")
+
+    return jobs
+
+def job_manifest_path(job):
+    """
+    Returns the manifest written by the dumper of a job, or None for the 'streaming' mode.
+
+    Args:
+        job (dict): The job description.
+
+    Returns:
+        str: The path of the manifest.
+    """
+    manifest_names = {
+        'lazy': '{}_manifest.jsonl',
+        'parallel': '{}_ranges_manifest.jsonl',
+        'tiled': '{}_tiles_manifest.jsonl',
+    }
+
+    if job['mode'] not in manifest_names:
+        return None
+
+    return os.path.join(job['output'], manifest_names[job['mode']].format(job['layer']))
+
+def job_output_size(job):
+    """
+    Measures what a job has written so far.
+
+    Args:
+        job (dict): The job description.
+
+    Returns:
+        tuple: The (number of features, number of bytes) of the job's output.
+    """
+    manifest_path = job_manifest_path(job)
+
+    if manifest_path:
+        manifest = ChunkManifest(manifest_path)
+        n_features = manifest.n_features
+        n_bytes = sum(entry['n_bytes'] for entry in manifest.entries)
+
+        # the last chunk of the lazy dumper is complete but left unregistered
+        registered = manifest.filenames
+        for filepath in listdir_fullpath(job['output'], extension=CHUNK_EXTENSIONS):
+            if os.path.basename(filepath) not in registered and os.path.basename(filepath).startswith(job['layer']):
+                n_features += sum(1 for _ in iter_chunk_lines(filepath))
+                n_bytes += os.path.getsize(filepath)
+
+        return n_features, n_bytes
+
+    if not os.path.exists(job['output']):
+        return 0, 0
+
+    return pq.ParquetFile(job['output']).metadata.num_rows, os.path.getsize(job['output'])
+
+def run_job(job):
+    """
+    Runs the dumper of a job.
+
+    Args:
+        job (dict): The job description.
+
+    Returns:
+        The return value of the dumper.
+    """
+    use_alt = JOB_SERVERS[job['server']]
+    options = job['options']
+
+    if job['mode'] == 'lazy':
+        return geojsonl_lazy_dumper(job['layer'], use_alt=use_alt, outfolderpath=job['output'],
+                                    chunksize=job['chunksize'], **options)
+
+    if job['mode'] == 'parallel':
+        return geojsonl_parallel_dumper(job['layer'], use_alt=use_alt, outfolderpath=job['output'],
+                                        chunksize=job['chunksize'], max_workers=job['concurrency'],
+                                        striped=job['server'] == 'both', **options)
+
+    if job['mode'] == 'tiled':
+        return tiled_dumper(job['layer'], use_alt=use_alt, outfolderpath=job['output'],
+                            max_workers=job['concurrency'], **options)
+
+    create_dir(os.path.dirname(job['output']) or '.')
+    return streaming_dumper(job['layer'], job['output'], use_alt=use_alt, batch_size=job['chunksize'], **options)
+
+class JobScheduler:
+    """
+    Runs many layer dumps at once, persisting the state of each job so that, after a crash,
+    running the same jobs again only resumes the unfinished ones (the dumpers themselves
+    resume from their manifests).
+
+    The state file holds, per job name, its status ('pending', 'running', 'done' or 'failed'),
+    start and end times, error and throughput. The requests of all the jobs to a same host
+    share the budget set with `set_host_budget`.
+
+    Args:
+        jobs (list): The job descriptions (see `normalize_job`).
+        state_path (str, optional): The path of the state file. Defaults to JOBS_STATE_PATH.
+        max_jobs (int, optional): The number of jobs run at once. Defaults to 2.
+    """
+    def __init__(self, jobs, state_path=JOBS_STATE_PATH, max_jobs=2):
+        self.jobs = [normalize_job(job) for job in jobs]
+        self.state_path = state_path
+        self.max_jobs = max_jobs
+
+        self._lock = threading.Lock()
+        self.state = read_json(state_path, {})
+
+    def _save_state(self):
+        create_dir(os.path.dirname(self.state_path) or '.')
+        tmp_path = f'{self.state_path}.tmp'
+        dump_json(self.state, tmp_path)
+        os.replace(tmp_path, self.state_path)
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self.state.setdefault(name, {}).update(fields)
+            self._save_state()
+
+    def reset(self, names=None):
+        """
+        Marks jobs as pending again, so the next run dumps them again (resuming from their outputs).
+
+        Args:
+            names (list, optional): The names of the jobs. Defaults to None (all).
+        """
+        with self._lock:
+            for name in names or [job['name'] for job in self.jobs]:
+                self.state.pop(name, None)
+            self._save_state()
+
+    def pending_jobs(self):
+        """
+        Returns the jobs that are not done, highest priority first.
+
+        Returns:
+            list: The job descriptions.
+        """
+        jobs = [job for job in self.jobs if self.state.get(job['name'], {}).get('status') != 'done']
+
+        return sorted(jobs, key=lambda job: -job['priority'])
+
+    def _run(self, job):
+        name = job['name']
+        # the manifest dumpers resume, so only what this run adds counts; the streaming one starts over
+        n_features_before, n_bytes_before = job_output_size(job) if job_manifest_path(job) else (0, 0)
+
+        self._update(name, status='running', layer=job['layer'], server=job['server'], mode=job['mode'],
+                     started=time.time(), ended=None, error=None)
+        start = time.perf_counter()
+
+        try:
+            run_job(job)
+            status, error = 'done', None
+        except Exception as e:
+            logging.error(f"Job {name} failed: {e}")
+            status, error = 'failed', repr(e)
+
+        elapsed = time.perf_counter() - start
+        n_features, n_bytes = job_output_size(job)
+        n_features -= n_features_before
+        n_bytes -= n_bytes_before
+
+        throughput = {
+            'elapsed': elapsed,
+            'n_features': n_features,
+            'n_bytes': n_bytes,
+            'features_per_second': n_features / elapsed if elapsed else None,
+            'bytes_per_second': n_bytes / elapsed if elapsed else None,
+        }
+
+        self._update(name, status=status, ended=time.time(), error=error, throughput=throughput)
+        logging.info(f"Job {name} {status}: {json.dumps(throughput)}")
+
+        return status
+
+    def run(self):
+        """
+        Runs the pending jobs, `max_jobs` at a time.
+
+        Returns:
+            dict: The summary, see `summary`.
+        """
+        jobs = self.pending_jobs()
+
+        for job in jobs:
+            self._update(job['name'], status='pending')
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            futures = {executor.submit(self._run, job): job for job in jobs}
+
+            for future in tqdm(as_completed(futures), total=len(futures), desc='jobs'):
+                future.result()
+
+        return self.summary()
+
+    def summary(self):
+        """
+        Summarizes the status and the throughput of the jobs, per layer.
+
+        Returns:
+            dict: The {'jobs': {name: state}, 'layers': {layer: totals}} summary, the totals being
+                  the features, bytes, time, features/s and bytes/s of the last run of its jobs.
+        """
+        jobs = {job['name']: self.state.get(job['name'], {'status': 'pending'}) for job in self.jobs}
+        layers = {}
+
+        for job in self.jobs:
+            throughput = jobs[job['name']].get('throughput')
+            if not throughput:
+                continue
+
+            totals = layers.setdefault(job['layer'], {'n_features': 0, 'n_bytes': 0, 'elapsed': 0.0})
+            for key in totals:
+                totals[key] += throughput[key]
+
+        for totals in layers.values():
+            totals['features_per_second'] = totals['n_features'] / totals['elapsed'] if totals['elapsed'] else None
+            totals['bytes_per_second'] = totals['n_bytes'] / totals['elapsed'] if totals['elapsed'] else None
+
+        return {'jobs': jobs, 'layers': layers}
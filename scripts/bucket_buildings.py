@@ -0,0 +1,6 @@
+from importer import *
+from lib.cli import main
+
+if __name__ == '__main__':
+    # `python -m lib bucket`, from outputs/buildings to data/buildings by default
+    sys.exit(main(['bucket', *sys.argv[1:]]))
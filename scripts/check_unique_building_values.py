@@ -1,72 +1,35 @@
 from importer import *
-import numpy as np
-import pandas as pd
+from profiler import profile_columns
+import argparse
 
-buildings_folderpath, filelist = get_filelist('buildings')
+# high cardinality columns, left out of the unique values file (they are still profiled)
+columns_to_exclude = ['objectid', 'x_coord', 'y_coord', 'geometry', 'ctba_nome', 'nome']
 
-if not filelist:
-    print(f"No files found in {buildings_folderpath}")
-    exit(1)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile the attribute columns of the dumped building chunks.')
+    parser.add_argument('--workers', '-w', type=int, default=None,
+                        help='Number of worker processes (default: one per CPU)')
 
-data = {}
-types = []
+    args = parser.parse_args()
 
-columns_to_exclude = ['objectid', 'x_coord', 'y_coord', 'geometry', 'ctba_nome', 'nome']
+    buildings_folderpath, filelist = get_filelist('buildings')
 
-for filename in tqdm(filelist):
-    filepath = os.path.join(buildings_folderpath, filename)
-    
-    try:
-        gdf = gpd.read_file(filepath)
-    except Exception as e:
-        print(f"Error reading {filename}: {e}")
-        continue
+    if not filelist:
+        print(f"No files found in {buildings_folderpath}")
+        exit(1)
 
-    for col in gdf.columns:
-        if col not in columns_to_exclude:
-            values = []
-            uniques = gdf[col].unique()
+    profiles = profile_columns([os.path.join(buildings_folderpath, filename) for filename in filelist],
+                               max_workers=args.workers)
 
-            # Process unique values with better type handling
-            for value in uniques:
-                value_type = type(value)
-                types.append(str(value_type))
-                
-                # Handle different numpy and pandas types more robustly
-                if pd.isna(value):
-                    # Skip NaN/None values
-                    continue
-                elif isinstance(value, (np.integer, np.int64, np.int32)):
-                    values.append(int(value))
-                elif isinstance(value, (np.floating, np.float64, np.float32)):
-                    if not np.isnan(value):
-                        values.append(float(value))
-                elif isinstance(value, np.bool_):
-                    values.append(bool(value))
-                elif isinstance(value, (str, np.str_)):
-                    values.append(str(value))
-                else:
-                    # For any other types, try to convert to a serializable format
-                    try:
-                        # Try to convert to basic Python types
-                        if hasattr(value, 'item'):  # numpy scalar
-                            values.append(value.item())
-                        else:
-                            values.append(value)
-                    except (ValueError, TypeError):
-                        # If conversion fails, convert to string as fallback
-                        values.append(str(value))
+    data = {col: profile.distinct_values() for col, profile in profiles.items() if col not in columns_to_exclude}
+    stats = {col: profile.summary() for col, profile in profiles.items()}
+    types = sorted({type_name for profile in profiles.values() for type_name in profile.types})
 
-            # Update data dictionary with unique values
-            if col in data:
-                data[col] = list(set(data[col] + values))
-            else:
-                data[col] = list(set(values))
-
-# Save results
-try:
-    dump_json(list_of_set_of_list(types), 'tests/unique_building_value_types.json')
-    dump_json(data, 'metadata/unique_building_values.json')
-    print("Successfully processed building values and saved results")
-except Exception as e:
-    print(f"Error saving results: {e}")
+    # Save results
+    try:
+        dump_json(types, 'tests/unique_building_value_types.json')
+        dump_json(data, 'metadata/unique_building_values.json')
+        dump_json(stats, 'metadata/building_columns_profile.json')
+        print("Successfully processed building values and saved results")
+    except Exception as e:
+        print(f"Error saving results: {e}")
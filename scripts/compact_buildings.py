@@ -0,0 +1,25 @@
+from importer import *
+from compaction import compact_chunks
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact the dumped building chunks into a partitioned, spatially sorted GeoParquet dataset.')
+    parser.add_argument('--input', '-i', type=str, default='outputs/buildings',
+                        help='Folder of the building chunks (default: outputs/buildings)')
+    parser.add_argument('--manifest', '-m', type=str, default='buildings_manifest.jsonl',
+                        help='Manifest file name, inside the input folder (default: buildings_manifest.jsonl)')
+    parser.add_argument('--output', '-o', type=str, default='outputs/buildings_geoparquet',
+                        help='Folder of the GeoParquet dataset (default: outputs/buildings_geoparquet)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Compact everything again, instead of only the new chunks')
+
+    args = parser.parse_args()
+
+    layer_metadata = read_json(os.path.join(args.input, 'buildings_metadata.json'), None)
+
+    if layer_metadata is None:
+        print(f"No buildings_metadata.json found in {args.input}. Please run the building dumper first.")
+        exit(1)
+
+    summary = compact_chunks(os.path.join(args.input, args.manifest), args.output, layer_metadata, rebuild=args.rebuild)
+    print(summary)
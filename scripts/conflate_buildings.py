@@ -0,0 +1,6 @@
+from importer import *
+from lib.cli import main
+
+if __name__ == '__main__':
+    # `python -m lib conflate`, from outputs/buildings to outputs/buildings_conflation by default
+    sys.exit(main(['conflate', *sys.argv[1:]]))
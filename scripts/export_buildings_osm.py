@@ -0,0 +1,6 @@
+from importer import *
+from lib.cli import main
+
+if __name__ == '__main__':
+    # `python -m lib export`, from outputs/buildings_prepared to outputs/buildings.osc by default
+    sys.exit(main(['export', *sys.argv[1:]]))
@@ -4,15 +4,18 @@ import os
 sys.path.append('.')
 from lib import *
 
-def get_filelist(category, folder='outputs', extension='.geojsonl'):
+# the scripts work in the repository folders and log to logs/global_log.log
+init()
+
+def get_filelist(category, folder='outputs', extension=CHUNK_EXTENSIONS):
     """
     Retrieves a list of files in a directory that match a given category and extension.
 
     Args:
         category (str): The category to search for in the filenames.
         folder (str, optional): The root folder to search in. Defaults to 'outputs'.
-        extension (str, optional): The file extension to filter by.
-                                   Defaults to '.geojsonl'.
+        extension (str or tuple, optional): The file extension(s) to filter by.
+                                            Defaults to CHUNK_EXTENSIONS (plain and compressed chunks).
 
     Returns:
         tuple: A tuple containing:
@@ -38,4 +41,80 @@ def get_filelist(category, folder='outputs', extension='.geojsonl'):
         logging.error(f"Error reading directory {search_path}: {e}")
         raise
     
-    return search_path, filelist
\ No newline at end of file
+    return search_path, filelist
+
+def add_cache_arguments(parser):
+    """
+    Adds the HTTP response cache options to a script's argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser.
+    """
+    parser.add_argument('--cache', action='store_true',
+                        help=f'Cache the server responses on disk (in {HTTP_CACHE_FOLDER}, or --cache-dir)')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help=f'Folder of the response cache, implies --cache (default: {HTTP_CACHE_FOLDER})')
+    parser.add_argument('--cache-ttl', type=float, default=24 * 3600,
+                        help='Maximum age of the cached responses, in seconds (default: one day)')
+    parser.add_argument('--offline', action='store_true',
+                        help='Serve every request from the response cache, failing on misses (implies --cache)')
+
+def setup_cache(args):
+    """
+    Sets the HTTP response cache according to the options of `add_cache_arguments`.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+    """
+    if args.cache or args.cache_dir or args.offline:
+        set_http_cache(ResponseCache(args.cache_dir or HTTP_CACHE_FOLDER, ttl=args.cache_ttl, offline=args.offline))
+
+def add_storage_arguments(parser):
+    """
+    Adds the chunk compression and coordinate rounding options to a script's argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser.
+    """
+    parser.add_argument('--compression', choices=[codec for codec in CHUNK_CODECS if codec], default=None,
+                        help='Compress the chunks (.geojsonl.gz or .geojsonl.zst; default: plain .geojsonl)')
+    parser.add_argument('--precision', type=int, default=None,
+                        help='Round the coordinates to this many decimals before writing them (default: as received; 7 is about 1 cm)')
+
+def add_profile_arguments(parser):
+    """
+    Adds the lighter fetch profile options to a script's argument parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser.
+    """
+    parser.add_argument('--light', action='store_true',
+                        help='Skip the single valued fields of metadata/unique_building_values.json and request protocol buffers if supported')
+    parser.add_argument('--no-pbf', action='store_true',
+                        help='With --light, request JSON even if the layer supports protocol buffers')
+
+def setup_profile(args, unique_values_path='metadata/unique_building_values.json',
+                  column_profiles_path='metadata/building_columns_profile.json'):
+    """
+    Builds the fetch profile according to the options of `add_profile_arguments`.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        unique_values_path (str, optional): The distinct values of each column.
+                                            Defaults to 'metadata/unique_building_values.json'.
+        column_profiles_path (str, optional): The column statistics, telling the exact columns.
+                                              Defaults to 'metadata/building_columns_profile.json'.
+
+    Returns:
+        FetchProfile: The profile, or None without --light.
+    """
+    if not args.light:
+        return None
+
+    column_profiles = read_json(column_profiles_path)
+    if not column_profiles:
+        logging.warning(f"No column profiles in {column_profiles_path}, every field is requested "
+                        "(run scripts/check_unique_building_values.py)")
+
+    return FetchProfile.from_unique_values(read_json(unique_values_path), column_profiles,
+                                           pbf=False if args.no_pbf else None)
@@ -5,8 +5,44 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Dump building data from Geocuritiba portal.')
     parser.add_argument('--output', '-o', type=str, default='outputs/buildings',
                         help='Path to the output directory (default: outputs/buildings)')
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help='If greater than 0, fetch objectid ranges in parallel with this many workers (default: 0, serial)')
+    parser.add_argument('--striped', action='store_true',
+                        help='With --workers, split the ranges between both map servers, failing over between them')
+    parser.add_argument('--page-size', type=int, default=None,
+                        help='Fixed number of features per page (default: adaptive, from the layer maxRecordCount)')
+    parser.add_argument('--target-latency', type=float, default=10.0,
+                        help='Targeted duration of each page request with adaptive pages, in seconds (default: 10)')
+    parser.add_argument('--reprojection', choices=['auto', 'server', 'client'], default='auto',
+                        help='Where to reproject the features to EPSG:4326 (default: auto, whichever a probe finds cheaper)')
+    parser.add_argument('--index', action='store_true',
+                        help='Update the spatial index of the output folder after dumping (see spatial_index.py)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Only check the existing chunks against their manifest, without downloading anything')
     
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+    add_storage_arguments(parser)
+
     args = parser.parse_args()
+    setup_cache(args)
     
-    geojsonl_lazy_dumper('buildings', use_alt=True, outfolderpath=args.output, chunksize=350,
-                         timeout=600)
+    if args.verify:
+        from lib.cli import main
+
+        manifest_name = 'buildings_ranges_manifest.jsonl' if args.workers > 0 else 'buildings_manifest.jsonl'
+        sys.exit(main(['verify', os.path.join(args.output, manifest_name)]))
+
+    if args.workers > 0:
+        geojsonl_parallel_dumper('buildings', use_alt=True, outfolderpath=args.output, chunksize=350,
+                                 max_workers=args.workers, timeout=600, compression=args.compression, precision=args.precision,
+                                 striped=args.striped)
+    else:
+        geojsonl_lazy_dumper('buildings', use_alt=True, outfolderpath=args.output, chunksize=350,
+                             page_size=args.page_size, target_latency=args.target_latency,
+                             profile=setup_profile(args), reprojection=args.reprojection, timeout=600,
+                             compression=args.compression, precision=args.precision)
+
+    if args.index:
+        from spatial_index import update_spatial_index
+        print(update_spatial_index(args.output))
@@ -0,0 +1,6 @@
+from importer import *
+from lib.cli import main
+
+if __name__ == '__main__':
+    # `python -m lib prep`, from outputs/buildings to outputs/buildings_prepared by default
+    sys.exit(main(['prep', *sys.argv[1:]]))
@@ -0,0 +1,6 @@
+from importer import *
+from lib.cli import main
+
+if __name__ == '__main__':
+    # `python -m lib jobs`
+    sys.exit(main(['jobs', *sys.argv[1:]]))
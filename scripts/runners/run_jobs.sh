@@ -0,0 +1,3 @@
+cd $HOME/Curitiba_OSM_Importing_Codebase
+
+$HOME/Curitiba_OSM_Importing_Codebase/.venv/bin/python $HOME/Curitiba_OSM_Importing_Codebase/scripts/run_jobs.py
\ No newline at end of file
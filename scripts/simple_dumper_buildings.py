@@ -1,3 +1,20 @@
 from importer import *
+import argparse
 
-silly_dumper('buildings',outpath='outputs/buildings.parquet',as_geoparquet=True)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dump building data from Geocuritiba portal into a single GeoParquet file.')
+    parser.add_argument('--output', '-o', type=str, default='outputs/buildings.parquet',
+                        help='Path to the output file (default: outputs/buildings.parquet)')
+    parser.add_argument('--batch-size', '-b', type=int, default=0,
+                        help='If greater than 0, stream the features in batches of this size instead of holding the whole layer in memory (default: 0)')
+
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    setup_cache(args)
+
+    if args.batch_size > 0:
+        streaming_dumper('buildings', outpath=args.output, batch_size=args.batch_size)
+    else:
+        silly_dumper('buildings', outpath=args.output, as_geoparquet=True, profile=setup_profile(args))
@@ -0,0 +1,21 @@
+from importer import *
+from sync import incremental_sync
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incrementally sync building data from Geocuritiba portal, writing a changeset.')
+    parser.add_argument('--output', '-o', type=str, default='outputs/buildings_sync',
+                        help='Path to the directory of the sync index and changesets (default: outputs/buildings_sync)')
+    parser.add_argument('--dump', '-d', type=str, default='outputs/buildings',
+                        help='Folder of a full dump, to build the index from on the first run (default: outputs/buildings)')
+    parser.add_argument('--geometry-precision', type=int, default=None,
+                        help='Also compare geometries, rounded to this many decimals (default: attributes only)')
+
+    add_cache_arguments(parser)
+
+    args = parser.parse_args()
+    setup_cache(args)
+
+    summary = incremental_sync('buildings', use_alt=True, outfolderpath=args.output, dump_folderpath=args.dump,
+                               geometry_precision=args.geometry_precision, timeout=600)
+    print(summary)
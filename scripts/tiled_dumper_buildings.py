@@ -0,0 +1,32 @@
+from importer import *
+from tiles import tiled_dumper
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dump building data from Geocuritiba portal, one file per map tile.')
+    parser.add_argument('--output', '-o', type=str, default='outputs/buildings_tiles',
+                        help='Path to the output directory (default: outputs/buildings_tiles)')
+    parser.add_argument('--zoom', '-z', type=int, default=ZOOM_LEVEL,
+                        help=f'Zoom level of the tiles (default: {ZOOM_LEVEL})')
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'),
+                        help='Longitude/latitude box to restrict the dump to (default: the whole layer)')
+    parser.add_argument('--workers', '-w', type=int, default=4,
+                        help='Number of tiles fetched at the same time (default: 4)')
+    parser.add_argument('--index', action='store_true',
+                        help='Update the spatial index of the output folder after dumping (see spatial_index.py)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Download again the tiles that were already downloaded')
+
+    add_cache_arguments(parser)
+    add_storage_arguments(parser)
+
+    args = parser.parse_args()
+    setup_cache(args)
+
+    tiled_dumper('buildings', use_alt=True, outfolderpath=args.output, zoom=args.zoom, bbox=args.bbox,
+                 max_workers=args.workers, refresh=args.refresh, timeout=600,
+                 compression=args.compression, precision=args.precision)
+
+    if args.index:
+        from spatial_index import update_spatial_index
+        print(update_spatial_index(args.output))
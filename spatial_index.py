@@ -0,0 +1,247 @@
+import os, json
+import logging
+
+import numpy as np
+import shapely
+from tqdm import tqdm
+
+from lib.files import listdir_fullpath
+from lib.compression import CHUNK_EXTENSIONS, chunk_codec, read_chunk
+from checker import fastjson
+
+SPATIAL_INDEX_NAME = '_spatial_index.npz'
+
+class SpatialIndex:
+    """
+    Persistent spatial index of the GeoJSONL chunks of a folder: the bbox of every feature,
+    with the chunk file and byte offset of its line, so a box or point query only reads the
+    matching lines instead of every chunk.
+
+    The index is stored as '<folderpath>/_spatial_index.npz' (the feature bboxes, file ids,
+    offsets and lengths, and the size and modification time of each indexed file). `update` is
+    incremental: only new or modified chunks are read, and the entries of the removed ones are
+    dropped, so it can be run after every dump or refresh. Queries go through an STRtree over
+    the bboxes, built when the index is first queried.
+
+    Features without a geometry are not indexed. The offsets of compressed chunks are in their
+    decompressed contents, so a query decompresses the whole chunks it hits.
+
+    Args:
+        folderpath (str): The folder of the chunks.
+        index_path (str, optional): The index file. Defaults to '<folderpath>/_spatial_index.npz'.
+        extension (str or tuple, optional): The extension(s) of the chunk files. Defaults to
+                                            CHUNK_EXTENSIONS (plain and compressed).
+    """
+    def __init__(self, folderpath, index_path=None, extension=CHUNK_EXTENSIONS):
+        self.folderpath = folderpath
+        self.index_path = index_path or os.path.join(folderpath, SPATIAL_INDEX_NAME)
+        self.extension = extension
+
+        self.filenames = []
+        self.file_stats = np.empty((0, 2), dtype=np.int64)
+        self.bounds = np.empty((0, 4), dtype=np.float64)
+        self.file_ids = np.empty(0, dtype=np.int32)
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.lengths = np.empty(0, dtype=np.int64)
+
+        self._tree = None
+
+        if os.path.exists(self.index_path):
+            self._load()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _load(self):
+        try:
+            with np.load(self.index_path) as data:
+                self.filenames = data['filenames'].tolist()
+                self.file_stats = data['file_stats']
+                self.bounds = data['bounds']
+                self.file_ids = data['file_ids']
+                self.offsets = data['offsets']
+                self.lengths = data['lengths']
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning(f"Ignoring the unreadable spatial index {self.index_path}: {e}")
+
+    def _save(self):
+        tmp_path = self.index_path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, filenames=np.array(self.filenames, dtype=str), file_stats=self.file_stats, bounds=self.bounds,
+                     file_ids=self.file_ids, offsets=self.offsets, lengths=self.lengths)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _file_stat(filepath):
+        stat = os.stat(filepath)
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _index_file(filepath):
+        data = read_chunk(filepath)
+
+        lines = data.split(b'\n')
+        lengths = np.array([len(line) for line in lines], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+
+        keep = lengths > 0
+        lines = [line for line, kept in zip(lines, keep) if kept]
+
+        # one vectorized GEOS parse of the whole file; features without a geometry get NaN bounds
+        geometries = shapely.from_geojson([line.decode('utf-8') for line in lines], on_invalid='ignore')
+        bounds = shapely.bounds(geometries)
+
+        located = ~np.isnan(bounds).any(axis=1)
+
+        return bounds[located], offsets[keep][located], lengths[keep][located]
+
+    def update(self, rebuild=False):
+        """
+        Indexes the new and modified chunks of the folder, and forgets the removed ones.
+
+        Args:
+            rebuild (bool, optional): Whether to index every chunk again. Defaults to False.
+
+        Returns:
+            dict: A summary with the number of indexed, unchanged and removed chunks, and the
+                  number of features in the index.
+        """
+        current = {os.path.basename(filepath): self._file_stat(filepath)
+                   for filepath in listdir_fullpath(self.folderpath, extension=self.extension)}
+
+        indexed = {} if rebuild else {filename: tuple(stats) for filename, stats in zip(self.filenames, self.file_stats.tolist())}
+        unchanged = [filename for filename, stats in indexed.items() if current.get(filename) == stats]
+        to_index = sorted(set(current) - set(unchanged))
+        n_removed = sum(1 for filename in indexed if filename not in current)
+
+        if not to_index and not n_removed and not rebuild:
+            return {'n_indexed': 0, 'n_unchanged': len(unchanged), 'n_removed': 0, 'n_features': len(self)}
+
+        # the entries of the unchanged files are kept, with their file ids renumbered
+        ids_by_name = {filename: i for i, filename in enumerate(self.filenames)}
+        old_ids = np.array([ids_by_name[filename] for filename in unchanged], dtype=np.int32)
+        kept = np.isin(self.file_ids, old_ids) if len(old_ids) else np.zeros(len(self), dtype=bool)
+        renumbering = np.full(len(self.filenames), -1, dtype=np.int32)
+        renumbering[old_ids] = np.arange(len(old_ids), dtype=np.int32)
+
+        bounds = [self.bounds[kept]]
+        file_ids = [renumbering[self.file_ids[kept]]]
+        offsets = [self.offsets[kept]]
+        lengths = [self.lengths[kept]]
+        filenames = list(unchanged)
+
+        for filename in tqdm(to_index, desc='indexing chunks'):
+            file_bounds, file_offsets, file_lengths = self._index_file(os.path.join(self.folderpath, filename))
+
+            bounds.append(file_bounds)
+            file_ids.append(np.full(len(file_offsets), len(filenames), dtype=np.int32))
+            offsets.append(file_offsets)
+            lengths.append(file_lengths)
+            filenames.append(filename)
+
+        self.filenames = filenames
+        self.file_stats = np.array([current[filename] for filename in filenames], dtype=np.int64).reshape(-1, 2)
+        self.bounds = np.concatenate(bounds)
+        self.file_ids = np.concatenate(file_ids)
+        self.offsets = np.concatenate(offsets)
+        self.lengths = np.concatenate(lengths)
+        self._tree = None
+
+        self._save()
+
+        return {'n_indexed': len(to_index), 'n_unchanged': len(unchanged), 'n_removed': n_removed, 'n_features': len(self)}
+
+    @property
+    def tree(self):
+        """
+        shapely.STRtree: The tree of the feature bboxes, built on first use.
+        """
+        if self._tree is None:
+            self._tree = shapely.STRtree(shapely.box(*self.bounds.T))
+        return self._tree
+
+    def _read(self, positions):
+        # sorted by file and offset, so each chunk is opened once and read forwards
+        positions = positions[np.lexsort((self.offsets[positions], self.file_ids[positions]))]
+        lines = []
+
+        for file_id in np.unique(self.file_ids[positions]):
+            in_file = positions[self.file_ids[positions] == file_id]
+            filepath = os.path.join(self.folderpath, self.filenames[file_id])
+            spans = zip(self.offsets[in_file].tolist(), self.lengths[in_file].tolist())
+
+            if chunk_codec(filepath):
+                data = read_chunk(filepath)
+                lines.extend(data[offset:offset + length] for offset, length in spans)
+                continue
+
+            with open(filepath, 'rb') as f:
+                for offset, length in spans:
+                    f.seek(offset)
+                    lines.append(f.read(length))
+
+        return lines
+
+    def _query(self, geometry, exact):
+        positions = self.tree.query(geometry)
+
+        if not len(positions):
+            return []
+
+        lines = self._read(positions)
+
+        if exact:
+            geometries = shapely.from_geojson([line.decode('utf-8') for line in lines], on_invalid='ignore')
+            lines = [line for line, hit in zip(lines, shapely.intersects(geometries, geometry)) if hit]
+
+        return [fastjson.loads(line) for line in lines]
+
+    def query_bbox(self, bbox, exact=True):
+        """
+        Reads the features intersecting a box.
+
+        Args:
+            bbox (tuple): The (xmin, ymin, xmax, ymax) box, in the coordinates of the chunks
+                          (longitude/latitude, for the dumpers' output).
+            exact (bool, optional): Whether to test the geometries themselves, not only their
+                                    bboxes. Defaults to True.
+
+        Returns:
+            list: The GeoJSON features, ordered by chunk and line.
+        """
+        if len(bbox) != 4:
+            raise ValueError("bbox must be (xmin, ymin, xmax, ymax)")
+
+        return self._query(shapely.box(*bbox), exact)
+
+    def query_point(self, x, y, exact=True):
+        """
+        Reads the features containing (or touching) a point.
+
+        Args:
+            x (float): The x coordinate (longitude).
+            y (float): The y coordinate (latitude).
+            exact (bool, optional): Whether to test the geometries themselves, not only their
+                                    bboxes. Defaults to True.
+
+        Returns:
+            list: The GeoJSON features, ordered by chunk and line.
+        """
+        return self._query(shapely.Point(x, y), exact)
+
+def update_spatial_index(folderpath, rebuild=False):
+    """
+    Creates or updates the spatial index of a folder of chunks (see SpatialIndex).
+
+    Args:
+        folderpath (str): The folder of the chunks.
+        rebuild (bool, optional): Whether to index every chunk again. Defaults to False.
+
+    Returns:
+        dict: The summary of SpatialIndex.update.
+    """
+    summary = SpatialIndex(folderpath).update(rebuild=rebuild)
+    logging.info(f"Spatial index of {folderpath}: {json.dumps(summary)}")
+
+    return summary
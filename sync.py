@@ -0,0 +1,247 @@
+from lib import *
+
+from datetime import datetime, timezone
+
+def feature_hash(feature, hash_fields=None, geometry_precision=None):
+    """
+    Computes a compact fingerprint of a feature, out of its attributes and, optionally, geometry.
+
+    Args:
+        feature (dict): A GeoJSON feature.
+        hash_fields (list, optional): The attributes taken into account. Defaults to None (all).
+        geometry_precision (int, optional): If given, the geometry is also taken into account,
+                                            with its coordinates rounded to this many decimals.
+                                            Defaults to None.
+
+    Returns:
+        int: A signed 64 bit hash.
+    """
+    properties = feature.get('properties') or {}
+
+    if hash_fields:
+        properties = {field: properties.get(field) for field in hash_fields}
+
+    payload = [properties]
+
+    if geometry_precision is not None:
+        def rounded(coords):
+            if isinstance(coords, list):
+                return [rounded(c) for c in coords]
+            return round(coords, geometry_precision)
+
+        geometry = feature.get('geometry') or {}
+        payload.append(rounded(geometry.get('coordinates')))
+
+    digest = hashlib.blake2b(json.dumps(payload, sort_keys=True).encode('utf-8'), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'little', signed=True)
+
+class SyncIndex:
+    """
+    Compact objectid -> feature hash index of a layer, stored as a two-column Parquet file.
+
+    The parquet metadata also keeps the settings the hashes were computed with, as hashes made
+    with other settings can't be compared.
+
+    Args:
+        path (str): The path of the index file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        self.settings = None
+
+        if os.path.exists(path):
+            table = pq.read_table(path)
+            self.hashes = dict(zip(table.column('objectid').to_pylist(), table.column('hash').to_pylist()))
+
+            metadata = table.schema.metadata or {}
+            if b'sync_settings' in metadata:
+                self.settings = json.loads(metadata[b'sync_settings'])
+
+    def save(self, settings):
+        """
+        Writes the index (to '<path>.tmp', then renamed), along with the hashing settings.
+
+        Args:
+            settings (dict): The settings the hashes were computed with.
+        """
+        self.settings = settings
+
+        table = pa.table({
+            'objectid': pa.array(list(self.hashes.keys()), type=pa.int64()),
+            'hash': pa.array(list(self.hashes.values()), type=pa.int64()),
+        })
+        table = table.replace_schema_metadata({'sync_settings': json.dumps(settings)})
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            create_dir(directory)
+
+        pq.write_table(table, self.path + '.tmp')
+        os.replace(self.path + '.tmp', self.path)
+
+def sync_settings(layer_metadata, geometry_precision=None):
+    """
+    Chooses which fields to fingerprint features with.
+
+    If the layer tracks edits, its edit date field alone is enough; otherwise every attribute
+    is hashed (the buildings layer carries x_coord/y_coord, so moved features are detected
+    even without the geometry).
+
+    Args:
+        layer_metadata (dict): The layer's metadata.
+        geometry_precision (int, optional): The geometry hashing precision, see `feature_hash`.
+                                            Defaults to None (no geometry).
+
+    Returns:
+        dict: The 'hash_fields' (None for all) and 'geometry_precision' settings.
+    """
+    edit_date_field = (layer_metadata.get('editFieldsInfo') or {}).get('editDateField')
+
+    return {
+        'hash_fields': [edit_date_field] if edit_date_field else None,
+        'geometry_precision': geometry_precision,
+    }
+
+def build_sync_index(chunk_filepaths, index_path, settings, oid_field='objectid'):
+    """
+    Builds a sync index out of an existing full dump (e.g. from `geojsonl_lazy_dumper`).
+
+    Args:
+        chunk_filepaths (list): The GeoJSONL chunks of the dump.
+        index_path (str): The path of the index to write.
+        settings (dict): The hashing settings, as returned by `sync_settings`.
+        oid_field (str, optional): The name of the objectid field. Defaults to 'objectid'.
+
+    Returns:
+        SyncIndex: The new index.
+    """
+    index = SyncIndex(index_path)
+    index.hashes = {}
+
+    for filepath in tqdm(chunk_filepaths):
+        for line in iter_chunk_lines(filepath):
+            feature = json.loads(line)
+            index.hashes[feature['properties'][oid_field]] = feature_hash(feature, settings['hash_fields'], settings['geometry_precision'])
+
+    index.save(settings)
+
+    return index
+
+def incremental_sync(layername, use_alt=False, outfolderpath=None, dump_folderpath=None, geometry_precision=None, page_size=1000, ids_per_request=200, timeout=None):
+    """
+    Refreshes a layer incrementally, writing a changeset instead of downloading it again.
+
+    Only objectids and the hash-relevant fields (the edit date, if the layer has one, or the
+    attributes without geometry) are listed from the server, page by page through a
+    CheckpointedPager (so with the retries, back-off, host budget and metrics of the dumpers). They are compared with the local
+    index; the full features are then downloaded only for new or changed objectids, by
+    batches of `ids_per_request` ('objectid IN (...)' pages), and the objectids that vanished
+    are emitted as deletions.
+
+    The changeset is a GeoJSONL file ('<layername>_changeset_<UTC timestamp>.geojsonl') with one
+    line per change: {"action": "create"|"modify"|"delete", "objectid": ..., "feature": ...},
+    where "feature" is null for deletions. The index is only updated after the changeset has
+    been committed.
+
+    If there is no index yet it is built from the chunks of `dump_folderpath`, the output of a
+    previous full dump; without it every feature is reported as created.
+
+    Args:
+        layername (str): The name of the layer to sync.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        outfolderpath (str, optional): The directory for the index and the changesets.
+                                       Defaults to None.
+        dump_folderpath (str, optional): The folder of a full GeoJSONL dump of the layer, to
+                                         bootstrap the index from. Defaults to None.
+        geometry_precision (int, optional): If given, geometries are also compared, with their
+                                            coordinates rounded to this many decimals (it costs
+                                            downloading the geometries for the listing).
+                                            Defaults to None.
+        page_size (int, optional): The number of features per page of the listing.
+                                   Defaults to 1000.
+        ids_per_request (int, optional): The number of objectids per request when downloading
+                                         the changed features. Defaults to 200.
+        timeout (int, optional): The timeout for the HTTP requests. Defaults to None.
+
+    Returns:
+        dict: A summary with the changeset path and the count of each action.
+
+    Raises:
+        ValueError: If layername is empty, outfolderpath is None, or the index was built
+                    with other hashing settings.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+
+    if outfolderpath is None:
+        raise ValueError("outfolderpath cannot be None")
+
+    create_dir(outfolderpath)
+
+    # the metadata is requested once, the pagers only use the URL and query settings of the dumpers
+    layer_url = get_layer_url(layername, use_alt=use_alt)
+    d = EsriDumper(layer_url, timeout=timeout)
+    layer_metadata = d.get_metadata()
+    oid_field = d._find_oid_field_name(layer_metadata) or 'objectid'
+    settings = sync_settings(layer_metadata, geometry_precision=geometry_precision)
+
+    index_path = os.path.join(outfolderpath, f'{layername}_sync_index.parquet')
+    index = SyncIndex(index_path)
+
+    if index.settings is None and dump_folderpath:
+        logging.info(f"Building the sync index of {layername} from {dump_folderpath}")
+        index = build_sync_index(listdir_fullpath(dump_folderpath, extension=CHUNK_EXTENSIONS), index_path, settings, oid_field=oid_field)
+
+    if index.settings is not None and index.settings != settings:
+        raise ValueError(f"The index {index_path} was built with {index.settings}, not {settings}; rebuild it from a full dump")
+
+    # listing: objectids plus the hash-relevant fields only
+    listing_fields = [oid_field] + settings['hash_fields'] if settings['hash_fields'] else None
+    listing_d = EsriDumper(layer_url, fields=listing_fields, request_geometry=geometry_precision is not None,
+                           geometry_precision=geometry_precision, timeout=timeout)
+    listing = CheckpointedPager(listing_d, oid_field, layer_metadata, page_size=page_size)
+
+    current = {}
+    for feature in tqdm(listing, desc='listing'):
+        current[feature['properties'][oid_field]] = feature_hash(feature, settings['hash_fields'], geometry_precision)
+
+    created = [oid for oid in current if oid not in index.hashes]
+    modified = [oid for oid in current if oid in index.hashes and index.hashes[oid] != current[oid]]
+    deleted = [oid for oid in index.hashes if oid not in current]
+
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    changeset_path = os.path.join(outfolderpath, f'{layername}_changeset_{timestamp}.geojsonl')
+
+    actions = {oid: 'create' for oid in created}
+    actions.update({oid: 'modify' for oid in modified})
+    to_download = sorted(actions)
+
+    with ChunkWriter(changeset_path) as writer:
+        for i in tqdm(range(0, len(to_download), ids_per_request), desc='downloading'):
+            batch = to_download[i:i + ids_per_request]
+            where = f"{oid_field} IN ({','.join(str(oid) for oid in batch)})"
+
+            for feature in CheckpointedPager(d, oid_field, layer_metadata, page_size=ids_per_request, where=where):
+                oid = feature['properties'][oid_field]
+                writer.write(json.dumps({'action': actions[oid], 'objectid': oid, 'feature': feature}) + '\n')
+
+        for oid in deleted:
+            writer.write(json.dumps({'action': 'delete', 'objectid': oid, 'feature': None}) + '\n')
+
+    index.hashes = current
+    index.save(settings)
+
+    summary = {
+        'changeset': changeset_path,
+        'create': len(created),
+        'modify': len(modified),
+        'delete': len(deleted),
+        'unchanged': len(current) - len(created) - len(modified),
+    }
+
+    logging.info(f"Sync of {layername}: {summary}")
+
+    return summary
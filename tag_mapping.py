@@ -0,0 +1,188 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_TAG_MAPPING_PATH = 'metadata/buildings_tag_mapping.json'
+
+RULE_KEYS = {'field', 'tag', 'values', 'type', 'decimals', 'min', 'max', 'ignore', 'pattern', 'replace'}
+
+RULE_TYPES = ('string', 'integer', 'number')
+
+def check_tag_mapping(mapping):
+    """
+    Checks a tag mapping specification (see `read_tag_mapping`).
+
+    Args:
+        mapping (dict): The specification.
+
+    Raises:
+        ValueError: If it is malformed.
+    """
+    if not isinstance(mapping.get('tags', {}), dict):
+        raise ValueError("The 'tags' of the tag mapping must be a {key: value} object")
+
+    rules = mapping.get('rules')
+    if not isinstance(rules, list):
+        raise ValueError("The tag mapping needs a list of 'rules'")
+
+    for i, rule in enumerate(rules):
+        if not rule.get('field') or not rule.get('tag'):
+            raise ValueError(f"Rule {i} of the tag mapping needs a 'field' and a 'tag'")
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)} in rule {i} of the tag mapping, expected some of {sorted(RULE_KEYS)}")
+        if rule.get('type', 'string') not in RULE_TYPES:
+            raise ValueError(f"Unknown type '{rule['type']}' in rule {i} of the tag mapping, must be one of {list(RULE_TYPES)}")
+        if ('pattern' in rule) != ('replace' in rule):
+            raise ValueError(f"Rule {i} of the tag mapping needs both a 'pattern' and a 'replace'")
+
+def read_tag_mapping(path=DEFAULT_TAG_MAPPING_PATH):
+    """
+    Reads a declarative attribute to OSM tag mapping.
+
+    The specification is a JSON object with:
+        - tags (object, optional): Tags set on every feature, e.g. {"building": "yes"}.
+        - rules (list): The rules, applied in order, each setting one tag from one field. A rule
+                        overrides the tag of the previous rules (and of `tags`) only where it
+                        gives a value, so the most specific sources go last. Its keys:
+            - field (str): The attribute.
+            - tag (str): The OSM key.
+            - values (object, optional): The lookup table from the attribute values (as text,
+                                         e.g. "3" for coded values) to the tag values; the
+                                         values not listed give no tag. Without it, the value
+                                         itself is the tag value.
+            - type (str, optional): 'string' (default), 'integer' or 'number', the last two
+                                    parsing the value first (non-numbers give no tag).
+            - decimals (int, optional): The decimals of 'number' values.
+            - min, max (float, optional): The range of the numeric values kept.
+            - ignore (list, optional): Attribute values giving no tag (e.g. placeholders).
+            - pattern, replace (str, optional): A regular expression substitution applied to
+                                                the tag values.
+
+    Args:
+        path (str, optional): The path of the JSON file. Defaults to DEFAULT_TAG_MAPPING_PATH.
+
+    Returns:
+        dict: The specification.
+
+    Raises:
+        ValueError: If it is malformed.
+    """
+    with open(path, encoding='utf-8') as f:
+        mapping = json.load(f)
+
+    check_tag_mapping(mapping)
+
+    return mapping
+
+def column_text(column):
+    """
+    Converts an attribute column to text, integral numbers without decimals (9999.0 -> '9999',
+    as a column of integers with nulls is read as floats).
+
+    Args:
+        column (pd.Series): The attribute values.
+
+    Returns:
+        pd.Series: The values as str, missing for the null and empty ones.
+    """
+    text = pd.Series(None, index=column.index, dtype=object)
+    present = column.notna().to_numpy()
+
+    if pd.api.types.is_bool_dtype(column):
+        text[present] = np.where(column[present].to_numpy(dtype=bool), 'yes', 'no')
+    elif pd.api.types.is_numeric_dtype(column):
+        values = column[present].to_numpy(dtype=float)
+        integral = np.isfinite(values) & (values % 1 == 0)
+        text[present] = np.where(integral, values.round().astype(np.int64).astype(str), values.astype(str))
+    else:
+        text[present] = column[present].astype(str).str.strip()
+        text[text == ''] = None
+
+    return text
+
+def map_column(column, rule):
+    """
+    Computes the tag values given by a rule, for a whole column.
+
+    Args:
+        column (pd.Series): The attribute values.
+        rule (dict): The rule (see `read_tag_mapping`).
+
+    Returns:
+        pd.Series: The tag values, missing where the rule gives none.
+    """
+    text = column_text(column)
+
+    if rule.get('ignore'):
+        text[text.isin([str(value) for value in rule['ignore']])] = None
+
+    rule_type = rule.get('type', 'string')
+
+    if rule_type != 'string':
+        numbers = pd.to_numeric(text, errors='coerce')
+        keep = numbers.notna()
+        if 'min' in rule:
+            keep &= numbers >= rule['min']
+        if 'max' in rule:
+            keep &= numbers <= rule['max']
+
+        text = pd.Series(None, index=column.index, dtype=object)
+        if rule_type == 'integer':
+            text[keep] = numbers[keep].round().astype(np.int64).astype(str)
+        else:
+            # '12.0' -> '12'
+            text[keep] = numbers[keep].round(rule.get('decimals', 2)).astype(str).str.replace(r'\.0+$', '', regex=True)
+
+    if 'values' in rule:
+        text = text.map(rule['values']).astype(object)
+
+    if 'pattern' in rule:
+        present = text.notna()
+        text[present] = text[present].str.replace(re.compile(rule['pattern']), rule['replace'], regex=True)
+
+    return text
+
+def apply_tag_mapping(frame, mapping):
+    """
+    Computes the OSM tags of a batch of features, column by column.
+
+    Rules on fields missing from the batch (e.g. not requested from the server) give no tags.
+
+    Args:
+        frame (pd.DataFrame): The attributes of the features, one row each.
+        mapping (dict): The specification (see `read_tag_mapping`).
+
+    Returns:
+        pd.DataFrame: The tags, one column per key in the order they first appear in the
+                      specification, missing where a feature has no such tag.
+    """
+    tags = {key: pd.Series(str(value), index=frame.index, dtype=object) for key, value in mapping.get('tags', {}).items()}
+
+    for rule in mapping['rules']:
+        if rule['field'] not in frame.columns:
+            tags.setdefault(rule['tag'], pd.Series(None, index=frame.index, dtype=object))
+            continue
+
+        values = map_column(frame[rule['field']], rule)
+        previous = tags.get(rule['tag'])
+        tags[rule['tag']] = values if previous is None else values.where(values.notna(), previous)
+
+    return pd.DataFrame(tags, index=frame.index)
+
+def tag_rows(tags):
+    """
+    Splits the tags of a batch (from `apply_tag_mapping`) by feature.
+
+    Args:
+        tags (pd.DataFrame): The tags.
+
+    Returns:
+        list: The {key: value} tags of each feature.
+    """
+    keys = list(tags.columns)
+
+    # the tag values are strings, and the missing ones None or NaN
+    return [{key: value for key, value in zip(keys, row) if isinstance(value, str)} for row in tags.to_numpy(dtype=object)]
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules of the repository and the fake map server of the benchmarks
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from constants import LAYER_IDS
+from fake_arcgis import FakeArcGISServer, use_fake_server
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """
+    Starts fake map servers for the tests: `fake_server(main, alt=None)` serves the FakeLayer
+    `main` as the buildings layer, and `alt` (or `main`) as the alternative one, and points
+    lib's dumpers to it. The metadata and unique values files are read from the repository root.
+    """
+    import lib.esri
+
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(lib.esri, 'MAPSERVER_URL', lib.esri.MAPSERVER_URL)
+    monkeypatch.setattr(lib.esri, 'MAPSERVER_URL_ALT', lib.esri.MAPSERVER_URL_ALT)
+    monkeypatch.setattr(lib.esri.EsriDumper, 'pause_seconds', lib.esri.EsriDumper.pause_seconds)
+    monkeypatch.setattr(lib.esri, 'HTTP_CACHE', None)
+
+    servers = []
+
+    def start(main, alt=None):
+        server = FakeArcGISServer({LAYER_IDS['buildings']: main, LAYER_IDS['buildings_alt']: alt or main}).start()
+        servers.append(server)
+        use_fake_server(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.stop()
@@ -0,0 +1,31 @@
+import json
+
+from checker import extract_oids, check_objectids
+
+def chunk(oids):
+    return ''.join(json.dumps({'type': 'Feature', 'geometry': None, 'properties': {} if oid is ... else {'objectid': oid}}) + '\n'
+                   for oid in oids).encode('utf-8')
+
+def test_features_without_objectid_are_left_out():
+    oids, has_oid = extract_oids(chunk([1, None, 3, ..., 5]))
+
+    assert oids.tolist() == [1, 3, 5]
+    assert has_oid.tolist() == [True, False, True, False, True]
+
+def test_check_reports_the_features_without_objectid(tmp_path):
+    (tmp_path / 'buildings_chunk_0.geojsonl').write_bytes(chunk([1, 2, 3]))
+    (tmp_path / 'buildings_chunk_1.geojsonl').write_bytes(chunk([4, None, 5]))
+
+    filepaths = [str(tmp_path / f'buildings_chunk_{i}.geojsonl') for i in range(2)]
+    registry_path = str(tmp_path / 'registry.json')
+    ids_cache_path = str(tmp_path / 'ids.npz')
+
+    for _ in range(2):
+        report = check_objectids(filepaths, registry_path=registry_path, ids_cache_path=ids_cache_path, max_workers=1)
+
+        assert report['n_ids'] == 5 and report['n_missing_ids'] == 0
+        assert report['n_no_oid'] == 1
+        assert report['no_oid'] == [{'file': 'buildings_chunk_1.geojsonl', 'count': 1}]
+
+    # the file without problems comes from the cache, the other one is checked again
+    assert report['n_files_parsed'] == 1
@@ -0,0 +1,202 @@
+import glob
+import json
+import re
+
+import pytest
+import requests
+
+from fake_arcgis import FakeLayer
+from http_cache import CacheMissError, ResponseCache
+from lib.chunks import ChunkManifest
+from lib.compression import iter_chunk_lines
+from lib.dumpers import geojsonl_lazy_dumper
+from lib.esri import EsriDumper, TransientDownloadError, PermanentDownloadError, get_layer_url, parse_esri_response
+import lib.esri
+import lib.paging
+
+LOWER_WHERE = re.compile(r'objectid > (\d+)')
+WINDOW_WHERE = re.compile(r'objectid > (\d+) AND objectid <= (\d+)')
+
+def page_lower(query):
+    """
+    The objectid a keyset page starts after (None for the first one), or False for the other queries.
+    """
+    if not query.get('orderByFields'):
+        return False
+    match = LOWER_WHERE.search(query.get('where') or '')
+    return int(match.group(1)) if match else None
+
+def read_chunks(folderpath):
+    # the registered chunks and the last one, which is kept unregistered
+    return [json.loads(line)['properties']['objectid']
+            for path in glob.glob(f'{folderpath}/buildings_chunk_*.geojsonl') for line in iter_chunk_lines(path)]
+
+def dump(folderpath):
+    return geojsonl_lazy_dumper('buildings', outfolderpath=str(folderpath), chunksize=200, page_size=100,
+                                reprojection='server', timeout=1)
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # the retries are under test, not the pauses between them
+    monkeypatch.setattr(lib.paging.AdaptiveBackoff, 'delay', lambda self, *args, **kwargs: 0)
+
+def response(status, body):
+    r = requests.Response()
+    r.status_code = status
+    r._content = body
+    return r
+
+@pytest.mark.parametrize('status, body, error_class', [
+    (503, b'', TransientDownloadError),
+    (429, b'', TransientDownloadError),
+    (400, b'', PermanentDownloadError),
+    (200, b'{"features": [{"attributes"', TransientDownloadError),
+    (200, b'{"error": {"code": 504, "message": "timeout"}}', TransientDownloadError),
+    (200, b'{"error": {"code": 400, "message": "Invalid query"}}', PermanentDownloadError),
+])
+def test_parse_esri_response_classifies_failures(status, body, error_class):
+    with pytest.raises(error_class):
+        parse_esri_response(response(status, body))
+
+def test_transient_failures_resume_from_the_checkpoint(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1500, gap_rate=0.2, max_record_count=100)
+    fake_server(layer)
+
+    script = {2: 503, 4: 'timeout', 6: 'truncated', 8: 200}
+    pages = []
+
+    def faults(query):
+        lower = page_lower(query)
+        if lower is False:
+            return None
+        fault = script.get(len(pages))
+        pages.append((lower, fault))
+        return fault
+
+    layer.faults = faults
+    stats = dump(tmp_path)
+
+    assert stats['n_retries'] == len(script)
+    # each failed page is requested again from the same objectid
+    for (lower, fault), (next_lower, _) in zip(pages, pages[1:]):
+        if fault is not None:
+            assert next_lower == lower
+
+    oids = read_chunks(tmp_path)
+    assert sorted(oids) == layer.oids.tolist()
+    assert len(oids) == len(set(oids))
+
+def test_permanent_failure_stops_and_next_run_resumes_after_the_manifest(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1500, gap_rate=0.2, max_record_count=100)
+    fake_server(layer)
+
+    threshold = int(layer.oids[650])
+    failed = []
+
+    def faults(query):
+        lower = page_lower(query)
+        if lower is not False and lower is not None and lower > threshold:
+            failed.append(lower)
+            return 400
+        return None
+
+    layer.faults = faults
+
+    with pytest.raises(PermanentDownloadError):
+        dump(tmp_path)
+
+    # max_permanent_attempts (2) attempts of the same page
+    assert len(failed) == 2 and len(set(failed)) == 1
+
+    manifest = ChunkManifest(f'{tmp_path}/buildings_manifest.jsonl')
+    highest = max(entry['oid_range'][1] for entry in manifest.entries)
+    assert manifest.n_features == 600
+
+    lowers = []
+
+    def spy(query):
+        lower = page_lower(query)
+        if lower is not False:
+            lowers.append(lower)
+
+    layer.faults = spy
+    dump(tmp_path)
+
+    assert lowers[0] == highest
+    oids = read_chunks(tmp_path)
+    assert sorted(oids) == layer.oids.tolist()
+    assert len(oids) == len(set(oids))
+
+@pytest.mark.parametrize('order_by', [True, False])
+def test_windows_resume_without_skipping_features(fake_server, tmp_path, order_by):
+    # no pagination: objectid windows, answered in reverse order unless ordered by objectid
+    layer = FakeLayer(n_features=1500, gap_rate=0.2, max_record_count=100, pagination=False, order_by=order_by, unordered=True)
+    fake_server(layer)
+
+    threshold = int(layer.oids[650])
+    windows = []
+
+    def faults(query):
+        match = WINDOW_WHERE.search(query.get('where') or '')
+        if match:
+            windows.append(query.get('orderByFields'))
+            if int(match.group(1)) > threshold:
+                return 400
+        return None
+
+    layer.faults = faults
+
+    with pytest.raises(PermanentDownloadError):
+        dump(tmp_path)
+
+    assert windows and all(bool(order) == order_by for order in windows)
+
+    layer.faults = None
+    dump(tmp_path)
+
+    oids = read_chunks(tmp_path)
+    assert sorted(oids) == layer.oids.tolist()
+    assert len(oids) == len(set(oids))
+
+def test_migrated_legacy_chunks_resume_by_offset(fake_server, tmp_path):
+    # esridump paged by offset without any order: the first chunks hold objectids from all over the layer
+    layer = FakeLayer(n_features=1500, gap_rate=0.2, max_record_count=100, unordered=True)
+    fake_server(layer)
+
+    legacy_features = iter(EsriDumper(get_layer_url('buildings')))
+    registry = []
+    for j in range(2):
+        path = tmp_path / f'buildings_chunk_{j}.geojsonl'
+        path.write_text(''.join(json.dumps(next(legacy_features)) + '\n' for _ in range(200)), encoding='utf-8')
+        registry.append(str(path))
+    (tmp_path / 'buildings_downloaded_registry.txt').write_text('\n'.join(registry) + '\n', encoding='utf-8')
+
+    dump(tmp_path)
+
+    manifest = ChunkManifest(f'{tmp_path}/buildings_manifest.jsonl')
+    assert all(entry['paging'] == 'offset' for entry in manifest.entries)
+
+    oids = read_chunks(tmp_path)
+    assert sorted(oids) == layer.oids.tolist()
+    assert len(oids) == len(set(oids))
+
+def test_offline_cache_miss_fails_without_retries(fake_server, tmp_path, monkeypatch):
+    layer = FakeLayer(n_features=500, gap_rate=0.2, max_record_count=100)
+    fake_server(layer)
+
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    monkeypatch.setattr(lib.esri, 'HTTP_CACHE', cache)
+    dump(tmp_path / 'online')
+
+    delays = []
+    monkeypatch.setattr(lib.paging.AdaptiveBackoff, 'delay', lambda self, *args, **kwargs: delays.append(args) or 0)
+    cache.offline = True
+    misses = cache.misses
+
+    # the metadata is cached, the pages of another size are not
+    with pytest.raises(CacheMissError):
+        geojsonl_lazy_dumper('buildings', outfolderpath=str(tmp_path / 'offline'), chunksize=200, page_size=50,
+                             reprojection='server', timeout=1)
+
+    assert cache.misses == misses + 1
+    assert delays == []
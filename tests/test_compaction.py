@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from fake_arcgis import FakeLayer
+from compaction import compact_chunks, read_compacted_bbox
+from lib.dumpers import geojsonl_lazy_dumper
+
+WORLD = (-180, -90, 180, 90)
+
+@pytest.fixture
+def dump(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1000, gap_rate=0.1, max_record_count=100)
+    fake_server(layer)
+
+    geojsonl_lazy_dumper('buildings', outfolderpath=str(tmp_path / 'dump'), chunksize=200, page_size=100)
+    with open(tmp_path / 'dump' / 'buildings_metadata.json', encoding='utf-8') as f:
+        layer_metadata = json.load(f)
+
+    return str(tmp_path / 'dump' / 'buildings_manifest.jsonl'), layer_metadata
+
+def test_read_compacted_bbox_always_reads_the_geometry(dump, tmp_path):
+    manifest_path, layer_metadata = dump
+    compact_chunks(manifest_path, str(tmp_path / 'compacted'), layer_metadata)
+
+    everything = read_compacted_bbox(str(tmp_path / 'compacted'), WORLD)
+    gdf = read_compacted_bbox(str(tmp_path / 'compacted'), WORLD, columns=['objectid'])
+
+    assert list(gdf.columns) == ['objectid', 'geometry']
+    assert len(gdf) == len(everything) > 0
+    assert gdf.geometry.notna().all()
+
+def test_failed_compaction_is_not_published_twice(dump, tmp_path, monkeypatch):
+    manifest_path, layer_metadata = dump
+    outfolderpath = str(tmp_path / 'compacted')
+
+    replace = os.replace
+    published = []
+
+    def fail_after_one_part(src, dst):
+        if 'geohash=' in dst:
+            if published:
+                raise OSError('disk full')
+            published.append(dst)
+        return replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', fail_after_one_part)
+    with pytest.raises(OSError):
+        compact_chunks(manifest_path, outfolderpath, layer_metadata, geohash_precision=3)
+    monkeypatch.setattr(os, 'replace', replace)
+
+    assert len(published) == 1 and os.path.exists(published[0])
+
+    summary = compact_chunks(manifest_path, outfolderpath, layer_metadata, geohash_precision=3)
+    gdf = read_compacted_bbox(outfolderpath, WORLD)
+
+    assert summary['n_partitions'] > 1
+    assert not os.path.exists(published[0])
+    assert len(gdf) == summary['n_features']
+    assert gdf['objectid'].is_unique
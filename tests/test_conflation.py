@@ -0,0 +1,98 @@
+import json
+
+import numpy as np
+import pytest
+
+from conflation import conflate
+from osm_pbf import PbfWriter
+
+X, Y, D = -49.27, -25.43, 0.0001
+
+def square(x, y, d=D):
+    return [[x, y], [x + d, y], [x + d, y + d], [x, y + d], [x, y]]
+
+class OsmExtract:
+    """
+    The elements of a small .osm.pbf extract, with positive ids.
+    """
+    def __init__(self):
+        self.nodes, self.ways, self.relations = [], [], []
+
+    def way(self, ring, tags):
+        refs = []
+        for lon, lat in ring[:-1]:
+            self.nodes.append((len(self.nodes) + 1, round(lon * 1e7), round(lat * 1e7)))
+            refs.append(len(self.nodes))
+        way_id = 100 + len(self.ways)
+        self.ways.append((way_id, refs + refs[:1], tags))
+        return way_id
+
+    def relation(self, outer, inner, tags):
+        members = [self.way(outer, {}), self.way(inner, {})]
+        self.relations.append((200 + len(self.relations), members, tags))
+
+    def write(self, path):
+        with PbfWriter(path) as writer:
+            ids, lons, lats = (np.array(values, dtype=np.int64) for values in zip(*self.nodes))
+            writer.write_nodes(ids, lons, lats)
+            writer.write_ways(np.array([way[0] for way in self.ways]), np.array([ref for way in self.ways for ref in way[1]]),
+                              np.array([len(way[1]) for way in self.ways]), [way[2] for way in self.ways])
+            writer.write_relations(np.array([relation[0] for relation in self.relations]),
+                                   np.array([member for relation in self.relations for member in relation[1]]),
+                                   ['way'] * sum(len(relation[1]) for relation in self.relations),
+                                   ['outer', 'inner'] * len(self.relations),
+                                   np.array([len(relation[1]) for relation in self.relations]),
+                                   [relation[2] for relation in self.relations])
+
+@pytest.fixture
+def conflated(tmp_path):
+    courtyard = (square(X + 0.0006, Y, 3 * D), square(X + 0.0007, Y + D)[::-1])
+    dump = [
+        (1, square(X, Y)),                         # matched
+        (2, square(X + 0.0002, Y)),                # overlapping: the OSM one is shifted
+        (3, square(X + 0.0004, Y)),                # new: only a non building overlaps it
+        (4, None),                                 # no geometry
+        (5, courtyard),                            # matched by a multipolygon relation
+    ]
+    folderpath = tmp_path / 'dump'
+    folderpath.mkdir()
+    lines = [{'type': 'Feature', 'properties': {'objectid': oid},
+              'geometry': None if rings is None else {'type': 'Polygon', 'coordinates': list(rings) if oid == 5 else [rings]}}
+             for oid, rings in dump]
+    (folderpath / 'buildings_chunk_0.geojsonl').write_text(''.join(json.dumps(line) + '\n' for line in lines), encoding='utf-8')
+
+    osm = OsmExtract()
+    osm.way(square(X, Y), {'building': 'yes'})
+    osm.way(square(X + 0.0002 + 0.6 * D, Y), {'building': 'house'})
+    osm.way(square(X + 0.0004, Y), {'landuse': 'grass'})
+    osm.relation(*courtyard, {'type': 'multipolygon', 'building': 'school'})
+    osm.way(square(X + 0.0003, Y + 2 * D), {'building': 'shed'})     # among the dumped ones, overlapping none
+    osm.way(square(X + 0.1, Y + 0.1), {'building': 'yes'})           # far from the dump
+    osm.write(str(tmp_path / 'extract.osm.pbf'))
+
+    summary = conflate(str(folderpath), str(tmp_path / 'extract.osm.pbf'), str(tmp_path / 'out'), max_workers=1)
+
+    with open(tmp_path / 'out' / 'buildings_conflation.jsonl', encoding='utf-8') as f:
+        rows = {row['objectid']: row for row in map(json.loads, f)}
+    with open(tmp_path / 'out' / 'buildings_osm_only.geojsonl', encoding='utf-8') as f:
+        osm_only = [json.loads(line) for line in f]
+
+    return summary, rows, osm_only
+
+def test_categories(conflated):
+    summary, rows, _ = conflated
+
+    # the far away building is out of the extent of the dump
+    assert summary['n_dumped'] == 5 and summary['n_osm'] == 4
+    assert (summary['n_matched'], summary['n_overlapping'], summary['n_new'], summary['n_no_geometry']) == (2, 1, 1, 1)
+
+    assert {oid: row['category'] for oid, row in rows.items()} == {1: 'matched', 2: 'overlapping', 3: 'new', 4: 'no_geometry', 5: 'matched'}
+    assert (rows[1]['osm_type'], rows[1]['osm_id'], rows[1]['iou']) == ('way', 100, 1.0)
+    assert rows[2]['osm_id'] == 101 and 0 < rows[2]['iou'] < 0.5
+    assert rows[5]['osm_type'] == 'relation'
+
+def test_osm_only(conflated):
+    summary, _, osm_only = conflated
+
+    assert summary['n_osm_only'] == 1
+    assert [(feature['properties']['osm_id'], feature['properties']['building']) for feature in osm_only] == [(105, 'shed')]
@@ -0,0 +1,28 @@
+from lib.paging import FetchProfile
+from profiler import ColumnProfile
+
+def profile(values, **kwargs):
+    column = ColumnProfile(**kwargs)
+    for value in values:
+        column.add(value)
+    return column
+
+def test_only_exact_single_valued_columns_are_constants():
+    columns = {
+        'always_null': profile([None] * 100),
+        'always_one': profile([1] * 100),
+        'sometimes_null': profile([None] * 50 + [1] * 50),
+        # past max_distinct, Misra-Gries keeps the dominant value alone
+        'pruned': profile(['common'] * 1000 + [f'rare_{i}' for i in range(50)], max_distinct=10, top_k=1),
+    }
+    unique_values = {field: column.distinct_values() for field, column in columns.items()}
+    summaries = {field: column.summary() for field, column in columns.items()}
+
+    assert unique_values['pruned'] == ['common']
+    assert not summaries['pruned']['exact'] and summaries['pruned']['distinct_estimate'] > 1
+
+    fetch_profile = FetchProfile.from_unique_values(unique_values, summaries)
+    assert fetch_profile.constants == {'always_null': None, 'always_one': 1}
+
+    # without column profiles, nothing is left out of the requests
+    assert FetchProfile.from_unique_values(unique_values, {}).constants == {}
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from geometry_prep import prepare_geometries
+
+X, Y, D = -49.27, -25.43, 0.0001
+
+def square(x, d=D):
+    return [[x, Y], [x + d, Y], [x + d, Y + d], [x, Y + d], [x, Y]]
+
+def feature(oid, geometry_type='Polygon', coordinates=None):
+    properties = {} if oid is ... else {'objectid': oid}
+    geometry = None if coordinates is None else {'type': geometry_type, 'coordinates': coordinates}
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+FEATURES = [
+    feature(1, coordinates=[square(X)]),
+    # bowtie
+    feature(2, coordinates=[[[X + 0.001, Y], [X + 0.001 + D, Y + D], [X + 0.001 + D, Y], [X + 0.001, Y + D], [X + 0.001, Y]]]),
+    # repeated vertex
+    feature(3, coordinates=[[[X + 0.002, Y], [X + 0.002 + D, Y], [X + 0.002 + D, Y], [X + 0.002 + D, Y + D], [X + 0.002, Y + D], [X + 0.002, Y]]]),
+    # a square and a triangle under a centimetre wide
+    feature(4, 'MultiPolygon', [[square(X + 0.003)], [[[X + 0.0032, Y], [X + 0.0035, Y], [X + 0.00335, Y + 1.5e-7], [X + 0.0032, Y]]]]),
+    feature(5),
+    feature(None, coordinates=[square(X + 0.004)]),
+    # two near-duplicate pairs, each with a feature without objectid
+    feature(6, coordinates=[square(X + 0.005)]),
+    feature(None, coordinates=[square(X + 0.005, D * 1.01)]),
+    feature(7, coordinates=[square(X + 0.006)]),
+    feature(..., coordinates=[square(X + 0.006, D * 1.01)]),
+]
+
+@pytest.fixture
+def prepared(tmp_path):
+    input_path = tmp_path / 'buildings_chunk_0.geojsonl'
+    input_path.write_text(''.join(json.dumps(feature) + '\n' for feature in FEATURES), encoding='utf-8')
+
+    report = prepare_geometries(str(input_path), str(tmp_path / 'prepared'), max_workers=1)
+
+    with open(tmp_path / 'prepared' / 'buildings_geometry_issues.jsonl', encoding='utf-8') as f:
+        issues = [json.loads(line) for line in f]
+    with open(tmp_path / 'prepared' / 'buildings_chunk_0.geojsonl', encoding='utf-8') as f:
+        output = [json.loads(line) for line in f]
+
+    return report, issues, output
+
+def test_issues_are_counted(prepared):
+    report, _, output = prepared
+
+    assert len(output) == report['n_features'] == len(FEATURES)
+    assert report['n_no_oid'] == 3
+    assert report['n_invalid'] == 1 and report['invalid_reasons'] == {'Self-intersection': 1}
+    assert report['n_duplicate_vertices'] == 1
+    assert report['n_sliver'] == 1
+    assert report['n_no_geometry'] == 1
+    assert report['n_near_duplicate_pairs'] == 2
+
+def test_issues_are_listed_per_feature(prepared):
+    _, issues, output = prepared
+
+    by_oid = {line['objectid']: line for line in issues if line['objectid'] is not None}
+    assert by_oid[2]['issues'] == ['invalid']
+    assert by_oid[3]['issues'] == ['duplicate_vertices']
+    assert by_oid[4]['issues'] == ['sliver']
+    assert by_oid[5]['issues'] == ['no_geometry']
+
+    # the features without objectid don't pair up with each other
+    assert by_oid[6]['near_duplicates'] == [] and by_oid[7]['near_duplicates'] == []
+    assert sorted(line['near_duplicates'] for line in issues if line['objectid'] is None) == [[6], [7]]
+
+    assert output[3]['geometry']['type'] == 'Polygon'
+    assert output[4]['geometry'] is None
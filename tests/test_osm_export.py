@@ -0,0 +1,67 @@
+import json
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+import shapely
+
+from osm_export import export_osm
+from osm_pbf import read_osm_areas
+
+X, Y, D = -49.27, -25.43, 0.0001
+
+def square(x, y, d=D):
+    return [[x, y], [x + d, y], [x + d, y + d], [x, y + d], [x, y]]
+
+FEATURES = [
+    # two buildings sharing a wall, in different blocks
+    {'objectid': 1, 'ctba_classe_edgv': 'ED_EDIF_ENSINO', 'geometry': {'type': 'Polygon', 'coordinates': [square(X, Y)]}},
+    {'objectid': 2, 'geometry': {'type': 'Polygon', 'coordinates': [square(X + D, Y)]}},
+    # a courtyard: a multipolygon relation
+    {'objectid': 3, 'geometry': {'type': 'Polygon', 'coordinates': [square(X, Y + 0.001, 3 * D), square(X + D, Y + 0.001 + D)[::-1]]}},
+    {'objectid': 4, 'geometry': None},
+]
+
+@pytest.fixture
+def input_path(tmp_path):
+    path = tmp_path / 'buildings_chunk_0.geojsonl'
+    lines = [{'type': 'Feature', 'geometry': feature['geometry'],
+              'properties': {key: value for key, value in feature.items() if key != 'geometry'}} for feature in FEATURES]
+    path.write_text(''.join(json.dumps(line) + '\n' for line in lines), encoding='utf-8')
+    return str(path)
+
+def test_pbf_round_trip(input_path, tmp_path):
+    summary = export_osm(input_path, str(tmp_path / 'buildings.osm.pbf'), block_size=1)
+
+    assert summary['n_exported'] == 3 and summary['n_no_geometry'] == 1
+    assert summary['n_shared_nodes'] == 2
+    assert summary['n_nodes'] == 4 + 2 + 8
+    assert summary['n_ways'] == 4 and summary['n_relations'] == 1
+
+    areas = read_osm_areas(str(tmp_path / 'buildings.osm.pbf'), max_workers=1)
+    assert sorted(areas['osm_type'].tolist()) == ['relation', 'way', 'way']
+    assert sorted(tags['building'] for tags in areas['tags']) == ['school', 'yes', 'yes']
+
+    expected = sorted(shapely.area(shapely.from_geojson([json.dumps(feature['geometry']) for feature in FEATURES[:3]])))
+    assert np.allclose(sorted(shapely.area(areas['geometry'])), expected, rtol=1e-3)
+
+def test_osmchange_is_well_formed(input_path, tmp_path):
+    export_osm(input_path, str(tmp_path / 'buildings.osc'), block_size=1)
+
+    root = ET.parse(tmp_path / 'buildings.osc').getroot()
+    assert root.tag == 'osmChange' and [child.tag for child in root] == ['create']
+
+    create = root.find('create')
+    nodes = {node.get('id'): (node.get('lon'), node.get('lat')) for node in create.iter('node')}
+    ways = {way.get('id'): [nd.get('ref') for nd in way.iter('nd')] for way in create.iter('way')}
+
+    # one node per location, referenced by both buildings of the shared wall
+    assert len(set(nodes.values())) == len(nodes)
+    assert all(ref in nodes for refs in ways.values() for ref in refs)
+    assert all(refs[0] == refs[-1] for refs in ways.values())
+    tagged = [set(refs) for way, refs in ways.items() if create.find(f"way[@id='{way}']/tag[@k='building']") is not None]
+    assert len(tagged) == 2 and len(tagged[0] & tagged[1]) == 2
+
+    for relation in create.iter('relation'):
+        assert all(member.get('ref') in ways for member in relation.iter('member'))
+        assert {member.get('role') for member in relation.iter('member')} == {'outer', 'inner'}
@@ -0,0 +1,110 @@
+import json
+import re
+
+import pytest
+from esridump.errors import EsriDownloadError
+
+from fake_arcgis import FakeLayer
+from lib.chunks import ChunkManifest
+from lib.compression import iter_chunk_lines
+from lib.dumpers import geojsonl_parallel_dumper
+
+RANGE_WHERE = re.compile(r'objectid BETWEEN (\d+) AND (\d+)')
+
+def query_range(query):
+    match = RANGE_WHERE.search(query.get('where') or '')
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def read_dump(folderpath):
+    manifest = ChunkManifest(f'{folderpath}/buildings_ranges_manifest.jsonl')
+    oids = [json.loads(line)['properties']['objectid']
+            for entry in manifest.entries for line in iter_chunk_lines(manifest.chunk_path(entry))]
+    return manifest, oids
+
+def assert_ranges_cover(manifest, layer):
+    ranges = sorted(tuple(entry['oid_range']) for entry in manifest.entries)
+
+    assert ranges[0][0] == layer.oids.min()
+    assert ranges[-1][1] == layer.oids.max()
+    for (_, last), (first, _) in zip(ranges, ranges[1:]):
+        assert first == last + 1
+
+def test_ranges_are_disjoint_and_cover_every_objectid(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100)
+    fake_server(layer)
+
+    geojsonl_parallel_dumper('buildings', outfolderpath=str(tmp_path), chunksize=200, max_workers=4, page_size=100)
+
+    manifest, oids = read_dump(tmp_path)
+    assert_ranges_cover(manifest, layer)
+    assert sorted(oids) == layer.oids.tolist()
+    assert manifest.verify() == []
+
+def test_interrupted_run_resumes_the_missing_ranges(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100)
+    fake_server(layer)
+
+    # the ranges starting after objectid 1000 fail for good in the first run
+    layer.faults = lambda query: 400 if (query_range(query) or (0, 0))[0] > 1000 else None
+
+    with pytest.raises(EsriDownloadError):
+        geojsonl_parallel_dumper('buildings', outfolderpath=str(tmp_path), chunksize=200, max_workers=4, page_size=100, range_attempts=1)
+
+    first_manifest, first_oids = read_dump(tmp_path)
+    done = {tuple(entry['oid_range']) for entry in first_manifest.entries}
+    assert done and all(first <= 1000 for first, _ in done)
+
+    requested = set()
+
+    def spy(query):
+        if query_range(query):
+            requested.add(query_range(query))
+
+    layer.faults = spy
+    geojsonl_parallel_dumper('buildings', outfolderpath=str(tmp_path), chunksize=200, max_workers=4, page_size=100)
+
+    manifest, oids = read_dump(tmp_path)
+    assert requested and not requested & done
+    assert all(first > 1000 for first, _ in requested)
+    assert_ranges_cover(manifest, layer)
+    assert sorted(oids) == layer.oids.tolist()
+    assert len(oids) == len(set(oids))
+
+def test_striped_dump_uses_both_servers(fake_server, tmp_path):
+    main = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100, latency=0.005)
+    alt = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100, latency=0.005)
+    fake_server(main, alt)
+
+    stats = geojsonl_parallel_dumper('buildings', outfolderpath=str(tmp_path), chunksize=100, max_workers=4, page_size=100, striped=True)
+
+    manifest, oids = read_dump(tmp_path)
+    assert set(stats) == {'main', 'alt'}
+    assert {entry['server'] for entry in manifest.entries} == {'main', 'alt'}
+    assert_ranges_cover(manifest, main)
+    assert sorted(oids) == main.oids.tolist()
+
+def test_striped_dump_fails_over_to_the_other_server(fake_server, tmp_path):
+    main = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100)
+    alt = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100)
+    fake_server(main, alt)
+
+    # the alternative server answers the equivalence check, but fails every range
+    alt.faults = lambda query: 503 if query_range(query) else None
+
+    stats = geojsonl_parallel_dumper('buildings', outfolderpath=str(tmp_path), chunksize=200, max_workers=4, page_size=100, striped=True)
+
+    manifest, oids = read_dump(tmp_path)
+    assert stats['alt']['n_failures'] > 0
+    assert {entry['server'] for entry in manifest.entries} == {'main'}
+    assert sorted(oids) == main.oids.tolist()
+
+def test_striped_dump_falls_back_when_the_servers_differ(fake_server, tmp_path):
+    main = FakeLayer(n_features=1500, gap_rate=0.3, max_record_count=100)
+    alt = FakeLayer(n_features=1200, gap_rate=0.3, max_record_count=100)
+    fake_server(main, alt)
+
+    stats = geojsonl_parallel_dumper('buildings', outfolderpath=str(tmp_path), chunksize=200, max_workers=4, page_size=100, striped=True)
+
+    manifest, oids = read_dump(tmp_path)
+    assert set(stats) == {'main'}
+    assert sorted(oids) == main.oids.tolist()
@@ -0,0 +1,44 @@
+import json
+import re
+
+import numpy as np
+
+from fake_arcgis import FakeLayer
+from sync import incremental_sync
+
+IN_LIST = re.compile(r'objectid IN \(([^)]*)\)')
+
+def read_changeset(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_sync_pages_the_listing_and_the_changed_features(fake_server, tmp_path):
+    layer = FakeLayer(n_features=800, gap_rate=0.1, max_record_count=100)
+    fake_server(layer)
+
+    queries = []
+    layer.faults = lambda query: queries.append(query)
+
+    summary = incremental_sync('buildings', outfolderpath=str(tmp_path), page_size=100, ids_per_request=150)
+    assert summary['create'] == 800
+
+    changes = read_changeset(summary['changeset'])
+    assert sorted(change['objectid'] for change in changes) == layer.oids.tolist()
+    assert all(change['feature']['geometry'] for change in changes)
+
+    # pages only: no count or objectid list queries
+    assert not any(query.get('returnCountOnly') or query.get('returnIdsOnly') for query in queries)
+    # each batch of ids is paged by the pager, within the server's maxRecordCount
+    batches = {IN_LIST.search(query['where']).group(1) for query in queries if IN_LIST.search(query.get('where') or '')}
+    assert len(batches) == int(np.ceil(800 / 150))
+
+    # one changed, one deleted feature
+    changed_oid = int(layer.oids[10])
+    layer.attributes[10] = {**layer.attributes[10], 'nome': 'changed'}
+    deleted_oid = int(layer.oids[-1])
+    layer.oids = layer.oids[:-1]
+
+    summary = incremental_sync('buildings', outfolderpath=str(tmp_path), page_size=100, ids_per_request=150)
+    changes = {change['objectid']: change['action'] for change in read_changeset(summary['changeset'])}
+
+    assert changes == {changed_oid: 'modify', deleted_oid: 'delete'}
@@ -0,0 +1,43 @@
+import json
+
+from fake_arcgis import FakeLayer
+from lib.chunks import ChunkManifest
+from lib.compression import iter_chunk_lines
+from tiles import tiled_dumper
+
+def read_tiles(folderpath):
+    manifest = ChunkManifest(f'{folderpath}/buildings_tiles_manifest.jsonl')
+    oids = [json.loads(line)['properties']['objectid']
+            for entry in manifest.entries if entry['n_features'] for line in iter_chunk_lines(manifest.chunk_path(entry))]
+    return manifest, oids
+
+def test_tiles_are_paged_without_extra_requests(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1000, gap_rate=0.1, max_record_count=100)
+    fake_server(layer)
+
+    queries = []
+    layer.faults = lambda query: queries.append(query)
+
+    tiled_dumper('buildings', outfolderpath=str(tmp_path), zoom=12, max_workers=4, page_size=100)
+
+    manifest, oids = read_tiles(tmp_path)
+    assert sorted(oids) == layer.oids.tolist()
+
+    # envelope pages only: no count, objectid list or statistics query per tile
+    assert all(query.get('geometry') and query.get('orderByFields') for query in queries)
+    assert len({query['geometry'] for query in queries}) == len(manifest.entries)
+
+def test_refresh_with_another_compression_replaces_the_tile_entries(fake_server, tmp_path):
+    layer = FakeLayer(n_features=1000, gap_rate=0.1, max_record_count=100)
+    fake_server(layer)
+
+    tiled_dumper('buildings', outfolderpath=str(tmp_path), zoom=12, page_size=100)
+    first, _ = read_tiles(tmp_path)
+
+    tiled_dumper('buildings', outfolderpath=str(tmp_path), zoom=12, page_size=100, refresh=True, compression='gzip')
+    manifest, oids = read_tiles(tmp_path)
+
+    assert len(manifest.entries) == len(first.entries)
+    assert all(entry['filename'].endswith('.gz') for entry in manifest.entries if entry['n_features'])
+    assert manifest.verify() == []
+    assert sorted(oids) == layer.oids.tolist()
@@ -0,0 +1,278 @@
+from lib import *
+
+from pyproj import Transformer
+
+from lib.compression import CHUNK_EXTENSIONS, chunk_extension, strip_chunk_extension, serialize_feature
+
+def lonlat_to_tile(lon, lat, zoom=ZOOM_LEVEL):
+    """
+    Finds the slippy-map tile that contains a point.
+
+    Args:
+        lon (float): The longitude of the point.
+        lat (float): The latitude of the point.
+        zoom (int, optional): The zoom level. Defaults to ZOOM_LEVEL.
+
+    Returns:
+        tuple: The (x, y) tile numbers.
+    """
+    n = 2 ** zoom
+    lat_rad = math.radians(lat)
+
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+
+    # points exactly on the antimeridian or the poles belong to the last tile
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def lonlat_to_tiles(lon, lat, zoom=ZOOM_LEVEL):
+    """
+    Vectorized `lonlat_to_tile`.
+
+    Args:
+        lon (np.ndarray): The longitudes of the points.
+        lat (np.ndarray): The latitudes of the points.
+        zoom (int, optional): The zoom level. Defaults to ZOOM_LEVEL.
+
+    Returns:
+        tuple: The x and y tile numbers, as int64 arrays.
+    """
+    n = 2 ** zoom
+    lat_rad = np.radians(lat)
+
+    x = ((np.asarray(lon) + 180.0) / 360.0 * n).astype(np.int64)
+    y = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+
+    return np.clip(x, 0, n - 1), np.clip(y, 0, n - 1)
+
+def tile_bounds(x, y, zoom=ZOOM_LEVEL):
+    """
+    Computes the longitude/latitude bounds of a slippy-map tile.
+
+    Args:
+        x (int): The tile column.
+        y (int): The tile row.
+        zoom (int, optional): The zoom level. Defaults to ZOOM_LEVEL.
+
+    Returns:
+        tuple: The (xmin, ymin, xmax, ymax) bounds, in degrees.
+    """
+    n = 2 ** zoom
+
+    def tile_lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return x / n * 360.0 - 180.0, tile_lat(y + 1), (x + 1) / n * 360.0 - 180.0, tile_lat(y)
+
+def tiles_in_bbox(bbox, zoom=ZOOM_LEVEL):
+    """
+    Lists the slippy-map tiles that cover a bounding box.
+
+    Args:
+        bbox (tuple): The (xmin, ymin, xmax, ymax) bounding box, in longitude/latitude.
+        zoom (int, optional): The zoom level. Defaults to ZOOM_LEVEL.
+
+    Returns:
+        list: A list of (x, y) tiles, row by row.
+    """
+    xmin, ymin, xmax, ymax = bbox
+
+    x0, y0 = lonlat_to_tile(xmin, ymax, zoom)
+    x1, y1 = lonlat_to_tile(xmax, ymin, zoom)
+
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+def layer_extent_lonlat(layer_metadata):
+    """
+    Gets the extent of a layer from its metadata, in longitude/latitude.
+
+    Args:
+        layer_metadata (dict): The layer's metadata.
+
+    Returns:
+        tuple: The (xmin, ymin, xmax, ymax) extent, in degrees.
+    """
+    extent = layer_metadata['extent']
+    spatial_reference = extent.get('spatialReference', {})
+    wkid = spatial_reference.get('latestWkid') or spatial_reference.get('wkid') or 4326
+
+    bounds = (extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax'])
+
+    if int(wkid) == 4326:
+        return bounds
+
+    transformer = Transformer.from_crs(f'EPSG:{wkid}', OSM_CRS, always_xy=True)
+    return transformer.transform_bounds(*bounds)
+
+def first_vertex(geometry):
+    """
+    Gets the first coordinate pair of a GeoJSON geometry, whatever its type.
+
+    Args:
+        geometry (dict): A GeoJSON geometry.
+
+    Returns:
+        tuple: The (x, y) of the first vertex, or None for empty geometries.
+    """
+    if not geometry:
+        return None
+
+    coords = geometry.get('coordinates')
+
+    while isinstance(coords, list) and coords and isinstance(coords[0], list):
+        coords = coords[0]
+
+    if not coords:
+        return None
+
+    return coords[0], coords[1]
+
+@instrumented_dumper
+def tiled_dumper(layername, use_alt=False, outfolderpath=None, zoom=ZOOM_LEVEL, bbox=None, max_workers=4, page_size=100, refresh=False, timeout=None, compression=None, precision=None):
+    """
+    Dumps the features of a layer tile by tile, one GeoJSONL file per slippy-map tile.
+
+    The tiles at `zoom` covering the layer extent (or `bbox`) are queried concurrently, each
+    one paged with an envelope filter by a CheckpointedPager; the layer metadata is requested
+    once for all of them. A feature crossing tile borders
+    is returned by every tile it touches, so it is kept only by the tile that contains its
+    first vertex; this way each objectid ends up in a single tile file, no matter which tiles
+    are (re)downloaded together. Finished tiles, empty ones included, are recorded in a
+    tile-keyed manifest ('<layername>_tiles_manifest.jsonl'), so reruns skip them; a refreshed
+    tile replaces the entry of its tile, whatever the compression it was written with.
+
+    Args:
+        layername (str): The name of the layer to dump.
+        use_alt (bool, optional): Whether to use the alternative map server URL.
+                                  Defaults to False.
+        outfolderpath (str, optional): The directory to save the output files.
+                                       Defaults to None.
+        zoom (int, optional): The zoom level of the tiles. Defaults to ZOOM_LEVEL.
+        bbox (tuple, optional): A (xmin, ymin, xmax, ymax) longitude/latitude box to restrict
+                                the dump to, e.g. one neighbourhood. Defaults to None (the
+                                whole layer extent).
+        max_workers (int, optional): The maximum number of tiles being fetched at the same
+                                     time. Defaults to 4.
+        page_size (int, optional): The number of features to request per page from
+                                   the server. Defaults to 100.
+        refresh (bool, optional): Whether to download again tiles that are already in the
+                                  manifest. Defaults to False.
+        timeout (int, optional): The timeout for the HTTP requests. Defaults to None.
+        compression (str, optional): Compress the tiles with 'gzip' or 'zstd'. Defaults to None
+                                     (plain text).
+        precision (int, optional): Round the coordinates to this many decimals before writing
+                                   them. Defaults to None (as received).
+
+    Returns:
+        int: The number of features written in this run.
+
+    Raises:
+        ValueError: If layername is empty or outfolderpath is None.
+        EsriDownloadError: If any tile could not be downloaded; the completed ones are kept.
+    """
+    if not layername:
+        raise ValueError("layername cannot be empty")
+
+    if outfolderpath is None:
+        raise ValueError("outfolderpath cannot be None")
+
+    create_dir(outfolderpath)
+
+    def tile_outpath(x, y):
+        return os.path.join(outfolderpath, f'{layername}_tile_{zoom}_{x}_{y}{chunk_extension(compression)}')
+
+    # one dumper for all the tiles: only its URL and query arguments are used by the pagers
+    d = EsriDumper(get_layer_url(layername, use_alt=use_alt), timeout=timeout)
+    layer_metadata = d.get_metadata()
+    oid_field = d._find_oid_field_name(layer_metadata) or 'objectid'
+
+    dump_json(layer_metadata, os.path.join(outfolderpath, f'{layername}_metadata.json'))
+
+    manifest = ChunkManifest(os.path.join(outfolderpath, f'{layername}_tiles_manifest.jsonl'))
+    # tiles written with another compression are done too
+    registered = {strip_chunk_extension(filename) for filename in manifest.filenames}
+
+    tiles = tiles_in_bbox(bbox or layer_extent_lonlat(layer_metadata), zoom)
+
+    if not refresh:
+        tiles = [tile for tile in tiles if strip_chunk_extension(os.path.basename(tile_outpath(*tile))) not in registered]
+
+    logging.info(f"{layername}: {len(tiles)} tiles to download at zoom {zoom}")
+
+    manifest_lock = threading.Lock()
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=10, max=120) + wait_random(min=1, max=12), reraise=True)
+    def dump_tile(x, y):
+        xmin, ymin, xmax, ymax = tile_bounds(x, y, zoom)
+
+        query_args = {
+            'geometry': json.dumps({'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax}),
+            'geometryType': 'esriGeometryEnvelope',
+            'inSR': '4326',
+            'spatialRel': 'esriSpatialRelIntersects',
+        }
+
+        pager = CheckpointedPager(d, oid_field, layer_metadata, page_size=page_size, query_args=query_args)
+
+        writer = ChunkWriter(tile_outpath(x, y))
+        seen = set()
+
+        with writer:
+            for feature in pager:
+                oid = feature['properties'].get(oid_field)
+
+                if oid in seen:
+                    continue
+
+                vertex = first_vertex(feature.get('geometry'))
+
+                # the feature belongs to another tile:
+                if vertex and lonlat_to_tile(*vertex, zoom) != (x, y):
+                    continue
+
+                seen.add(oid)
+                with timed_stage('serialize'):
+                    line = serialize_feature(feature, precision)
+                writer.write(line)
+                count_metric('features')
+
+            if not writer.n_lines:
+                writer.abort()
+
+                # a refreshed tile that became empty:
+                if os.path.exists(writer.filepath):
+                    os.remove(writer.filepath)
+
+        # a refreshed tile previously written with another compression
+        for extension in CHUNK_EXTENSIONS:
+            stale_path = os.path.join(outfolderpath, f'{layername}_tile_{zoom}_{x}_{y}{extension}')
+            if stale_path != writer.filepath and os.path.exists(stale_path):
+                os.remove(stale_path)
+
+        oids = [oid for oid in seen if oid is not None]
+
+        with manifest_lock:
+            manifest.add(manifest.next_index, writer.filepath, (min(oids, default=None), max(oids, default=None)),
+                         writer.n_lines, writer.n_bytes, writer.sha256, key=f'tile_{zoom}_{x}_{y}', tile=[zoom, x, y])
+
+        return writer.n_lines
+
+    failed = []
+    n_feats = 0
+    dump_tile = with_current_metrics(dump_tile)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(dump_tile, *tile): tile for tile in tiles}
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            x, y = futures[future]
+            try:
+                n_feats += future.result()
+            except Exception as e:
+                logging.error(f"Tile {zoom}/{x}/{y} of {layername} failed: {e}")
+                failed.append((x, y))
+
+    if failed:
+        raise EsriDownloadError(f"{len(failed)} of {len(tiles)} tiles of {layername} failed, rerun to resume: {sorted(failed)}")
+
+    return n_feats